@@ -1,5 +1,7 @@
 import flask
-from flask import Flask, request, jsonify, render_template_string, make_response
+from flask import Blueprint, Flask, current_app, request, jsonify, make_response, g, has_app_context, has_request_context
+import jinja2
+from werkzeug.datastructures import Headers
 import re
 import json
 import time
@@ -9,26 +11,60 @@ import string
 import base64
 import logging
 import datetime
+import heapq
+import itertools
+import queue
+from collections import OrderedDict, deque
+import gc
+import hmac
+import ipaddress
+import marshal
+import math
+import os
+import secrets
+import select
+import signal
+import socket
+import threading
+import types
+import urllib.parse
+import mmap
+import struct
+import sys
+import tracemalloc
+import multiprocessing
 from functools import wraps
-from user_agents import parse
+from ip_reputation import IPReputationDB
+from sketches import CountMinSketch, HyperLogLog, SpaceSaving
+from request_timing import RequestTimingTracker
 
-# Initialize Flask app
-app = Flask(__name__)
+# Routes are registered on blueprints; create_app() and setup_protection()
+# attach them to an app, and the module-level ``app`` is built on first use
+protection_blueprint = Blueprint('protection', __name__)
+demo_blueprint = Blueprint('demo', __name__)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Store detected bots
-detected_bots = {}
-
 # Configuration settings - customize these based on your needs
 config = {
     'threshold_score': 60,  # Score threshold to consider a visitor a bot (0-100)
     'block_threshold': 85,  # Score threshold to block the request completely
     'token_validity': 1800,  # Token validity in seconds (30 minutes)
+    'token_validity_jitter': 0.2,  # Fraction shaved off at random so tokens issued together expire apart
+    'token_max_lifetime': 86400,  # Seconds a session can keep renewing before a full check is required
+    'token_secret': None,    # Key for signing tokens (random per start if None; set to share across hosts)
     'fingerprint_validity': 86400,  # Fingerprint validity in seconds (24 hours)
-    'challenge_difficulty': 2,  # JavaScript challenge difficulty (1-3)
+    'challenge_difficulty': 2,  # Challenge difficulty for unknown clients (1-3 math, 4+ proof of work)
+    'challenge_max_difficulty': 8,  # Hardest challenge the scheduler hands out
+    'pow_base_bits': 12,     # Leading zero bits required at difficulty 4; each level above adds 2
+    'difficulty_rate_limit': 20,  # Requests per minute from a fingerprint or IP above which its difficulty climbs
+    'difficulty_prefix_rate_limit': 200,  # The same for a whole network prefix, which many clients can share
+    'difficulty_max_clients': 100000,  # Fingerprints, IPs and prefixes tracked by the difficulty scheduler
+    'challenge_coalesce_window': 30,  # Seconds a fingerprint gets its existing challenge back
+    'embed_challenge': True,  # Embed a signed challenge in /bot-protection.js (saves one round trip)
+    'preset_challenge_validity': 300,  # Seconds an embedded challenge can be answered
     'honeypot_fields': ['email_confirm', 'phone_alt', 'username_2'],  # Hidden form fields
     'rate_limits': {
         'default': 60,       # Requests per minute for regular users
@@ -38,6 +74,7 @@ config = {
     },
     'ip_whitelist': [],      # IPs to whitelist completely
     'ip_blacklist': [],      # IPs to block completely
+    'ip_reputation_db': None,  # Path to a database compiled with ip_reputation.py
     'user_agent_blacklist': [
         'PhantomJS', 'HeadlessChrome', 'Headless', 'Playwright', 
         'Selenium', 'webdriver', 'puppeteer', 'cypress', 'Scrapy', 
@@ -49,15 +86,731 @@ config = {
     ],
     'track_mouse': True,     # Track mouse movements as bot detection signal
     'track_scroll': True,    # Track scroll behavior as bot detection signal
+    'compact_wire_format': True,  # Offer clients the binary /bot-detection/check encoding
     'obfuscate_selectors': True,  # Randomize CSS selectors to break scrapers
+    'admin_api_key': None,   # Required in X-Admin-Key for /admin/* routes (None = read-only routes open, others refused)
+    'revocation_capacity': 100000,  # Expected revocations per token validity window
+    'revocation_error_rate': 0.001,  # Target false-positive rate of the revocation filter
+    'revocation_buckets': 4,  # Time buckets the token validity window is split into
+    'spent_challenge_capacity': 100000,  # Expected proofs of work solved per challenge validity window
+    'spent_challenge_error_rate': 0.000001,  # Chance a fresh proof of work is mistaken for a replay
+    'score_weights': {},      # Optional per-stage multipliers, e.g. {'behavior': 0.5}
+    'shadow_configs': {},    # Candidate configs scored off the request path, e.g. {'strict': {'threshold_score': 50}}
+    'shadow_queue_size': 10000,  # Pending shadow evaluations before new ones are dropped
+    'shadow_workers': 2,     # Threads scoring shadow evaluations
+    'token_cache_size': 100000,  # Verified tokens kept in the per-process LRU cache
+    'store_shards': 16,      # Lock shards per in-memory store (coalesced challenges, detections)
+    'challenge_ttl': 300,    # Seconds before an unanswered challenge is discarded
+    'detection_retention': 86400,  # Seconds detections for an IP are kept after the last one
+    'detections_per_ip': 100,  # Most recent detections kept per IP; older ones are dropped
+    'janitor_interval': 1.0,  # Seconds between expiry passes
+    'janitor_budget_ms': 5,  # Maximum CPU time per expiry pass
+    'janitor_batch': 256,    # Entries expired per batch within a pass
+    'janitor_granularity': 1.0,  # Width in seconds of the expiry index buckets
+    'shed_degraded_inflight': 64,  # In-flight checks at which scoring drops to cheap checks only
+    'shed_reject_inflight': 256,  # In-flight checks at which new ones are rejected with 503
+    'shed_recovery_ratio': 0.5,  # Fraction of a watermark load must fall below to step back down
+    'shed_retry_after': 5,   # Retry-After seconds sent with 503 responses
+    'sketch_width': 2048,    # Count-Min counters per row
+    'sketch_depth': 4,       # Count-Min rows
+    'sketch_precision': 14,  # HyperLogLog precision for global distinct counts
+    'sketch_key_precision': 8,  # HyperLogLog precision for per-key distinct counts
+    'sketch_top_k': 100,     # Keys tracked by each top-K summary
+    'timing_max_clients': 1000000,  # Fingerprints, IPs and prefixes tracked for request timing (LRU beyond this)
+    'timing_ewma_alpha': 0.3,  # Smoothing factor of the inter-arrival EWMA
+    'timing_min_samples': 5,  # Intervals needed before timing affects the score
+    'timing_min_interval': 1.0,  # Average seconds between requests below which a client is suspicious
+    'timing_regularity_cv': 0.1,  # Interval variation below which timing looks machine-generated
+    'detection_log_rates': {'ip': 10, 'user_agent': 100},  # Detections logged per key per interval before sampling
+    'detection_log_interval': 60,  # Seconds per logging window; suppressed counts are summarized after each
+    'detection_log_sample_rate': 0.01,  # Fraction of detections over the rate that are still logged
+    'detection_log_max_keys': 10000,  # Keys tracked by the log sampler (least recently seen are dropped)
+    'detection_stream_buffer': 1024,  # Events kept for /admin/detections/stream; subscribers further behind are dropped
+    'detection_stream_max_subscribers': 8,  # Concurrent stream connections per worker
+    'detection_stream_heartbeat': 15,  # Seconds between keep-alive comments on idle streams
+    'memory_sample_interval': 10,  # Seconds between memory samples of the in-process state
+    'memory_sample_entries': 32,  # Entries sized per store and sample to estimate bytes per entry
+    'memory_history': 360,   # Samples kept for growth rates (an hour at the default interval)
+    'memory_budgets': {},    # Byte budgets per store, e.g. {'detected_bots': 256 * 1024 * 1024}; crossing one counts an alert
+    'memory_tracemalloc': 0,  # Frames per traceback to trace with tracemalloc (0 = off; costly)
+    'snapshot_dir': None,    # Directory for state snapshots restored on restart (None = off)
+    'snapshot_interval': 30,  # Seconds between snapshots of the shards written since the last one
+    'tenants': {},           # Sites served by this deployment, e.g. {'shop': {'hosts': ['shop.example.com'], 'api_keys': [...], 'settings': {'threshold_score': 50}}}
 }
 
+class ExpiryIndex:
+    """Keys grouped into fixed-width time buckets by expiry, oldest bucket first.
+
+    Adding a key is O(1) amortized and draining due keys is proportional to
+    the number drained, so expiry can be done in small batches instead of
+    full scans. The store decides on removal whether an entry is really
+    due, and re-adds keys whose expiry was extended in the meantime, so a
+    key only needs a new entry when its expiry moves to an earlier bucket.
+    """
+
+    def __init__(self, granularity=1.0):
+        self.granularity = granularity
+        self.buckets = {}
+        self.heap = []
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def bucket(self, expires_at):
+        # Round up so that every key in a due bucket has expired
+        return int(expires_at // self.granularity) + 1
+
+    def add(self, key, expires_at):
+        bucket = self.bucket(expires_at)
+        with self.lock:
+            keys = self.buckets.get(bucket)
+            if keys is None:
+                keys = self.buckets[bucket] = []
+                heapq.heappush(self.heap, bucket)
+            keys.append(key)
+            self.pending += 1
+
+    def add_many(self, entries):
+        """Add ``(key, expires_at)`` pairs under a single lock acquisition."""
+        with self.lock:
+            for key, expires_at in entries:
+                bucket = self.bucket(expires_at)
+                keys = self.buckets.get(bucket)
+                if keys is None:
+                    keys = self.buckets[bucket] = []
+                    heapq.heappush(self.heap, bucket)
+                keys.append(key)
+            self.pending += len(entries)
+
+    def pop_due(self, now, limit):
+        """Remove and return up to ``limit`` keys from buckets that are due."""
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0] * self.granularity <= now and len(due) < limit:
+                bucket = self.heap[0]
+                keys = self.buckets[bucket]
+                take = min(limit - len(due), len(keys))
+                due.extend(keys[len(keys) - take:])
+                del keys[len(keys) - take:]
+                if not keys:
+                    heapq.heappop(self.heap)
+                    del self.buckets[bucket]
+            self.pending -= len(due)
+        return due
+
+    def backlog(self, now):
+        """Return the number of due keys and the age of the oldest due bucket."""
+        with self.lock:
+            if not self.heap or self.heap[0] * self.granularity > now:
+                return 0, 0.0
+            cutoff = now / self.granularity
+            count = sum(len(keys) for bucket, keys in self.buckets.items() if bucket <= cutoff)
+            return count, now - self.heap[0] * self.granularity
+
+def estimate_size(obj, depth=4):
+    """Approximate the bytes held by ``obj`` and the containers nested in it."""
+    size = sys.getsizeof(obj)
+    if depth:
+        if isinstance(obj, dict):
+            size += sum(estimate_size(k, depth - 1) + estimate_size(v, depth - 1) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            size += sum(estimate_size(item, depth - 1) for item in obj)
+    return size
+
+class ShardedStore:
+    """Dictionary split into lock-protected shards for threaded servers.
+
+    Each key hashes to one of ``shards`` plain dicts guarded by its own lock,
+    so concurrent requests touching different keys rarely contend and no
+    read-modify-write sequence on a single key can interleave with another.
+    Entries written with an expiry are also recorded in an ``ExpiryIndex``
+    so that ``purge_expired`` can remove them incrementally. Every write
+    marks its shard dirty, so snapshots only rewrite shards that changed.
+    """
+
+    def __init__(self, shards=16, granularity=1.0):
+        self._shards = [{} for _ in range(shards)]
+        self._expiry = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._dirty = [False] * shards
+        self.expiry_index = ExpiryIndex(granularity)
+
+    def _index(self, key):
+        return hash(key) % len(self._shards)
+
+    def _set_expiry(self, index, key, expires_at):
+        """Record a key's expiry under its shard lock, returning whether it must be indexed.
+
+        A key already indexed in the same or an earlier bucket is left alone:
+        ``purge_expired`` re-adds it when that entry comes due.
+        """
+        expiry = self._expiry[index]
+        old = expiry.get(key)
+        expiry[key] = expires_at
+        return old is None or self.expiry_index.bucket(expires_at) < self.expiry_index.bucket(old)
+
+    def __getitem__(self, key):
+        index = self._index(key)
+        with self._locks[index]:
+            return self._shards[index][key]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        index = self._index(key)
+        with self._locks[index]:
+            del self._shards[index][key]
+            self._expiry[index].pop(key, None)
+            self._dirty[index] = True
+
+    def __contains__(self, key):
+        index = self._index(key)
+        with self._locks[index]:
+            return key in self._shards[index]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def set(self, key, value, expires_at=None):
+        """Store ``value``, optionally removing it once ``expires_at`` has passed."""
+        index = self._index(key)
+        reindex = False
+        with self._locks[index]:
+            self._shards[index][key] = value
+            if expires_at is None:
+                self._expiry[index].pop(key, None)
+            else:
+                reindex = self._set_expiry(index, key, expires_at)
+            self._dirty[index] = True
+        if reindex:
+            self.expiry_index.add(key, expires_at)
+
+    def add(self, key, value, expires_at=None):
+        """Store ``value`` only if ``key`` is absent, returning whether it was stored."""
+        index = self._index(key)
+        reindex = False
+        with self._locks[index]:
+            if key in self._shards[index]:
+                return False
+            self._shards[index][key] = value
+            if expires_at is not None:
+                reindex = self._set_expiry(index, key, expires_at)
+            self._dirty[index] = True
+        if reindex:
+            self.expiry_index.add(key, expires_at)
+        return True
+
+    def get(self, key, default=None):
+        index = self._index(key)
+        with self._locks[index]:
+            return self._shards[index].get(key, default)
+
+    def pop(self, key, default=None):
+        index = self._index(key)
+        with self._locks[index]:
+            self._expiry[index].pop(key, None)
+            self._dirty[index] = True
+            return self._shards[index].pop(key, default)
+
+    def get_or_create(self, key, factory, is_valid=None, ttl=None):
+        """Return the value for ``key``, creating it with ``factory`` if missing or invalid.
+
+        The check and the creation happen under the shard lock, so concurrent
+        callers for the same key all receive the value created by the first.
+        A created value expires after ``ttl`` seconds if given.
+        """
+        index = self._index(key)
+        expires_at = None
+        reindex = False
+        with self._locks[index]:
+            value = self._shards[index].get(key)
+            if value is None or (is_valid is not None and not is_valid(value)):
+                value = self._shards[index][key] = factory()
+                if ttl is not None:
+                    expires_at = time.time() + ttl
+                    reindex = self._set_expiry(index, key, expires_at)
+                self._dirty[index] = True
+        if reindex:
+            self.expiry_index.add(key, expires_at)
+        return value
+
+    def append(self, key, item, expires_at=None, limit=None, is_stale=None):
+        """Append ``item`` to the list stored under ``key``, creating it if needed.
+
+        With ``expires_at``, the whole list expires at that time unless
+        appended to again. With ``limit``, only the newest ``limit`` items are
+        kept, and leading items for which ``is_stale`` returns True are dropped.
+        """
+        index = self._index(key)
+        reindex = False
+        with self._locks[index]:
+            items = self._shards[index].setdefault(key, [])
+            items.append(item)
+            if limit is not None and len(items) > limit:
+                del items[:len(items) - limit]
+            if is_stale is not None:
+                stale = 0
+                while stale < len(items) - 1 and is_stale(items[stale]):
+                    stale += 1
+                del items[:stale]
+            if expires_at is not None:
+                reindex = self._set_expiry(index, key, expires_at)
+            self._dirty[index] = True
+        if reindex:
+            self.expiry_index.add(key, expires_at)
+
+    def purge_expired(self, now, limit):
+        """Process up to ``limit`` due index entries.
+
+        Returns the number of index entries examined and entries removed.
+        """
+        due = self.expiry_index.pop_due(now, limit)
+        removed = 0
+        extended = []
+        for key in due:
+            index = self._index(key)
+            with self._locks[index]:
+                # The expiry may have been extended since this index entry was added
+                expires_at = self._expiry[index].get(key)
+                if expires_at is None:
+                    continue
+                if expires_at <= now:
+                    del self._expiry[index][key]
+                    self._shards[index].pop(key, None)
+                    self._dirty[index] = True
+                    removed += 1
+                else:
+                    extended.append((key, expires_at))
+        if extended:
+            self.expiry_index.add_many(extended)
+        return len(due), removed
+
+    def memory_usage(self, sample_size):
+        """Estimate ``(entries, bytes)`` from the containers and a sample of entries.
+        
+        Up to ``sample_size`` entries are sized, spread over the shards, so
+        the cost does not depend on how large the store has grown.
+        """
+        entries = len(self)
+        container_bytes = sum(sys.getsizeof(d) for d in self._shards + self._expiry)
+        # Expiry index: one list slot per pending key plus a list and heap slot per bucket
+        container_bytes += self.expiry_index.pending * 8 + len(self.expiry_index.buckets) * 120
+        
+        sampled = sampled_bytes = 0
+        per_shard = max(1, sample_size // len(self._shards))
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                sample = list(itertools.islice(shard.items(), per_shard))
+            for key, value in sample:
+                sampled_bytes += estimate_size(key) + estimate_size(value)
+            sampled += len(sample)
+        
+        entry_bytes = sampled_bytes / sampled if sampled else 0
+        return entries, int(container_bytes + entry_bytes * entries)
+
+    def items(self):
+        """Return a snapshot of all entries, taken one shard at a time."""
+        entries = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                entries.extend(shard.items())
+        return entries
+
+    def to_dict(self):
+        """Return a plain-dict snapshot, e.g. for ``jsonify``."""
+        return dict(self.items())
+
+    @property
+    def shard_count(self):
+        return len(self._shards)
+
+    def take_dirty(self):
+        """Return the indexes of shards written since the last call and mark them clean."""
+        dirty = []
+        for index, lock in enumerate(self._locks):
+            with lock:
+                if self._dirty[index]:
+                    self._dirty[index] = False
+                    dirty.append(index)
+        return dirty
+
+    def mark_dirty(self, indexes):
+        for index in indexes:
+            self._dirty[index] = True
+
+    def clear(self):
+        for index, lock in enumerate(self._locks):
+            with lock:
+                self._shards[index] = {}
+                self._expiry[index] = {}
+                self._dirty[index] = True
+        with self.expiry_index.lock:
+            self.expiry_index.buckets = {}
+            self.expiry_index.heap = []
+            self.expiry_index.pending = 0
+
+    def shard_state(self, index):
+        """Return the live ``(entries, expiry)`` dicts of a shard.
+
+        They are not copied: use this only where nothing else can write to
+        them, such as in a forked child.
+        """
+        return self._shards[index], self._expiry[index]
+
+    def restore(self, entries, expiry, now, source=None):
+        """Insert snapshot entries, skipping those that expired by ``now``.
+
+        Keys are rehashed because ``hash()`` of a string differs between
+        processes. Entries that land in shard ``source``, the shard their
+        file was saved from, leave it clean since the file already holds
+        them; any other shard they land in is marked dirty, and so is
+        ``source`` when entries moved out of it or expired. Returns the
+        number of entries restored.
+        """
+        shards = len(self._shards)
+        grouped = [({}, {}) for _ in range(shards)]
+        due = []
+        stale = False
+        for key, value in entries.items():
+            index = hash(key) % shards
+            expires_at = expiry.get(key)
+            if expires_at is not None:
+                if expires_at <= now:
+                    stale = True
+                    continue
+                due.append((key, expires_at))
+                grouped[index][1][key] = expires_at
+            grouped[index][0][key] = value
+        
+        # One lock acquisition per shard instead of per entry
+        for index, (shard_entries, shard_expiry) in enumerate(grouped):
+            if shard_entries:
+                stale = stale or index != source
+                with self._locks[index]:
+                    self._shards[index].update(shard_entries)
+                    self._expiry[index].update(shard_expiry)
+                    if index != source:
+                        self._dirty[index] = True
+        if stale and source is not None:
+            with self._locks[source]:
+                self._dirty[source] = True
+        self.expiry_index.add_many(due)
+        return sum(len(shard_entries) for shard_entries, _ in grouped)
+
+# In-memory stores shared by all request threads
+# In production, use Redis or a database
+detected_bots = ShardedStore(config['store_shards'], config['janitor_granularity'])
+challenges_by_fingerprint = ShardedStore(config['store_shards'], config['janitor_granularity'])
+
+class Janitor:
+    """Background thread that expires store entries in small time-sliced batches.
+
+    Each tick drains due entries from the stores' expiry indexes in batches
+    of ``batch`` until ``budget`` seconds of work have been spent, then
+    yields until the next tick, so a large expiry wave is spread over many
+    ticks instead of stalling a worker. Callables in ``tasks`` run after
+    every tick for other periodic housekeeping.
+    """
+
+    def __init__(self, stores, interval, budget, batch):
+        self.stores = stores
+        self.interval = interval
+        self.budget = budget
+        self.batch = batch
+        self.pid = None
+        self.lock = threading.Lock()
+        self.ticks = 0
+        self.last_tick_seconds = 0.0
+        self.expired = {name: 0 for name in stores}
+        self.next_store = 0
+        self.tasks = []
+
+    def ensure_running(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                threading.Thread(target=self._run, daemon=True).start()
+                self.pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.tick()
+                for task in self.tasks:
+                    task()
+            except Exception:
+                logger.exception("Janitor tick failed")
+
+    def tick(self, now=None):
+        """Run one time-limited expiry pass over the stores."""
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        deadline = started + self.budget
+        names = list(self.stores)
+        
+        # Rotate the starting store so a busy store cannot starve the others
+        for offset in range(len(names)):
+            name = names[(self.next_store + offset) % len(names)]
+            while time.perf_counter() < deadline:
+                examined, removed = self.stores[name].purge_expired(now, self.batch)
+                self.expired[name] += removed
+                if examined < self.batch:
+                    break
+            if time.perf_counter() >= deadline:
+                self.next_store = (self.next_store + offset) % len(names)
+                break
+        
+        self.ticks += 1
+        self.last_tick_seconds = time.perf_counter() - started
+
+    def stats(self):
+        now = time.time()
+        stores = {}
+        for name, store in self.stores.items():
+            backlog, oldest = store.expiry_index.backlog(now)
+            stores[name] = {
+                'entries': len(store),
+                'indexed': store.expiry_index.pending,
+                'backlog': backlog,
+                'oldest_overdue_seconds': oldest,
+                'expired': self.expired[name],
+            }
+        return {
+            'ticks': self.ticks,
+            'last_tick_ms': self.last_tick_seconds * 1000,
+            'budget_ms': self.budget * 1000,
+            'stores': stores,
+        }
+
+janitor = Janitor(
+    {
+        'challenges_by_fingerprint': challenges_by_fingerprint,
+        'detected_bots': detected_bots,
+    },
+    config['janitor_interval'],
+    config['janitor_budget_ms'] / 1000,
+    config['janitor_batch'],
+)
+
+@protection_blueprint.before_app_request
+def start_background_tasks():
+    janitor.ensure_running()
+
+class OverloadController:
+    """Switches the bot-detection endpoints between normal, degraded and reject modes.
+
+    The mode follows the number of in-flight requests with hysteresis: it
+    escalates when a high watermark is reached and only steps back down
+    once load falls below ``recovery_ratio`` of that watermark.
+    """
+
+    NORMAL = 'normal'
+    DEGRADED = 'degraded'
+    REJECT = 'reject'
+
+    def __init__(self, degraded_watermark, reject_watermark, recovery_ratio):
+        self.degraded_watermark = degraded_watermark
+        self.reject_watermark = reject_watermark
+        self.recovery_ratio = recovery_ratio
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.mode = self.NORMAL
+        self.transitions = 0
+        self.served = {self.NORMAL: 0, self.DEGRADED: 0, self.REJECT: 0}
+
+    def _update_mode(self):
+        mode = self.mode
+        if self.inflight >= self.reject_watermark:
+            mode = self.REJECT
+        elif mode == self.REJECT and self.inflight < self.reject_watermark * self.recovery_ratio:
+            mode = self.DEGRADED
+        if mode == self.NORMAL and self.inflight >= self.degraded_watermark:
+            mode = self.DEGRADED
+        elif mode == self.DEGRADED and self.inflight < self.degraded_watermark * self.recovery_ratio:
+            mode = self.NORMAL
+        if mode != self.mode:
+            logger.warning(f"Load shedding mode {self.mode} -> {mode} ({self.inflight} in flight)")
+            self.mode = mode
+            self.transitions += 1
+
+    def enter(self):
+        """Admit a request and return the mode it should be served in."""
+        with self.lock:
+            self.inflight += 1
+            self._update_mode()
+            mode = self.mode
+            self.served[mode] += 1
+            if mode == self.REJECT:
+                self.inflight -= 1
+            return mode
+
+    def leave(self):
+        with self.lock:
+            self.inflight -= 1
+            self._update_mode()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'inflight': self.inflight,
+                'transitions': self.transitions,
+                'served': dict(self.served),
+            }
+
+overload_controller = OverloadController(
+    config['shed_degraded_inflight'],
+    config['shed_reject_inflight'],
+    config['shed_recovery_ratio'],
+)
+
+def overload_page_response():
+    """Serve the pre-rendered protection page with a 503 asking the client to retry later."""
+    response = make_response(render_protection_page(), 503)
+    response.headers['Retry-After'] = str(config['shed_retry_after'])
+    return response
+
+def shed_load(f):
+    """Apply the overload controller to a bot-detection endpoint."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        mode = overload_controller.enter()
+        if mode == OverloadController.REJECT:
+            response = jsonify({'error': 'Service overloaded, retry later'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(config['shed_retry_after'])
+            return response
+        g.load_mode = mode
+        try:
+            return f(*args, **kwargs)
+        finally:
+            overload_controller.leave()
+    return decorated_function
+
+class TrafficSketches:
+    """Fixed-memory streaming summaries of bot checks and detections.
+
+    Answers campaign-level questions (fingerprints per IP, IPs per
+    fingerprint, top user agents by bot score) without scanning
+    ``detected_bots``. State can be exported and merged across workers.
+    """
+
+    def __init__(self, width, depth, precision, top_k, key_precision):
+        self.lock = threading.Lock()
+        self.checks_by_ip = CountMinSketch(width, depth)
+        self.detections_by_ip = CountMinSketch(width, depth)
+        self.distinct_ips = HyperLogLog(precision)
+        self.distinct_fingerprints = HyperLogLog(precision)
+        self.fingerprints_per_ip = SpaceSaving(top_k, key_precision)
+        self.ips_per_fingerprint = SpaceSaving(top_k, key_precision)
+        self.top_user_agents_by_score = SpaceSaving(top_k)
+        self.top_detected_ips = SpaceSaving(top_k)
+
+    def observe_check(self, ip, fingerprint, user_agent, score):
+        with self.lock:
+            self.checks_by_ip.add(ip)
+            self.distinct_ips.add(ip)
+            if fingerprint:
+                self.distinct_fingerprints.add(fingerprint)
+                self.fingerprints_per_ip.add(ip, item=fingerprint)
+                self.ips_per_fingerprint.add(fingerprint, item=ip)
+            if score:
+                self.top_user_agents_by_score.add(user_agent, score)
+
+    def observe_detection(self, ip, score):
+        with self.lock:
+            self.detections_by_ip.add(ip)
+            self.top_detected_ips.add(ip, score)
+
+    _SKETCHES = {
+        'checks_by_ip': CountMinSketch,
+        'detections_by_ip': CountMinSketch,
+        'distinct_ips': HyperLogLog,
+        'distinct_fingerprints': HyperLogLog,
+        'fingerprints_per_ip': SpaceSaving,
+        'ips_per_fingerprint': SpaceSaving,
+        'top_user_agents_by_score': SpaceSaving,
+        'top_detected_ips': SpaceSaving,
+    }
+
+    def to_state(self):
+        with self.lock:
+            return {name: getattr(self, name).to_state() for name in self._SKETCHES}
+
+    def merge_state(self, state):
+        """Merge the exported state of another worker into this one.
+
+        Raises KeyError, TypeError or ValueError, before anything is merged,
+        if a sketch is missing, malformed or shaped unlike the local one.
+        """
+        for name in self._SKETCHES:
+            shape = getattr(self, name).shape()
+            # Checked before decoding, so a state cannot make us allocate a larger sketch
+            if any(state[name][key] != value for key, value in shape.items()):
+                raise ValueError(f"{name} does not have the local shape {shape}")
+        other = {name: cls.from_state(state[name]) for name, cls in self._SKETCHES.items()}
+        with self.lock:
+            for name, sketch in other.items():
+                getattr(self, name).merge(sketch)
+
+    def summary(self, top=20, ip=None):
+        with self.lock:
+            result = {
+                'distinct_ips': self.distinct_ips.count(),
+                'distinct_fingerprints': self.distinct_fingerprints.count(),
+                'fingerprints_per_ip': [
+                    {'ip': key, 'checks': weight, 'error': error, 'distinct_fingerprints': distinct}
+                    for key, weight, error, distinct in self.fingerprints_per_ip.top(top)
+                ],
+                'ips_per_fingerprint': [
+                    {'fingerprint': key, 'checks': weight, 'error': error, 'distinct_ips': distinct}
+                    for key, weight, error, distinct in self.ips_per_fingerprint.top(top)
+                ],
+                'top_user_agents_by_score': [
+                    {'user_agent': key, 'total_score': weight, 'error': error}
+                    for key, weight, error, _ in self.top_user_agents_by_score.top(top)
+                ],
+                'top_detected_ips': [
+                    {'ip': key, 'total_score': weight, 'error': error}
+                    for key, weight, error, _ in self.top_detected_ips.top(top)
+                ],
+            }
+            if ip:
+                result['ip'] = {
+                    'ip': ip,
+                    'checks': self.checks_by_ip.estimate(ip),
+                    'detections': self.detections_by_ip.estimate(ip),
+                }
+            return result
+
+timing_tracker = RequestTimingTracker(
+    config['timing_max_clients'],
+    config['timing_ewma_alpha'],
+    60.0,
+    config['rate_limits']['default'],
+)
+
+traffic_sketches = TrafficSketches(
+    config['sketch_width'],
+    config['sketch_depth'],
+    config['sketch_precision'],
+    config['sketch_top_k'],
+    config['sketch_key_precision'],
+)
+
 # HTML/JS snippets - these will be included in your website
 HTML_HEAD_SNIPPET = '''
 <script>
 (function() {
     const BOT_CHECK_ENDPOINT = "/bot-detection/check";
     const CHALLENGE_ENDPOINT = "/bot-detection/challenge";
+    const RENEW_ENDPOINT = "/bot-detection/renew";
+    const COMPACT_CHECK_TYPE = "application/x-bot-check";
+    // Filled in by /bot-protection.js with a signed challenge, saving a round trip
+    let presetChallenge = /*PRESET_CHALLENGE*/null;
     
     // Generate a browser fingerprint
     function generateFingerprint() {
@@ -110,20 +863,105 @@ HTML_HEAD_SNIPPET = '''
     let scrollEvents = 0;
     let keyPresses = 0;
     let lastActivityTime = Date.now();
+    let activityStampPending = false;
+    
+    // Handlers only bump a counter; the activity timestamp is taken at most
+    // once per animation frame instead of calling Date.now() on every event
+    const nextFrame = window.requestAnimationFrame ? window.requestAnimationFrame.bind(window) : (callback) => setTimeout(callback, 16);
+    
+    function stampActivity() {
+        activityStampPending = false;
+        lastActivityTime = Date.now();
+    }
+    
+    function noteActivity() {
+        if (!activityStampPending) {
+            activityStampPending = true;
+            nextFrame(stampActivity);
+        }
+    }
     
     function trackUserActivity() {
+        const options = { passive: true };
         document.addEventListener('mousemove', () => { 
             mouseMovements++; 
-            lastActivityTime = Date.now();
-        });
+            noteActivity();
+        }, options);
         document.addEventListener('scroll', () => { 
             scrollEvents++; 
-            lastActivityTime = Date.now();
-        });
+            noteActivity();
+        }, options);
         document.addEventListener('keydown', () => { 
             keyPresses++; 
-            lastActivityTime = Date.now();
-        });
+            noteActivity();
+        }, options);
+    }
+    
+    // SHA-256 of an ASCII string as eight 32-bit words, for proof-of-work
+    // challenges (crypto.subtle is async per hash and missing on plain HTTP)
+    const SHA256_K = (() => {
+        const k = [];
+        for (let n = 2; k.length < 64; n++) {
+            let prime = true;
+            for (let d = 2; d * d <= n; d++) {
+                if (n % d === 0) { prime = false; break; }
+            }
+            if (prime) {
+                const root = Math.cbrt(n);
+                k.push(((root - Math.floor(root)) * 4294967296) | 0);
+            }
+        }
+        return k;
+    })();
+    
+    function sha256Words(message) {
+        const length = message.length;
+        const words = new Uint32Array((((length + 8) >> 6) + 1) * 16);
+        for (let i = 0; i < length; i++) {
+            words[i >> 2] |= message.charCodeAt(i) << (24 - (i & 3) * 8);
+        }
+        words[length >> 2] |= 0x80 << (24 - (length & 3) * 8);
+        words[words.length - 1] = length * 8;
+        
+        const h = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19];
+        const w = new Uint32Array(64);
+        for (let block = 0; block < words.length; block += 16) {
+            for (let t = 0; t < 64; t++) {
+                if (t < 16) {
+                    w[t] = words[block + t];
+                } else {
+                    const x = w[t - 15], y = w[t - 2];
+                    const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+                    const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+                    w[t] = w[t - 16] + s0 + w[t - 7] + s1;
+                }
+            }
+            let [a, b, c, d, e, f, g, k] = h;
+            for (let t = 0; t < 64; t++) {
+                const s1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+                const t1 = (k + s1 + ((e & f) ^ (~e & g)) + SHA256_K[t] + w[t]) | 0;
+                const s0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+                const t2 = (s0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+                k = g; g = f; f = e; e = (d + t1) | 0; d = c; c = b; b = a; a = (t1 + t2) | 0;
+            }
+            [a, b, c, d, e, f, g, k].forEach((value, i) => { h[i] = (h[i] + value) | 0; });
+        }
+        return h;
+    }
+    
+    // Find a counter whose hash with the nonce starts with enough zero bits,
+    // yielding to the page every few thousand hashes
+    async function solveProofOfWork(nonce, bits) {
+        for (let counter = 0; ; counter++) {
+            const h = sha256Words(nonce + ':' + counter);
+            const zeros = h[0] === 0 ? 32 + Math.clz32(h[1]) : Math.clz32(h[0]);
+            if (zeros >= bits) {
+                return counter.toString();
+            }
+            if (counter % 5000 === 4999) {
+                await new Promise(resolve => setTimeout(resolve, 0));
+            }
+        }
     }
     
     // Solve challenge for token
@@ -133,6 +971,9 @@ HTML_HEAD_SNIPPET = '''
             // This is a simple challenge - the server will verify the solution
             const values = challenge.split('|');
             const operation = values[0];
+            if (operation === 'pow') {
+                return solveProofOfWork(values[1], parseInt(values[2]));
+            }
             const a = parseInt(values[1]);
             const b = parseInt(values[2]);
             
@@ -152,6 +993,11 @@ HTML_HEAD_SNIPPET = '''
     async function getProtectionToken() {
         const fingerprint = generateFingerprint();
         
+        // Settle an activity timestamp still waiting for its frame
+        if (activityStampPending) {
+            stampActivity();
+        }
+        
         // Collect browser information
         const browserInfo = {
             fingerprint: fingerprint,
@@ -174,56 +1020,132 @@ HTML_HEAD_SNIPPET = '''
         };
         
         try {
-            // Request a challenge first
-            const challengeResponse = await fetch(CHALLENGE_ENDPOINT, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    fingerprint: fingerprint
-                })
-            });
-            
-            const challengeData = await challengeResponse.json();
+            // Use the embedded challenge once while it is still valid,
+            // otherwise request a challenge first
+            let challengeData = presetChallenge;
+            presetChallenge = null;
+            if (!challengeData || parseInt(challengeData.challenge.split('|')[3]) * 1000 <= Date.now()) {
+                const challengeResponse = await fetch(CHALLENGE_ENDPOINT, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        fingerprint: fingerprint
+                    })
+                });
+                
+                challengeData = await challengeResponse.json();
+            }
             
             // Solve the challenge
-            const solution = solveChallenge(challengeData.challenge);
+            const solution = await solveChallenge(challengeData.challenge);
             
-            // Send solution and browser info to get a token
+            // Send solution and browser info to get a token, in the compact
+            // binary format when the server advertises it and JSON otherwise
+            const compact = (challengeData.formats || []).indexOf('packed') !== -1 &&
+                typeof TextEncoder !== 'undefined' && typeof DataView !== 'undefined';
             const response = await fetch(BOT_CHECK_ENDPOINT, {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json',
+                    'Content-Type': compact ? COMPACT_CHECK_TYPE : 'application/json',
                 },
-                body: JSON.stringify({
+                body: compact ? encodeCompactCheck(challengeData.challenge, solution, browserInfo) : JSON.stringify({
                     challenge: challengeData.challenge,
                     solution: solution,
                     info: browserInfo
                 })
             });
             
+            if (!response.ok) {
+                // Overloaded or refused; honour Retry-After when the server sends it
+                console.error("Failed to get protection token:", response.status);
+                scheduleRetry(parseInt(response.headers.get('Retry-After'), 10) * 1000);
+                return null;
+            }
             const data = await response.json();
             
             // If we got a token, store it
             if (data.token) {
-                localStorage.setItem('protection_token', data.token);
-                localStorage.setItem('token_expiry', Date.now() + (30 * 60 * 1000)); // 30 minutes
-                
-                // Add token to all forms
-                addTokenToForms(data.token);
-                
+                storeToken(data.token, data.expires_in);
                 return data.token;
             } else {
                 console.error("Failed to get protection token");
+                scheduleRetry();
                 return null;
             }
         } catch (error) {
             console.error("Error getting protection token:", error);
+            scheduleRetry();
             return null;
         }
     }
     
+    // Store a token, add it to all forms and schedule its renewal
+    let refreshTimer = null;
+    
+    // Retry a failed token request with jittered exponential backoff
+    const RETRY_MIN_DELAY = 5 * 1000;
+    const RETRY_MAX_DELAY = 5 * 60 * 1000;
+    let retryDelay = 0;
+    
+    function scheduleRetry(minimumDelay) {
+        retryDelay = Math.min(Math.max(retryDelay * 2, RETRY_MIN_DELAY), RETRY_MAX_DELAY);
+        const delay = Math.max(retryDelay * (0.5 + Math.random() * 0.5), minimumDelay || 0);
+        clearTimeout(refreshTimer);
+        refreshTimer = setTimeout(getProtectionToken, delay);
+    }
+    
+    // Also send the token with every request to this site, for ProtectionMiddleware
+    function setTokenCookie(token, expiry) {
+        document.cookie = 'protection_token=' + token + '; path=/; max-age=' + Math.floor((expiry - Date.now()) / 1000) +
+            '; SameSite=Lax' + (location.protocol === 'https:' ? '; Secure' : '');
+    }
+    
+    function storeToken(token, expiresIn) {
+        retryDelay = 0;
+        const expiry = Date.now() + (expiresIn || 30 * 60) * 1000;
+        localStorage.setItem('protection_token', token);
+        localStorage.setItem('token_expiry', expiry);
+        setTokenCookie(token, expiry);
+        addTokenToForms(token);
+        scheduleRefresh(expiry);
+    }
+    
+    // Renew at a random point between 70% and 90% of the remaining
+    // lifetime, so clients holding tokens issued together spread out
+    function scheduleRefresh(expiry) {
+        clearTimeout(refreshTimer);
+        const remaining = Math.max(0, expiry - Date.now());
+        refreshTimer = setTimeout(renewProtectionToken, remaining * (0.7 + Math.random() * 0.2));
+    }
+    
+    // Extend the current token, falling back to the full challenge when refused
+    async function renewProtectionToken() {
+        const token = localStorage.getItem('protection_token');
+        try {
+            const response = await fetch(RENEW_ENDPOINT, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    token: token
+                })
+            });
+            if (response.ok) {
+                const data = await response.json();
+                if (data.token) {
+                    storeToken(data.token, data.expires_in);
+                    return data.token;
+                }
+            }
+        } catch (error) {
+            console.error("Error renewing protection token:", error);
+        }
+        return getProtectionToken();
+    }
+    
     // Detect WebGL capabilities
     function detectWebGL() {
         const canvas = document.createElement('canvas');
@@ -240,19 +1162,69 @@ HTML_HEAD_SNIPPET = '''
         };
     }
     
+    // Encode the check request in the compact binary layout (see decode_compact_check)
+    function encodeCompactCheck(challenge, solution, info) {
+        const encoder = new TextEncoder();
+        const strings = [
+            info.fingerprint, challenge, solution, info.language,
+            info.webGL.vendor, info.webGL.renderer
+        ].map(value => encoder.encode(String(value || '')).subarray(0, 65535));
+        
+        const automation = info.automationIndicators;
+        const activity = info.userActivity;
+        const flags = (info.cookiesEnabled ? 1 : 0) |
+            (automation.webdriver ? 2 : 0) |
+            (automation.selenium ? 4 : 0) |
+            (automation.phantom ? 8 : 0) |
+            (automation.nightmare ? 16 : 0) |
+            (automation.domAutomation ? 32 : 0) |
+            (automation.headless ? 64 : 0) |
+            (info.webGL.available ? 128 : 0);
+        
+        const size = 26 + strings.reduce((total, bytes) => total + 2 + bytes.length, 0);
+        const buffer = new ArrayBuffer(size);
+        const view = new DataView(buffer);
+        const u16 = value => Math.max(0, Math.min(value | 0, 65535));
+        const u32 = value => Math.max(0, Math.min(Math.floor(value) || 0, 4294967295));
+        
+        view.setUint8(0, 1);  // layout version
+        view.setUint16(1, flags, true);
+        view.setUint16(3, u16(info.screen.width), true);
+        view.setUint16(5, u16(info.screen.height), true);
+        view.setUint8(7, Math.min(info.screen.colorDepth | 0, 255));
+        view.setInt16(8, Math.max(-32768, Math.min(info.timezone | 0, 32767)), true);
+        view.setUint32(10, u32(activity.mouseMovements), true);
+        view.setUint32(14, u32(activity.scrollEvents), true);
+        view.setUint32(18, u32(activity.keyPresses), true);
+        view.setUint32(22, u32(activity.timeSinceLastActivity), true);
+        
+        let offset = 26;
+        const bytes = new Uint8Array(buffer);
+        strings.forEach(value => {
+            view.setUint16(offset, value.length, true);
+            bytes.set(value, offset + 2);
+            offset += 2 + value.length;
+        });
+        return buffer;
+    }
+    
     // Add the token to all forms on the page
+    let currentToken = null;
+    
+    function addTokenToForm(form, token) {
+        let input = form.querySelector('input[name="protection_token"]');
+        if (!input) {
+            input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = 'protection_token';
+            form.appendChild(input);
+        }
+        input.value = token;
+    }
+    
     function addTokenToForms(token) {
-        const forms = document.querySelectorAll('form');
-        forms.forEach(form => {
-            let input = form.querySelector('input[name="protection_token"]');
-            if (!input) {
-                input = document.createElement('input');
-                input.type = 'hidden';
-                input.name = 'protection_token';
-                form.appendChild(input);
-            }
-            input.value = token;
-        });
+        currentToken = token;
+        Array.prototype.forEach.call(document.forms, form => addTokenToForm(form, token));
     }
     
     // Add random delay to events to defeat timing analysis
@@ -276,51 +1248,72 @@ HTML_HEAD_SNIPPET = '''
                 getProtectionToken();
             });
         } else {
-            // We have a valid token, add it to forms
+            // We have a valid token, add it to forms and renew it before it expires
             addTokenToForms(token);
+            setTokenCookie(token, parseInt(expiry));
+            scheduleRefresh(parseInt(expiry));
         }
         
         // Add honeypot fields to forms
         addHoneypotFields();
         
-        // Re-validate token periodically
-        setInterval(() => {
-            const tokenExpiry = localStorage.getItem('token_expiry');
-            if (!tokenExpiry || parseInt(tokenExpiry) < Date.now()) {
-                getProtectionToken();
-            }
-        }, 10 * 60 * 1000); // Check every 10 minutes
+        // Protect forms added later, instead of rescanning the whole page
+        watchForNewForms();
     }
     
     // Add honeypot fields to forms
-    function addHoneypotFields() {
-        const forms = document.querySelectorAll('form');
-        const honeypotNames = ['email_confirm', 'phone_alt', 'username_2'];
+    const honeypotNames = ['email_confirm', 'phone_alt', 'username_2'];
+    
+    function addHoneypotField(form) {
+        // Add one random honeypot field per form
+        const fieldName = honeypotNames[Math.floor(Math.random() * honeypotNames.length)];
         
-        forms.forEach(form => {
-            // Add one random honeypot field per form
-            const fieldName = honeypotNames[Math.floor(Math.random() * honeypotNames.length)];
+        let honeypot = form.querySelector(`input[name="${fieldName}"]`);
+        if (!honeypot) {
+            honeypot = document.createElement('input');
+            honeypot.type = 'text';
+            honeypot.name = fieldName;
+            honeypot.autocomplete = 'off';
             
-            let honeypot = form.querySelector(`input[name="${fieldName}"]`);
-            if (!honeypot) {
-                honeypot = document.createElement('input');
-                honeypot.type = 'text';
-                honeypot.name = fieldName;
-                honeypot.autocomplete = 'off';
-                
-                // Hide it with CSS
-                honeypot.style.position = 'absolute';
-                honeypot.style.opacity = '0';
-                honeypot.style.height = '0';
-                honeypot.style.width = '0';
-                honeypot.style.zIndex = '-1';
-                honeypot.tabIndex = -1;
-                
-                form.appendChild(honeypot);
+            // Hide it with CSS
+            honeypot.style.position = 'absolute';
+            honeypot.style.opacity = '0';
+            honeypot.style.height = '0';
+            honeypot.style.width = '0';
+            honeypot.style.zIndex = '-1';
+            honeypot.tabIndex = -1;
+            
+            form.appendChild(honeypot);
+        }
+    }
+    
+    function addHoneypotFields() {
+        Array.prototype.forEach.call(document.forms, addHoneypotField);
+    }
+    
+    // Give forms inserted after page load their honeypot and token
+    function protectAddedNode(node) {
+        if (node.nodeType !== 1) {
+            return;
+        }
+        const forms = node.tagName === 'FORM' ? [node] : node.getElementsByTagName('form');
+        Array.prototype.forEach.call(forms, form => {
+            addHoneypotField(form);
+            if (currentToken) {
+                addTokenToForm(form, currentToken);
             }
         });
     }
     
+    function watchForNewForms() {
+        if (typeof MutationObserver === 'undefined') {
+            return;
+        }
+        new MutationObserver(mutations => {
+            mutations.forEach(mutation => mutation.addedNodes.forEach(protectAddedNode));
+        }).observe(document.documentElement, { childList: true, subtree: true });
+    }
+    
     // Run on page load
     if (document.readyState === 'loading') {
         document.addEventListener('DOMContentLoaded', initProtection);
@@ -331,20 +1324,304 @@ HTML_HEAD_SNIPPET = '''
 </script>
 '''
 
+# Compact binary encoding of /bot-detection/check requests. Layout (little-endian):
+# version u8, flags u16, screen width u16, screen height u16, color depth u8,
+# timezone offset i16, mouse movements u32, scroll events u32, key presses u32,
+# ms since last activity u32, then six u16-length-prefixed UTF-8 strings:
+# fingerprint, challenge, solution, language, WebGL vendor, WebGL renderer.
+COMPACT_CHECK_MIMETYPE = 'application/x-bot-check'
+_COMPACT_CHECK_HEADER = struct.Struct('<BHHHBhIIII')
+_COMPACT_STRING_LENGTH = struct.Struct('<H')
+_AUTOMATION_FLAGS = {
+    'webdriver': 2,
+    'selenium': 4,
+    'phantom': 8,
+    'nightmare': 16,
+    'domAutomation': 32,
+    'headless': 64,
+}
+
+class _PackedAutomationIndicators:
+    """Read-only mapping view over the automation bits of a packed check."""
+
+    __slots__ = ('flags',)
+
+    def __init__(self, flags):
+        self.flags = flags
+
+    def get(self, name, default=None):
+        bit = _AUTOMATION_FLAGS.get(name)
+        return bool(self.flags & bit) if bit else default
+
+    def keys(self):
+        return _AUTOMATION_FLAGS.keys()
+
+    def __getitem__(self, name):
+        return bool(self.flags & _AUTOMATION_FLAGS[name])
+
+class _PackedUserActivity:
+    """Read-only mapping view over the activity counters of a packed check."""
+
+    __slots__ = ('mouseMovements', 'scrollEvents', 'keyPresses', 'timeSinceLastActivity')
+
+    def __init__(self, mouse_movements, scroll_events, key_presses, idle_ms):
+        self.mouseMovements = mouse_movements
+        self.scrollEvents = scroll_events
+        self.keyPresses = key_presses
+        self.timeSinceLastActivity = idle_ms
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+class PackedCheckInfo:
+    """Browser info decoded from the compact format, readable like the JSON ``info`` dict."""
+
+    __slots__ = (
+        'fingerprint', 'language', 'cookiesEnabled', 'timezone', 'screen_width', 'screen_height',
+        'color_depth', 'webgl_vendor', 'webgl_renderer', 'flags', 'activity',
+    )
+
+    def get(self, name, default=None):
+        if name == 'automationIndicators':
+            return _PackedAutomationIndicators(self.flags)
+        if name == 'userActivity':
+            return self.activity
+        if name in ('fingerprint', 'language', 'cookiesEnabled', 'timezone'):
+            return getattr(self, name)
+        return default
+
+def decode_compact_check(data):
+    """Decode a compact check body into ``(challenge, solution, info)``.
+    
+    Raises ValueError if the body is malformed.
+    """
+    try:
+        (version, flags, width, height, color_depth, timezone,
+         mouse_movements, scroll_events, key_presses, idle_ms) = _COMPACT_CHECK_HEADER.unpack_from(data, 0)
+        if version != 1:
+            raise ValueError(f"unsupported compact check version {version}")
+        
+        offset = _COMPACT_CHECK_HEADER.size
+        strings = []
+        for _ in range(6):
+            (length,) = _COMPACT_STRING_LENGTH.unpack_from(data, offset)
+            offset += _COMPACT_STRING_LENGTH.size
+            if offset + length > len(data):
+                raise ValueError("truncated compact check")
+            strings.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"malformed compact check: {e}")
+    
+    fingerprint, challenge, solution, language, vendor, renderer = strings
+    info = PackedCheckInfo()
+    info.fingerprint = fingerprint
+    info.language = language
+    info.cookiesEnabled = bool(flags & 1)
+    info.timezone = timezone
+    info.screen_width = width
+    info.screen_height = height
+    info.color_depth = color_depth
+    info.webgl_vendor = vendor
+    info.webgl_renderer = renderer
+    info.flags = flags
+    info.activity = _PackedUserActivity(mouse_movements, scroll_events, key_presses, idle_ms)
+    return challenge, solution, info
+
+# Challenges from this difficulty up are proofs of work rather than math
+POW_DIFFICULTY = 4
+
+def client_keys(ip, fingerprint=None):
+    """Return the keys a client's reputation is tracked under: fingerprint, IP and network prefix."""
+    namespace = compiled_config().namespace
+    keys = [namespace + 'ip:' + str(ip)]
+    if ip and ':' in ip:
+        try:
+            keys.append(namespace + 'prefix:' + str(ipaddress.ip_network(f"{ip}/48", strict=False)))
+        except ValueError:
+            pass
+    elif ip:
+        keys.append(namespace + 'prefix:' + ip.rsplit('.', 1)[0])
+    if fingerprint:
+        keys.append(namespace + 'fingerprint:' + fingerprint)
+    return keys
+
+class DifficultyScheduler:
+    """Chooses a challenge difficulty per client from its recent scores, rate and global load.
+    
+    A bounded LRU keeps an exponentially weighted average of the bot score
+    seen for each fingerprint, IP and network prefix. Clients whose keys
+    have consistently scored low get the trivial challenge. Clients whose
+    worst key scores at or above ``threshold_score``, or whose worst key
+    sends requests faster than its rate limit per minute, get proof-of-work
+    challenges that double in cost with every level. Rates are taken per
+    key too, so rotating fingerprints does not reset them. Degraded load
+    mode adds one more level on top.
+    """
+
+    def __init__(self, max_clients, alpha=0.3):
+        self.max_clients = max_clients
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.clients = OrderedDict()  # key -> [score EWMA, checks]
+        self.issued = {}
+
+    def record(self, keys, score):
+        """Fold a check's score into the reputation of each of ``keys``."""
+        with self.lock:
+            for key in keys:
+                entry = self.clients.get(key)
+                if entry is None:
+                    self.clients[key] = [float(score), 1]
+                    if len(self.clients) > self.max_clients:
+                        self.clients.popitem(last=False)
+                else:
+                    entry[0] += self.alpha * (score - entry[0])
+                    entry[1] += 1
+                    self.clients.move_to_end(key)
+
+    def difficulty(self, keys, rates=None, load_mode=None):
+        """Return the challenge difficulty for a client identified by ``keys``.
+        
+        ``rates`` maps keys to their requests in the current timing window,
+        as returned by ``client_request_rates``.
+        """
+        compiled = compiled_config()
+        settings = compiled.settings
+        level = settings['challenge_difficulty']
+        threshold = compiled.threshold_score
+        
+        with self.lock:
+            entries = [self.clients[key] for key in keys if key in self.clients]
+        if entries:
+            worst = max(entry[0] for entry in entries)
+            if worst >= threshold:
+                level = POW_DIFFICULTY + int((worst - threshold) // 10)
+            elif worst < threshold / 3 and all(entry[1] >= 2 for entry in entries):
+                level = 1
+        
+        # High-rate clients climb one level per doubling of the rate limit of their worst key
+        overshoot = 1
+        for key, rate in (rates or {}).items():
+            if key.startswith(compiled.namespace + 'prefix:'):
+                overshoot = max(overshoot, rate / settings['difficulty_prefix_rate_limit'])
+            else:
+                overshoot = max(overshoot, rate / settings['difficulty_rate_limit'])
+        if overshoot > 1:
+            level = max(level, POW_DIFFICULTY) + int(math.log2(overshoot))
+        
+        if load_mode == OverloadController.DEGRADED:
+            level += 1
+        
+        level = max(1, min(level, settings['challenge_max_difficulty']))
+        with self.lock:
+            self.issued[level] = self.issued.get(level, 0) + 1
+        return level
+
+    def stats(self):
+        with self.lock:
+            return {'tracked_keys': len(self.clients), 'issued': dict(sorted(self.issued.items()))}
+
+difficulty_scheduler = DifficultyScheduler(config['difficulty_max_clients'])
+
+def claim_challenge(challenge):
+    """Mark a proof-of-work challenge as used, returning False if it already was.
+    
+    Only genuine, unexpired challenges are recorded, so clients cannot fill
+    the filter with made-up ones; the challenge check scores those anyway.
+    The filter is shared by all workers, so a proof of work buys a single
+    check no matter which worker it is sent to.
+    """
+    if not isinstance(challenge, str) or not challenge.startswith('pow|'):
+        return True
+    if not verify_challenge_signature(challenge):
+        return True
+    return spent_challenges.add_if_absent(challenge.rsplit('|', 1)[1])
+
 # Flask routes for the anti-scraper system
-@app.route('/bot-detection/challenge', methods=['POST'])
+@protection_blueprint.route('/bot-detection/challenge', methods=['POST'])
+@shed_load
 def get_challenge():
     """Generate a challenge for the client to solve."""
     data = request.get_json()
     fingerprint = data.get('fingerprint', '')
+    keys = record_client_request(request, fingerprint)
+    difficulty = difficulty_scheduler.difficulty(keys, client_request_rates(keys), overload_controller.mode)
+    
+    if fingerprint and difficulty < POW_DIFFICULTY:
+        # Reuse the fingerprint's recent challenge; concurrent requests for the
+        # same fingerprint serialize on its shard lock and share one challenge.
+        # Proof-of-work challenges are single-use, so they are never shared
+        challenge_id, entry = challenges_by_fingerprint.get_or_create(
+            namespaced(fingerprint),
+            lambda: create_challenge(fingerprint, difficulty),
+            lambda existing: (
+                time.time() - existing[1]['created_at'] < config['challenge_coalesce_window']
+                and existing[1]['difficulty'] == difficulty
+            ),
+            ttl=config['challenge_coalesce_window']
+        )
+    else:
+        challenge_id, entry = create_challenge(fingerprint, difficulty)
+    
+    return jsonify({
+        'challenge': entry['challenge'],
+        'id': challenge_id,
+        'formats': challenge_formats()
+    })
+
+def challenge_formats():
+    """Return the /bot-detection/check encodings clients may use."""
+    return ['json', 'packed'] if config['compact_wire_format'] else ['json']
+
+def issue_signed_challenge(difficulty=None, validity=None):
+    """Issue a stateless challenge that carries its own expiry and signature.
+    
+    Every challenge is signed, so clients cannot substitute an easier one
+    of their own. Signed challenges are also embedded in /bot-protection.js
+    so a client can solve one and go straight to /bot-detection/check.
+    """
+    challenge, solution = generate_challenge(difficulty)
+    validity = config['preset_challenge_validity'] if validity is None else validity
+    body = f"{challenge}|{int(time.time()) + validity}"
+    return f"{body}|{sign_challenge(body)}", solution
+
+def verify_challenge_signature(challenge, compiled=None):
+    """Check the signature and expiry of a signed challenge."""
+    parts = challenge.split('|') if isinstance(challenge, str) else []
+    if len(parts) != 5:
+        return False
+    body, signature = challenge.rsplit('|', 1)
+    try:
+        expires = int(parts[3])
+    except ValueError:
+        return False
+    return hmac.compare_digest(sign_challenge(body, compiled), signature) and time.time() <= expires
+
+def generate_challenge(difficulty=None):
+    """Generate a challenge, returning the challenge string and its solution.
+    
+    Difficulties 1-3 are math challenges. From ``POW_DIFFICULTY`` upwards
+    the client must find a proof of work, whose solution is not known in
+    advance (None).
+    """
+    difficulty = config['challenge_difficulty'] if difficulty is None else difficulty
+    if difficulty >= POW_DIFFICULTY:
+        bits = config['pow_base_bits'] + 2 * (difficulty - POW_DIFFICULTY)
+        return f"pow|{secrets.token_hex(8)}|{bits}", None
     
     # Create a simple math challenge based on difficulty
     operations = ['add', 'sub', 'mul']
     operation = random.choice(operations)
     
     # Adjust number ranges based on difficulty
-    difficulty = config['challenge_difficulty']
-    if difficulty == 1:
+    if difficulty <= 1:
         a = random.randint(1, 10)
         b = random.randint(1, 10)
     elif difficulty == 2:
@@ -364,76 +1641,182 @@ def get_challenge():
     else:  # mul
         solution = a * b
     
+    return challenge, solution
+
+def create_challenge(fingerprint, difficulty=None):
+    """Create a new signed challenge, returning its ID and entry."""
+    challenge, solution = issue_signed_challenge(difficulty, config['challenge_ttl'])
+    
     # Create a challenge ID
     challenge_id = hashlib.md5(f"{fingerprint}:{time.time()}".encode()).hexdigest()
     
-    # Store the challenge in a database or cache
-    # For this example, we'll just use an in-memory dictionary
-    # In production, use Redis or a database
-    if not hasattr(app, 'challenges'):
-        app.challenges = {}
-    
-    app.challenges[challenge_id] = {
+    entry = {
         'challenge': challenge,
         'solution': solution,
         'created_at': time.time(),
-        'fingerprint': fingerprint
+        'fingerprint': fingerprint,
+        'difficulty': difficulty
     }
     
-    return jsonify({
-        'challenge': challenge,
-        'id': challenge_id
-    })
+    return challenge_id, entry
 
-@app.route('/bot-detection/check', methods=['POST'])
+@protection_blueprint.route('/bot-detection/check', methods=['POST'])
+@shed_load
 def check_bot():
     """Check if the client is a bot based on the provided information."""
-    data = request.get_json()
+    if request.mimetype == COMPACT_CHECK_MIMETYPE:
+        try:
+            challenge, solution, info = decode_compact_check(request.get_data())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        data = request.get_json()
+        
+        # Extract data from the request
+        challenge = data.get('challenge', '')
+        solution = data.get('solution', '')
+        info = data.get('info', {})
+    record_client_request(request, info.get('fingerprint'))
     
-    # Extract data from the request
-    challenge = data.get('challenge', '')
-    solution = data.get('solution', '')
-    info = data.get('info', {})
+    # A proof of work only buys one check; a replayed one scores like a wrong answer
+    if not claim_challenge(challenge):
+        solution = None
     
-    # Calculate bot score
-    score = calculate_bot_score(request, info, challenge, solution)
+    # Calculate bot score, using only the cheap checks when overloaded
+    degraded = g.get('load_mode') == OverloadController.DEGRADED
+    score = calculate_bot_score(request, info, challenge, solution, degraded)
+    if not degraded:
+        # Degraded scores skip most signals, so they must not feed reputation
+        shadow_scorer.submit(request, info, challenge, solution, score)
+        traffic_sketches.observe_check(
+            request.remote_addr, info.get('fingerprint', ''), request.headers.get('User-Agent', ''), score
+        )
+        difficulty_scheduler.record(client_keys(request.remote_addr, info.get('fingerprint')), score)
     
-    # Generate a token if the score is below the threshold
-    if score < config['threshold_score']:
-        token = generate_token(info.get('fingerprint', ''))
+    compiled = compiled_config()
+    validity = token_lifetime()
+    if degraded and score < compiled.block_threshold:
+        # The cheap checks can only condemn a client, never clear it: no real
+        # token is issued until the challenge and behaviour checks have run
+        return overload_page_response()
+    
+    # Generate a token if the score is below the tenant's threshold
+    if score < compiled.threshold_score:
+        token = generate_token(info.get('fingerprint', ''), validity=validity)
         return jsonify({
             'token': token,
-            'expires_in': config['token_validity']
+            'expires_in': validity
         })
     else:
         # Log the bot detection
         log_bot_detection(request, score, info)
         
         # If score is above block threshold, return a fake token
-        if score >= config['block_threshold']:
+        if score >= compiled.block_threshold:
             fake_token = ''.join(random.choices(string.ascii_letters + string.digits, k=64))
             return jsonify({
                 'token': fake_token,
-                'expires_in': config['token_validity']
+                'expires_in': validity
             })
         else:
             # Otherwise, return a real token but flag for monitoring
-            token = generate_token(info.get('fingerprint', ''), is_suspicious=True)
+            token = generate_token(info.get('fingerprint', ''), is_suspicious=True, validity=validity)
             return jsonify({
                 'token': token,
-                'expires_in': config['token_validity']
+                'expires_in': validity
             })
 
-def calculate_bot_score(request, info, challenge, solution):
-    """Calculate a score indicating how likely the client is a bot."""
-    score = 0
+@protection_blueprint.route('/bot-detection/renew', methods=['POST'])
+@shed_load
+def renew_token():
+    """Extend a valid, non-suspicious token without rescoring the client.
     
-    # 1. Check the solution to the challenge
-    if not verify_challenge_solution(challenge, solution):
-        score += 30
+    Only the signature, expiry and revocation status are checked, so a
+    renewal costs a fraction of a full check. Suspicious tokens and
+    sessions older than ``token_max_lifetime`` must go through the full
+    challenge and check again.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    elif not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    token = data.get('token') or request.headers.get('X-Protection-Token')
     
-    # 2. Check browser automation indicators
+    try:
+        payload = decode_protection_token(token) if isinstance(token, str) else None
+    except ValueError:
+        payload = None
+    now = time.time()
+    if (
+        payload is None
+        or payload.get('expires_at', 0) < now
+        or payload.get('is_suspicious')
+        or now - payload.get('created_at', 0) > config['token_max_lifetime']
+        or revocation_filter.is_revoked(token, namespaced(payload.get('fingerprint')), namespaced(request.remote_addr))
+    ):
+        return jsonify({'error': 'Token cannot be renewed'}), 403
+    
+    validity = token_lifetime()
+    renewed = generate_token(payload.get('fingerprint', ''), validity=validity, created_at=payload.get('created_at'))
+    return jsonify({
+        'token': renewed,
+        'expires_in': validity
+    })
+
+def calculate_bot_score(request, info, challenge, solution, degraded=False):
+    """Calculate a score indicating how likely the client is a bot.
+    
+    Checks run cheapest first and stop as soon as the score reaches
+    ``block_threshold``: scores only grow, so the decision can no longer change.
+    With ``degraded`` only the cheap header, IP and user agent checks run,
+    and a score below ``block_threshold`` must not earn a token.
+    """
+    stages = DEGRADED_SCORING_STAGES if degraded else SCORING_STAGES
+    score, stopped_at = run_scoring_pipeline(request, info, challenge, solution, compiled_config(), stages)
+    pipeline_stats.record(stopped_at)
+    return score
+
+def run_scoring_pipeline(request, info, challenge, solution, compiled, stages=None):
+    """Score a request against ``compiled``, returning the score and the stage it stopped at."""
+    score = 0
+    stopped_at = None
+    
+    for name, check in stages or SCORING_STAGES:
+        points = check(request, info, challenge, solution, compiled)
+        if points:
+            score += points * compiled.score_weights.get(name, 1)
+        if score >= compiled.block_threshold:
+            stopped_at = name
+            break
+    
+    # Ensure the score is within bounds
+    score = max(0, min(score, 100))
+    
+    return score, stopped_at
+
+def score_decision(score, compiled):
+    """Map a score to the decision check_bot takes for it."""
+    if score < compiled.threshold_score:
+        return 'allow'
+    if score < compiled.block_threshold:
+        return 'flag'
+    return 'block'
+
+def _score_honeypots(request, info, challenge, solution, compiled):
+    # A filled honeypot field is proof of automation on its own
+    return 100 if honeypot_filled(request, compiled, info) else 0
+
+def _score_ip_deny(request, info, challenge, solution, compiled):
+    return 50 if request.remote_addr in compiled.ip_blacklist else 0
+
+def _score_ua_blacklist(request, info, challenge, solution, compiled):
+    return 20 if compiled.user_agent_blacklist.search(request.headers.get('User-Agent', '')) else 0
+
+def _score_automation(request, info, challenge, solution, compiled):
+    # Check browser automation indicators
     automation = info.get('automationIndicators', {})
+    score = 0
     if automation.get('webdriver', False):
         score += 25
     if automation.get('selenium', False):
@@ -446,17 +1829,72 @@ def calculate_bot_score(request, info, challenge, solution):
         score += 25
     if automation.get('headless', False):
         score += 20
+    return score
+
+def _score_headers(request, info, challenge, solution, compiled):
+    score = 0
     
-    # 3. Check user agent
-    user_agent = request.headers.get('User-Agent', '')
-    for blacklisted_ua in config['user_agent_blacklist']:
-        if blacklisted_ua.lower() in user_agent.lower():
-            score += 20
-            break
+    # Check suspicious headers
+    for header in compiled.suspicious_headers:
+        if header in request.headers:
+            score += 5
+    
+    # Check for missing headers that normal browsers would have
+    for header in ('Accept', 'Accept-Language', 'Accept-Encoding'):
+        if header not in request.headers:
+            score += 10
+    return score
+
+def _score_behavior(request, info, challenge, solution, compiled):
+    score = 0
+    
+    # Check for cookies
+    if not info.get('cookiesEnabled', True):
+        score += 15
+    
+    # Check user behavior if available
+    user_activity = info.get('userActivity', {})
+    if compiled.track_mouse and user_activity.get('mouseMovements', 0) < 3:
+        score += 10
+    
+    if compiled.track_scroll and user_activity.get('scrollEvents', 0) < 1:
+        score += 10
     
+    if user_activity.get('keyPresses', 0) < 1:
+        score += 5
+    return score
+
+def _score_challenge(request, info, challenge, solution, compiled):
+    if not verify_challenge_signature(challenge, compiled):
+        return 30
+    if verify_challenge_solution(challenge, solution):
+        return 0
+    # Proofs of work go to clients that are already suspect or too fast;
+    # skipping one must not be cheaper than solving it
+    return compiled.threshold_score if challenge.startswith('pow|') else 30
+
+def _score_timing(request, info, challenge, solution, compiled):
+    # Check time between requests
+    stats = timing_tracker.stats(timing_key(request, info.get('fingerprint'), compiled.namespace))
+    return calculate_timing_score(stats, compiled.rate_limits['default'])
+
+def _score_ip_reputation(request, info, challenge, solution, compiled):
+    return ip_reputation_score(request.remote_addr)
+
+def parse_user_agent(user_agent):
+    """Parse a user agent string with ``user_agents``.
+
+    The package compiles hundreds of regexes when imported, so it is loaded
+    on the first parse (or by ``preload`` before forking) rather than with
+    this module.
+    """
+    from user_agents import parse
+    return parse(user_agent)
+
+def _score_ua_consistency(request, info, challenge, solution, compiled):
     # Parse user agent for inconsistencies
     try:
-        parsed_ua = parse(user_agent)
+        parsed_ua = parse_user_agent(request.headers.get('User-Agent', ''))
         
         # Check for inconsistent browser/OS combinations
         browser = parsed_ua.browser.family
@@ -469,55 +1907,401 @@ def calculate_bot_score(request, info, challenge, solution):
         ]
         
         if any(inconsistent_combos):
-            score += 25
+            return 25
     except:
         # Error parsing user agent - suspicious
-        score += 10
-    
-    # 4. Check IP reputation (in a real system, check against IP reputation databases)
-    ip = request.remote_addr
-    if ip in config['ip_blacklist']:
-        score += 50
-    
-    # 5. Check suspicious headers
-    for header in config['suspicious_headers']:
-        if header in request.headers:
-            score += 5
+        return 10
+    return 0
+
+# Scoring stages in order of increasing cost
+SCORING_STAGES = [
+    ('honeypot', _score_honeypots),
+    ('ip_deny', _score_ip_deny),
+    ('ua_blacklist', _score_ua_blacklist),
+    ('automation', _score_automation),
+    ('headers', _score_headers),
+    ('behavior', _score_behavior),
+    ('challenge', _score_challenge),
+    ('timing', _score_timing),
+    ('ip_reputation', _score_ip_reputation),
+    ('ua_consistency', _score_ua_consistency),
+]
+
+# Stages kept when shedding load: no challenge, behaviour, timing or UA parsing.
+# They can only block a client; clients they do not block get the protection page
+DEGRADED_SCORING_STAGES = [
+    stage for stage in SCORING_STAGES
+    if stage[0] in ('ip_deny', 'ua_blacklist', 'headers', 'ip_reputation')
+]
+
+class PipelineStats:
+    """Counts how often the scoring pipeline stops after each stage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.evaluations = 0
+        self.short_circuits = {}
+
+    def record(self, stage):
+        with self.lock:
+            self.evaluations += 1
+            if stage:
+                self.short_circuits[stage] = self.short_circuits.get(stage, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {'evaluations': self.evaluations, 'short_circuits': dict(self.short_circuits)}
+
+pipeline_stats = PipelineStats()
+
+def honeypot_filled(request, compiled, info=None):
+    """Check whether a honeypot field was filled in the form, JSON body or check info."""
+    sources = [request.form]
+    data = request.get_json(silent=True) if request.is_json else None
+    if isinstance(data, dict):
+        sources.append(data)
+    if isinstance(info, dict):
+        sources.append(info)
+    return any(source.get(field) for source in sources for field in compiled.honeypot_fields)
+
+# Generated before workers fork, so every worker signs with the same key
+_generated_token_secret = secrets.token_bytes(32)
+
+class CompiledConfig:
+    """Lookup structures derived from ``config`` once instead of per request.
     
-    # 6. Check for missing headers that normal browsers would have
-    required_headers = ['Accept', 'Accept-Language', 'Accept-Encoding']
-    for header in required_headers:
-        if header not in request.headers:
-            score += 10
+    One is compiled per tenant from ``config`` merged with the tenant's
+    settings. ``namespace`` prefixes the tenant's keys in the shared stores
+    and ``token_key`` signs its tokens and challenges, so tenants never
+    accept each other's tokens. A tenant signs with the ``token_secret`` of
+    its own settings if it has one; otherwise its key is derived from the
+    global secret and its name, never the global key itself.
+    """
+
+    __slots__ = (
+        'tenant', 'namespace', 'settings', 'tenant_settings', 'token_key', 'rate_limits',
+        'threshold_score', 'block_threshold', 'score_weights', 'honeypot_fields', 'ip_blacklist', 'user_agent_blacklist',
+        'suspicious_headers', 'track_mouse', 'track_scroll',
+    )
+
+    def __init__(self, settings, tenant=None, tenant_settings=None):
+        self.tenant = tenant
+        self.namespace = f"{tenant}/" if tenant else ''
+        self.settings = types.MappingProxyType(dict(settings))
+        self.tenant_settings = types.MappingProxyType(dict(tenant_settings or {}))
+        own_secret = self.tenant_settings.get('token_secret') if tenant else None
+        secret = own_secret or settings['token_secret'] or _generated_token_secret
+        secret = secret.encode() if isinstance(secret, str) else secret
+        if tenant and not own_secret:
+            secret = hmac.new(secret, f"tenant:{tenant}".encode(), hashlib.sha256).digest()
+        self.token_key = secret
+        self.rate_limits = types.MappingProxyType(dict(settings['rate_limits']))
+        self.threshold_score = settings['threshold_score']
+        self.block_threshold = settings['block_threshold']
+        self.score_weights = dict(settings['score_weights'])
+        self.honeypot_fields = tuple(settings['honeypot_fields'])
+        self.ip_blacklist = frozenset(settings['ip_blacklist'])
+        self.user_agent_blacklist = re.compile(
+            '|'.join(re.escape(ua) for ua in settings['user_agent_blacklist']) or '(?!)', re.IGNORECASE
+        )
+        self.suspicious_headers = tuple(settings['suspicious_headers'])
+        self.track_mouse = settings['track_mouse']
+        self.track_scroll = settings['track_scroll']
+
+class TenantRegistry:
+    """Compiled configs for the default site and every tenant, indexed by host and API key."""
+
+    def __init__(self, settings):
+        self.default = CompiledConfig(settings)
+        self.tenants = {}
+        self.by_host = {}
+        self.by_api_key = {}
+        for name, tenant in settings['tenants'].items():
+            overrides = tenant.get('settings', {})
+            compiled = self.tenants[name] = CompiledConfig(dict(settings, **overrides), name, overrides)
+            for host in tenant.get('hosts', ()):
+                self.by_host[host.lower()] = compiled
+            for api_key in tenant.get('api_keys', ()):
+                self.by_api_key[api_key] = compiled
+
+    def resolve(self, host, api_key=None):
+        """Return the compiled config for a request's API key or Host header."""
+        if api_key and api_key in self.by_api_key:
+            return self.by_api_key[api_key]
+        if host:
+            # Drop the port; IPv6 literals keep their brackets
+            host = host.lower()
+            host = host[:host.index(']') + 1] if host.startswith('[') else host.partition(':')[0]
+            return self.by_host.get(host, self.default)
+        return self.default
+
+# Settings that an app can override for itself through its own registry;
+# the others size or drive state shared by every app in the process
+APP_SETTINGS = frozenset({
+    'token_secret', 'rate_limits', 'threshold_score', 'block_threshold', 'score_weights', 'honeypot_fields',
+    'ip_blacklist', 'user_agent_blacklist', 'suspicious_headers', 'track_mouse', 'track_scroll', 'tenants',
+})
+
+_tenant_registry = None
+
+def tenant_registry(flask_app=None):
+    """Return the tenant registry of ``flask_app`` (the current app by default).
     
-    # 7. Check for cookies
-    if not info.get('cookiesEnabled', True):
-        score += 15
+    Apps built with their own settings get a registry compiled from
+    ``config`` merged with them, recompiled after ``reload_config``; all
+    other apps share the one compiled from ``config`` on first use.
+    """
+    global _tenant_registry
+    if _tenant_registry is None:
+        _tenant_registry = TenantRegistry(config)
+    if flask_app is None:
+        if not has_app_context():
+            return _tenant_registry
+        flask_app = current_app
+    own = flask_app.extensions.get('anti_scraper')
+    if own is None:
+        return _tenant_registry
+    settings, base, registry = own
+    if base is not _tenant_registry:
+        registry = TenantRegistry(dict(config, **settings))
+        flask_app.extensions['anti_scraper'] = (settings, _tenant_registry, registry)
+    return registry
+
+def compiled_config():
+    """Return the compiled config of the current request's tenant.
     
-    # 8. Check user behavior if available
-    user_activity = info.get('userActivity', {})
-    if config['track_mouse'] and user_activity.get('mouseMovements', 0) < 3:
-        score += 10
+    The tenant is resolved once per request from the ``X-API-Key`` or
+    ``Host`` header of the current app's registry; outside a request this
+    is the registry's default config.
+    """
+    registry = tenant_registry()
+    if not has_request_context():
+        return registry.default
+    compiled = g.get('tenant')
+    if compiled is None:
+        compiled = g.tenant = registry.resolve(request.host, request.headers.get('X-API-Key'))
+    return compiled
+
+def namespaced(key, compiled=None):
+    """Prefix ``key`` with the tenant's namespace (the current one by default); empty keys stay empty."""
+    return (compiled or compiled_config()).namespace + key if key else key
+
+def reload_config():
+    """Recompile ``config`` and the tenants; call after changing them at runtime."""
+    global _tenant_registry
+    _tenant_registry = TenantRegistry(config)
+    shadow_scorer.configure(config['shadow_configs'])
+    return _tenant_registry.default
+
+class ShadowRequest:
+    """Copy of the request fields the scoring stages read, safe to use off the request thread."""
+
+    __slots__ = ('remote_addr', 'headers', 'form', 'is_json', '_json', 'tenant')
+
+    def __init__(self, request):
+        self.tenant = compiled_config()
+        self.remote_addr = request.remote_addr
+        self.headers = Headers(request.headers)
+        self.form = request.form.copy()
+        self.is_json = request.is_json
+        self._json = request.get_json(silent=True) if request.is_json else None
+
+    def get_json(self, silent=False):
+        return self._json
+
+class ShadowScorer:
+    """Scores live checks against candidate configs on background threads.
+
+    The request path only copies the scoring inputs onto a bounded queue and
+    never waits: when the queue is full the evaluation is dropped and
+    counted. Workers score each item against every candidate and tally how
+    often the candidate's decision differs from the live one.
+    """
+
+    def __init__(self, candidates, queue_size, workers):
+        self.queue = queue.Queue(queue_size)
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pid = None
+        self.dropped = 0
+        self.candidates = {}
+        self.overrides = {}
+        self.tenant_candidates = {}
+        self.results = {}
+        self.configure(candidates)
+
+    def configure(self, candidates):
+        """Compile the candidate configs, resetting their results."""
+        compiled = {name: CompiledConfig(dict(config, **overrides)) for name, overrides in candidates.items()}
+        with self.lock:
+            self.candidates = compiled
+            self.overrides = dict(candidates)
+            self.tenant_candidates = {}
+            self.results = {
+                name: {'evaluated': 0, 'agreed': 0, 'score_delta': 0, 'changes': {}}
+                for name in compiled
+            }
+
+    def _ensure_workers(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            for _ in range(self.workers):
+                threading.Thread(target=self._work, daemon=True).start()
+            self.pid = os.getpid()
+
+    def submit(self, request, info, challenge, solution, live_score):
+        """Queue a live check for shadow scoring without ever blocking."""
+        if not self.candidates:
+            return
+        self._ensure_workers()
+        try:
+            self.queue.put_nowait((ShadowRequest(request), info, challenge, solution, live_score))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _work(self):
+        while True:
+            shadow_request, info, challenge, solution, live_score = self.queue.get()
+            try:
+                self._evaluate(shadow_request, info, challenge, solution, live_score)
+            except Exception:
+                logger.exception("Shadow scoring failed")
+
+    def _candidates_for(self, tenant):
+        # Candidates apply their overrides on top of the tenant's own settings
+        if tenant.tenant is None:
+            return list(self.candidates.items())
+        with self.lock:
+            candidates = self.tenant_candidates.get(tenant.tenant)
+            if candidates is None:
+                candidates = self.tenant_candidates[tenant.tenant] = [
+                    (name, CompiledConfig(dict(tenant.settings, **overrides), tenant.tenant, tenant.tenant_settings))
+                    for name, overrides in self.overrides.items()
+                ]
+            return candidates
+
+    def _evaluate(self, shadow_request, info, challenge, solution, live_score):
+        live_decision = score_decision(live_score, shadow_request.tenant)
+        candidates = self._candidates_for(shadow_request.tenant)
+        
+        for name, compiled in candidates:
+            score, _ = run_scoring_pipeline(shadow_request, info, challenge, solution, compiled)
+            decision = score_decision(score, compiled)
+            with self.lock:
+                result = self.results.get(name)
+                if result is None:
+                    continue
+                result['evaluated'] += 1
+                result['score_delta'] += score - live_score
+                if decision == live_decision:
+                    result['agreed'] += 1
+                else:
+                    change = f"{live_decision}->{decision}"
+                    result['changes'][change] = result['changes'].get(change, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            results = {}
+            for name, result in self.results.items():
+                evaluated = result['evaluated']
+                results[name] = {
+                    'evaluated': evaluated,
+                    'agreed': result['agreed'],
+                    'disagreement_rate': (evaluated - result['agreed']) / evaluated if evaluated else 0.0,
+                    'mean_score_delta': result['score_delta'] / evaluated if evaluated else 0.0,
+                    'changes': dict(result['changes']),
+                }
+            return {'queued': self.queue.qsize(), 'dropped': self.dropped, 'candidates': results}
+
+shadow_scorer = ShadowScorer(config['shadow_configs'], config['shadow_queue_size'], config['shadow_workers'])
+
+def timing_key(request, fingerprint=None, namespace=None):
+    """Identify a client for request timing by fingerprint, token or IP within its tenant."""
+    namespace = compiled_config().namespace if namespace is None else namespace
+    if fingerprint:
+        return namespace + 'fingerprint:' + fingerprint
+    token = request.headers.get('X-Protection-Token')
+    if token:
+        return namespace + 'token:' + token
+    return namespace + 'ip:' + str(request.remote_addr)
+
+def record_client_request(request, fingerprint=None):
+    """Record a request for timing under the client's timing key and reputation keys, and return the latter."""
+    keys = client_keys(request.remote_addr, fingerprint)
+    for key in keys:
+        timing_tracker.record(key)
+    key = timing_key(request, fingerprint)
+    if key not in keys:
+        timing_tracker.record(key)
+    return keys
+
+def client_request_rates(keys):
+    """Map each tracked key of a client to its requests in the current timing window."""
+    rates = {}
+    for key in keys:
+        stats = timing_tracker.stats(key)
+        if stats:
+            rates[key] = stats['window_requests']
+    return rates
+
+def calculate_timing_score(stats, rate_limit=None):
+    """Score a client's request timing statistics."""
+    if not stats:
+        return 0
     
-    if config['track_scroll'] and user_activity.get('scrollEvents', 0) < 1:
-        score += 10
+    score = 0
     
-    if user_activity.get('keyPresses', 0) < 1:
+    # Sustained bursts above the default rate limit
+    if stats['window_requests'] > (config['rate_limits']['default'] if rate_limit is None else rate_limit):
+        score += 15
+    elif stats['bursts']:
         score += 5
     
-    # 9. Check time between requests (requires server-side session tracking)
-    # This would be implemented in a real system
-    
-    # Ensure the score is within bounds
-    score = max(0, min(score, 100))
+    if stats['requests'] - 1 >= config['timing_min_samples']:
+        # Requests arriving faster than a human would navigate
+        if stats['ewma_interval'] < config['timing_min_interval']:
+            score += 10
+        
+        # Intervals that are too regular to come from a person
+        mean = stats['mean_interval']
+        if mean > 0 and stats['stddev_interval'] / mean < config['timing_regularity_cv']:
+            score += 15
     
     return score
 
+_ip_reputation_db = None
+_ip_reputation_lock = threading.Lock()
+
+def load_ip_reputation_db():
+    """Map the configured IP reputation database, once per process.
+
+    Call this before forking workers so they all share the same mapping.
+    """
+    global _ip_reputation_db
+    if _ip_reputation_db is None and config['ip_reputation_db']:
+        with _ip_reputation_lock:
+            if _ip_reputation_db is None:
+                _ip_reputation_db = IPReputationDB(config['ip_reputation_db'])
+                logger.info(f"Loaded {len(_ip_reputation_db)} IP reputation ranges")
+    return _ip_reputation_db
+
+def ip_reputation_score(ip):
+    """Look up the reputation score of an IP (0 if no database is configured)."""
+    db = load_ip_reputation_db()
+    return db.lookup(ip) if db else 0
+
 def verify_challenge_solution(challenge, solution):
     """Verify the solution to the provided challenge."""
     try:
         parts = challenge.split('|')
         operation = parts[0]
+        if operation == 'pow':
+            return verify_proof_of_work(parts[1], int(parts[2]), solution)
         a = int(parts[1])
         b = int(parts[2])
         
@@ -533,28 +2317,257 @@ def verify_challenge_solution(challenge, solution):
     except:
         return False
 
-def generate_token(fingerprint, is_suspicious=False):
+def token_lifetime():
+    """Pick a validity for a new token, jittered so tokens issued together expire apart.
+    
+    The jitter only shortens tokens, so no token outlives ``token_validity``
+    and the revocation filter's window still covers all of them.
+    """
+    validity = config['token_validity']
+    return int(validity * (1 - random.uniform(0, config['token_validity_jitter'])))
+
+def verify_proof_of_work(nonce, bits, solution):
+    """Check that SHA-256 of ``nonce:solution`` starts with ``bits`` zero bits."""
+    solution = str(solution)
+    if not solution.isdigit() or len(solution) > 20:
+        return False
+    digest = hashlib.sha256(f"{nonce}:{solution}".encode()).digest()
+    return int.from_bytes(digest, 'big') >> (256 - bits) == 0
+
+def generate_token(fingerprint, is_suspicious=False, validity=None, created_at=None):
     """Generate a token for the client."""
+    now = time.time()
+    
     # Create a payload
     payload = {
         'fingerprint': fingerprint,
-        'created_at': time.time(),
-        'expires_at': time.time() + config['token_validity'],
+        'created_at': now if created_at is None else created_at,
+        'expires_at': now + (config['token_validity'] if validity is None else validity),
         'is_suspicious': is_suspicious
     }
     
-    # In production, you'd encrypt this token or use JWT
-    # For this example, we'll just use base64 encoding
+    # Sign the base64 payload so any worker can verify it without a store;
+    # the revocation filter is the only server-side state a token has
     token_str = json.dumps(payload)
-    token = base64.b64encode(token_str.encode()).decode()
-    
-    # Store the token (in a real system, use Redis or a database)
-    if not hasattr(app, 'tokens'):
-        app.tokens = {}
-        
-    app.tokens[token] = payload
+    encoded = base64.b64encode(token_str.encode()).decode()
+    return f"{encoded}.{sign_token(encoded)}"
+
+def sign_message(domain, message, compiled=None):
+    """MAC ``message`` with the tenant's key, prefixed by ``domain`` so that
+    a signature made for one kind of message never verifies as another."""
+    key = (compiled or compiled_config()).token_key
+    return hmac.new(key, domain + b':' + message.encode(), hashlib.sha256).hexdigest()[:32]
+
+def sign_token(encoded_payload, compiled=None):
+    """Compute the signature of an encoded token payload with the tenant's key."""
+    return sign_message(b'token', encoded_payload, compiled)
+
+def sign_challenge(body, compiled=None):
+    """Compute the signature of a signed challenge's body with the tenant's key."""
+    return sign_message(b'challenge', body, compiled)
+
+class DetectionLogSampler:
+    """Per-key rate limiting and sampling of detection log records.
     
-    return token
+    Each detection is keyed by its IP and user agent. While every key is
+    under its rate for the current window the detection is logged;
+    beyond that only ``sample_rate`` of them are, and the rest are counted.
+    When a key's window ends, one summary record reports how many of its
+    detections were suppressed.
+    """
+
+    def __init__(self, rates, interval, sample_rate, max_keys):
+        self.rates = rates
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.windows = OrderedDict()  # (kind, key) -> [window start, logged, suppressed]
+        self.pending = []  # (kind, key, suppressed) summaries waiting to be logged
+        self.logged = 0
+        self.suppressed = 0
+
+    def _window(self, name, now):
+        window = self.windows.get(name)
+        if window is None:
+            window = self.windows[name] = [now, 0, 0]
+            if len(self.windows) > self.max_keys:
+                evicted, (_, _, suppressed) = self.windows.popitem(last=False)
+                if suppressed:
+                    self.pending.append(evicted + (suppressed,))
+        else:
+            self.windows.move_to_end(name)
+            if now - window[0] >= self.interval:
+                if window[2]:
+                    self.pending.append(name + (window[2],))
+                window[:] = [now, 0, 0]
+        return window
+
+    def allow(self, keys, now=None):
+        """Decide whether to log a detection for ``keys``, a ``{kind: key}`` dict."""
+        now = time.time() if now is None else now
+        with self.lock:
+            windows = [
+                (self._window((kind, key), now), self.rates[kind])
+                for kind, key in keys.items() if kind in self.rates
+            ]
+            allowed = all(window[1] < rate for window, rate in windows) or random.random() < self.sample_rate
+            for window, rate in windows:
+                if allowed:
+                    window[1] += 1
+                elif window[1] >= rate:
+                    window[2] += 1
+            if allowed:
+                self.logged += 1
+            else:
+                self.suppressed += 1
+        return allowed
+
+    def flush(self, now=None):
+        """Close finished windows and log their suppression summaries."""
+        now = time.time() if now is None else now
+        with self.lock:
+            for name, window in self.windows.items():
+                if window[2] and now - window[0] >= self.interval:
+                    self.pending.append(name + (window[2],))
+                    window[2] = 0
+            pending, self.pending = self.pending, []
+        for kind, key, suppressed in pending:
+            logger.warning(
+                "Suppressed %d bot detection log records for %s %s",
+                suppressed, kind, key,
+                extra={'detection_summary': {'kind': kind, 'key': key, 'suppressed': suppressed}},
+            )
+
+    def stats(self):
+        with self.lock:
+            return {'logged': self.logged, 'suppressed': self.suppressed, 'tracked_keys': len(self.windows)}
+
+detection_log_sampler = DetectionLogSampler(
+    config['detection_log_rates'],
+    config['detection_log_interval'],
+    config['detection_log_sample_rate'],
+    config['detection_log_max_keys'],
+)
+janitor.tasks.append(detection_log_sampler.flush)
+
+class DetectionBroadcaster:
+    """Fans detections out to stream subscribers from a single ring buffer.
+
+    Publishing writes an event into the next slot of a fixed-size ring and
+    never waits for subscribers. Each subscriber only keeps a cursor into
+    the ring; one that falls a full ring behind has missed events and is
+    disconnected, so a slow consumer never makes anything buffer on its
+    behalf. Detections are also totalled per second and tenant, and each
+    finished second is published as a summary event.
+    """
+
+    SUMMARY_MAX_IPS = 1000  # Distinct IPs counted per summary; further IPs only add to the totals
+
+    def __init__(self, capacity, max_subscribers):
+        self.capacity = capacity
+        self.max_subscribers = max_subscribers
+        self.ring = [None] * capacity  # [sequence, event, serialized event or None]
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.subscribers = 0
+        self.dropped = 0
+        self.second = None
+        self.summaries = {}  # tenant -> [detections, score sum, max score, {ip: detections}]
+
+    def _append(self, event):
+        self.sequence += 1
+        self.ring[self.sequence % self.capacity] = [self.sequence, event, None]
+
+    def _close_second(self, second):
+        for tenant, (count, score_sum, max_score, ips) in self.summaries.items():
+            self._append({
+                'type': 'summary',
+                'tenant': tenant,
+                'second': self.second,
+                'detections': count,
+                'mean_score': round(score_sum / count, 1),
+                'max_score': max_score,
+                'ips': len(ips),
+                'top_ips': sorted(ips.items(), key=lambda item: item[1], reverse=True)[:5],
+            })
+        self.summaries = {}
+        self.second = second
+
+    def publish(self, detection, tenant=None, now=None):
+        """Add a detection to the ring and wake the subscribers."""
+        if not self.capacity:
+            return
+        second = int(time.time() if now is None else now)
+        with self.condition:
+            if second != self.second:
+                self._close_second(second)
+            summary = self.summaries.get(tenant)
+            if summary is None:
+                summary = self.summaries[tenant] = [0, 0, 0, {}]
+            summary[0] += 1
+            summary[1] += detection['score']
+            summary[2] = max(summary[2], detection['score'])
+            ips = summary[3]
+            if detection['ip'] in ips or len(ips) < self.SUMMARY_MAX_IPS:
+                ips[detection['ip']] = ips.get(detection['ip'], 0) + 1
+            self._append(dict(detection, type='detection', tenant=tenant))
+            self.condition.notify_all()
+
+    def tick(self, now=None):
+        """Publish the summary of a finished second even if no detection followed it."""
+        second = int(time.time() if now is None else now)
+        with self.condition:
+            if self.summaries and second != self.second:
+                self._close_second(second)
+                self.condition.notify_all()
+
+    def subscribe(self):
+        """Reserve a subscriber slot, returning False when all are taken."""
+        with self.condition:
+            if self.subscribers >= self.max_subscribers or not self.capacity:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def start(self, last_sequence=None):
+        """Return the cursor a new subscriber starts from, resuming if still possible."""
+        with self.condition:
+            if last_sequence is not None and 0 <= self.sequence - last_sequence <= self.capacity:
+                return last_sequence
+            return self.sequence
+
+    def read(self, cursor, timeout):
+        """Return the entries published after ``cursor``, waiting up to ``timeout`` for one.
+
+        Returns ``(None, sequence)`` if the subscriber has fallen a full
+        ring behind and must be dropped.
+        """
+        with self.condition:
+            if self.sequence == cursor:
+                self.condition.wait(timeout)
+            sequence = self.sequence
+            if sequence - cursor > self.capacity:
+                self.dropped += 1
+                return None, sequence
+            entries = [self.ring[position % self.capacity] for position in range(cursor + 1, sequence + 1)]
+        return entries, sequence
+
+    def stats(self):
+        with self.condition:
+            return {
+                'published': self.sequence,
+                'subscribers': self.subscribers,
+                'dropped_subscribers': self.dropped,
+                'buffer': self.capacity,
+            }
+
+detection_broadcaster = DetectionBroadcaster(config['detection_stream_buffer'], config['detection_stream_max_subscribers'])
+janitor.tasks.append(detection_broadcaster.tick)
 
 def log_bot_detection(request, score, info):
     """Log bot detection for analysis and improvement."""
@@ -564,47 +2577,684 @@ def log_bot_detection(request, score, info):
         'user_agent': request.headers.get('User-Agent', ''),
         'score': score,
         'fingerprint': info.get('fingerprint', ''),
-        'automation_indicators': info.get('automationIndicators', {}),
+        'automation_indicators': dict(info.get('automationIndicators', {})),
         'headers': dict(request.headers)
     }
     
     # In production, store this in a database
-    # For this example, we'll just log it
-    logger.warning(f"Bot detected: {detection}")
+    # For this example, we'll just log it, sampled per IP and user agent.
+    # The full record travels in ``extra`` for structured handlers, and the
+    # message is only formatted if a handler actually emits it
+    if detection_log_sampler.allow({'ip': detection['ip'], 'user_agent': detection['user_agent']}):
+        logger.warning(
+            "Bot detected: ip=%s score=%s fingerprint=%s user_agent=%s",
+            detection['ip'], score, detection['fingerprint'], detection['user_agent'],
+            extra={'detection': detection},
+        )
     
-    # Track in memory for demonstration
-    ip = request.remote_addr
-    if ip not in detected_bots:
-        detected_bots[ip] = []
+    # Track in memory for demonstration: the newest detections of each IP,
+    # dropping those older than the retention so a busy IP's list stays bounded
+    cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=config['detection_retention'])).isoformat()
+    detected_bots.append(
+        namespaced(request.remote_addr), detection, time.time() + config['detection_retention'],
+        limit=config['detections_per_ip'], is_stale=lambda old: old['timestamp'] < cutoff,
+    )
+    traffic_sketches.observe_detection(request.remote_addr, score)
+    detection_broadcaster.publish(detection, compiled_config().tenant)
+
+class RevocationFilter:
+    """Time-bucketed Bloom filter of revoked tokens, fingerprints and IPs.
+
+    The token validity window is split into ``buckets`` time slices. A
+    revocation is written into the slice for the current time and stays
+    visible until every token that could have been issued before it has
+    expired, after which the slice is recycled. Lookups probe a fixed number
+    of bits, so checking a token costs the same no matter how many entries
+    have been revoked.
+
+    The bit arrays live in an anonymous shared mmap, so a filter created
+    before the server forks its workers is shared by all of them.
+    """
+
+    _EPOCH = struct.Struct('<q')
+
+    def __init__(self, validity, capacity, error_rate, buckets):
+        self.span = max(1, int(math.ceil(validity / buckets)))
+        self.slots = buckets + 1
+        self.bits = max(64, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.bits += -self.bits % 8
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.slot_bytes = self.bits // 8
+        self.header_bytes = self._EPOCH.size * self.slots
+        self.memory = mmap.mmap(-1, self.header_bytes + self.slot_bytes * self.slots)
+        for slot in range(self.slots):
+            self._EPOCH.pack_into(self.memory, slot * self._EPOCH.size, -1)
+        self.lock = multiprocessing.Lock()
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _slot_epoch(self, slot):
+        return self._EPOCH.unpack_from(self.memory, slot * self._EPOCH.size)[0]
+
+    def _add(self, key, now):
+        # Callers hold the lock
+        epoch = int(now // self.span)
+        slot = epoch % self.slots
+        base = self.header_bytes + slot * self.slot_bytes
+        if self._slot_epoch(slot) != epoch:
+            self.memory[base:base + self.slot_bytes] = bytes(self.slot_bytes)
+            self._EPOCH.pack_into(self.memory, slot * self._EPOCH.size, epoch)
+        for pos in self._positions(key):
+            self.memory[base + (pos >> 3)] |= 1 << (pos & 7)
+
+    def add(self, key, now=None):
+        """Revoke ``key`` for at least one full token validity window."""
+        with self.lock:
+            self._add(key, time.time() if now is None else now)
+
+    def add_if_absent(self, key, now=None):
+        """Add ``key`` unless it is already present, returning whether it was added.
+        
+        The check and the insert happen under the cross-process lock, so of
+        several workers adding the same key at once exactly one succeeds.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            if self._contains(key, self._live_bases(now)):
+                return False
+            self._add(key, now)
+            return True
+
+    def _live_bases(self, now=None):
+        """Return the offsets of the slots that still hold live revocations."""
+        current = int((time.time() if now is None else now) // self.span)
+        return [
+            self.header_bytes + slot * self.slot_bytes
+            for slot in range(self.slots)
+            if 0 <= current - self._slot_epoch(slot) < self.slots
+        ]
+
+    def _contains(self, key, bases):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        memory, bits = self.memory, self.bits
+        for base in bases:
+            # Positions are generated lazily: most absent keys miss on the first bit
+            for i in range(self.hashes):
+                pos = (h1 + i * h2) % bits
+                if not memory[base + (pos >> 3)] & (1 << (pos & 7)):
+                    break
+            else:
+                return True
+        return False
+
+    def __contains__(self, key):
+        bases = self._live_bases()
+        return bool(bases) and self._contains(key, bases)
+
+    def revoke(self, token=None, fingerprint=None, ip=None):
+        """Revoke a token, every token bound to a fingerprint, or an IP."""
+        if token:
+            self.add('token:' + token)
+        if fingerprint:
+            self.add('fingerprint:' + fingerprint)
+        if ip:
+            self.add('ip:' + ip)
+
+    def is_revoked(self, token=None, fingerprint=None, ip=None):
+        """Check whether any of the given identifiers has been revoked."""
+        # Skip hashing entirely while nothing has been revoked in the window
+        bases = self._live_bases()
+        if not bases:
+            return False
+        return bool(
+            (token and self._contains('token:' + token, bases))
+            or (fingerprint and self._contains('fingerprint:' + fingerprint, bases))
+            or (ip and self._contains('ip:' + ip, bases))
+        )
+
+# Created at import time so that forked workers share the same filter
+revocation_filter = RevocationFilter(
+    config['token_validity'],
+    config['revocation_capacity'],
+    config['revocation_error_rate'],
+    config['revocation_buckets'],
+)
+
+# Proofs of work already used for a check, kept at least as long as any
+# signed challenge stays valid
+spent_challenges = RevocationFilter(
+    max(config['challenge_ttl'], config['preset_challenge_validity']),
+    config['spent_challenge_capacity'],
+    config['spent_challenge_error_rate'],
+    config['revocation_buckets'],
+)
+
+def decode_protection_token(token, compiled=None):
+    """Return the payload of a correctly signed token, or None."""
+    # Verify the signature before trusting anything in the payload
+    encoded, _, signature = token.rpartition('.')
+    if not encoded or not hmac.compare_digest(signature, sign_token(encoded, compiled)):
+        return None
     
-    detected_bots[ip].append(detection)
+    token_str = base64.b64decode(encoded.encode()).decode()
+    return json.loads(token_str)
 
-def verify_protection_token(token):
-    """Verify a protection token."""
+def verify_protection_token(token, ip=None, compiled=None):
+    """Verify a protection token for the current tenant, or for ``compiled``."""
     if not token:
         return False
     
-    # In production, you'd decrypt the token or verify the JWT
-    # For this example, we'll just decode the base64
+    compiled = compiled or compiled_config()
     try:
-        token_str = base64.b64decode(token.encode()).decode()
-        payload = json.loads(token_str)
+        payload = decode_protection_token(token, compiled)
+        if payload is None:
+            return False
         
         # Check if the token is expired
         if payload.get('expires_at', 0) < time.time():
             return False
         
-        # Verify the token in our store
-        if not hasattr(app, 'tokens') or token not in app.tokens:
+        # Reject tokens that were revoked directly, via their fingerprint or via the client IP
+        if revocation_filter.is_revoked(token, namespaced(payload.get('fingerprint'), compiled), namespaced(ip, compiled)):
             return False
         
         # If the token is for a suspicious client, we may want to
         # add additional checks here
         
+        token_cache.put(namespaced(token, compiled), payload)
         return True
     except:
         return False
 
+class VerifiedTokenCache:
+    """Bounded LRU of tokens that already passed full verification.
+
+    Entries are keyed by a digest of the token and hold only what later
+    checks need (expiry, suspicious flag, fingerprint), so a returning
+    session is verified with one hash lookup instead of a base64 decode,
+    JSON parse and signature check.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, token, payload):
+        key = self._key(token)
+        entry = (payload.get('expires_at', 0), payload.get('is_suspicious', False), payload.get('fingerprint'))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, token):
+        with self.lock:
+            self.entries.pop(self._key(token), None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'capacity': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+token_cache = VerifiedTokenCache(config['token_cache_size'])
+
+def verify_cached_protection_token(token, ip=None, compiled=None):
+    """Verify a token through the verified-token cache, falling back to full verification."""
+    compiled = compiled or compiled_config()
+    entry = token_cache.get(namespaced(token, compiled)) if token else None
+    if entry is None:
+        return verify_protection_token(token, ip, compiled)
+    
+    expires_at, is_suspicious, fingerprint = entry
+    if expires_at < time.time():
+        token_cache.discard(namespaced(token, compiled))
+        return False
+    
+    return not revocation_filter.is_revoked(token, namespaced(fingerprint, compiled), namespaced(ip, compiled))
+
+class MemoryMonitor:
+    """Periodic size estimates of the in-process state, with growth rates and budget alerts.
+    
+    Each tracked source reports ``(entries, bytes)``. Stores size only a
+    fixed sample of entries per pass, so a sample costs the same however
+    large they grow. Samples are taken from the janitor thread and kept in a
+    bounded history from which growth over recent windows is derived.
+    Crossing a byte budget counts one alert per crossing, not per sample.
+    """
+
+    WINDOWS = (60, 300, 900)
+
+    def __init__(self, interval, history, budgets):
+        self.interval = interval
+        self.budgets = budgets
+        self.sources = {}
+        self.samples = deque(maxlen=history)  # (timestamp, {name: (entries, bytes)})
+        self.alerts = {}
+        self.over_budget = set()
+        self.lock = threading.Lock()
+        self.last_sample = 0.0
+        self.last_sample_seconds = 0.0
+
+    def track(self, name, usage):
+        """Track a source; ``usage`` returns its ``(entries, bytes)``."""
+        self.sources[name] = usage
+
+    def maybe_sample(self, now=None):
+        """Take a sample if ``interval`` has passed since the last one."""
+        now = time.time() if now is None else now
+        frames = config['memory_tracemalloc']
+        if frames and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        if now - self.last_sample >= self.interval:
+            self.sample(now)
+
+    def sample(self, now=None):
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        usage = {name: source() for name, source in self.sources.items()}
+        
+        crossed = []
+        with self.lock:
+            self.samples.append((now, usage))
+            self.last_sample = now
+            self.last_sample_seconds = time.perf_counter() - started
+            for name, (_, size) in usage.items():
+                budget = self.budgets.get(name)
+                if budget and size > budget:
+                    if name not in self.over_budget:
+                        self.over_budget.add(name)
+                        self.alerts[name] = self.alerts.get(name, 0) + 1
+                        crossed.append((name, size, budget))
+                else:
+                    self.over_budget.discard(name)
+        
+        for name, size, budget in crossed:
+            logger.warning("Memory budget exceeded for %s: ~%d bytes (budget %d)", name, size, budget)
+
+    def _growth(self, samples, name, window):
+        now, latest = samples[-1]
+        # Compare with the newest sample at least ``window`` old, or the oldest there is
+        for then, past in reversed(samples[:-1]):
+            if now - then >= window:
+                break
+        else:
+            if len(samples) < 2:
+                return None
+            then, past = samples[0]
+        if name not in past:
+            return None
+        elapsed = now - then
+        entries, past_entries = latest[name][0], past[name][0]
+        return {
+            'seconds': round(elapsed, 1),
+            'entries_per_second': (entries - past_entries) / elapsed if entries is not None else None,
+            'bytes_per_second': (latest[name][1] - past[name][1]) / elapsed,
+        }
+
+    def stats(self, top=10):
+        if not self.samples:
+            self.sample()
+        with self.lock:
+            samples = list(self.samples)
+            alerts = dict(self.alerts)
+            over_budget = set(self.over_budget)
+            sample_ms = self.last_sample_seconds * 1000
+        
+        sampled_at, latest = samples[-1]
+        stores = {}
+        for name, (entries, size) in latest.items():
+            stores[name] = {
+                'entries': entries,
+                'estimated_bytes': size,
+                'bytes_per_entry': size / entries if entries else None,
+                'budget': self.budgets.get(name),
+                'over_budget': name in over_budget,
+                'alerts': alerts.get(name, 0),
+                'growth': {f"{window}s": self._growth(samples, name, window) for window in self.WINDOWS},
+            }
+        result = {
+            'sampled_at': sampled_at,
+            'sample_ms': sample_ms,
+            'interval': self.interval,
+            'alerts': sum(alerts.values()),
+            'stores': stores,
+        }
+        
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            statistics = tracemalloc.take_snapshot().statistics('lineno')[:top]
+            result['tracemalloc'] = {
+                'traced_bytes': current,
+                'peak_bytes': peak,
+                'top': [{'site': str(stat.traceback), 'bytes': stat.size, 'count': stat.count} for stat in statistics],
+            }
+        return result
+
+def mapping_usage(mapping, lock, sample_size):
+    """Estimate ``(entries, bytes)`` of a lock-protected dict from a sample of its items."""
+    with lock:
+        entries = len(mapping)
+        container = sys.getsizeof(mapping)
+        sample = list(itertools.islice(mapping.items(), sample_size))
+    if not sample:
+        return entries, container
+    per_entry = sum(estimate_size(key) + estimate_size(value) for key, value in sample) / len(sample)
+    return entries, int(container + per_entry * entries)
+
+memory_monitor = MemoryMonitor(config['memory_sample_interval'], config['memory_history'], config['memory_budgets'])
+for _name, _store in janitor.stores.items():
+    memory_monitor.track(_name, lambda store=_store: store.memory_usage(config['memory_sample_entries']))
+memory_monitor.track('token_cache', lambda: mapping_usage(token_cache.entries, token_cache.lock, config['memory_sample_entries']))
+memory_monitor.track('difficulty_scheduler', lambda: mapping_usage(difficulty_scheduler.clients, difficulty_scheduler.lock, config['memory_sample_entries']))
+memory_monitor.track('detection_log_sampler', lambda: mapping_usage(detection_log_sampler.windows, detection_log_sampler.lock, config['memory_sample_entries']))
+memory_monitor.track('timing_tracker', lambda: (len(timing_tracker), timing_tracker.memory_bytes()))
+memory_monitor.track('revocation_filter', lambda: (None, len(revocation_filter.memory)))
+memory_monitor.track('spent_challenges', lambda: (None, len(spent_challenges.memory)))
+janitor.tasks.append(memory_monitor.maybe_sample)
+
+class StateSnapshots:
+    """Periodic per-shard snapshots of the in-process stores, restored on restart.
+
+    Each shard of each store is saved to its own file, and only shards
+    written since the previous snapshot are saved again. The files are
+    written by a forked child, which serializes a copy-on-write image of
+    the stores taken at the fork, so requests never wait on shard locks or
+    the GIL while a snapshot is written. Each file is written under a
+    temporary name and renamed into place, so a crash never leaves a
+    partial snapshot.
+
+    Every process that snapshots needs its own ``slot``, which numbers its
+    files. In prefork mode the master only restores the revocation filter
+    before forking; each worker then restores the stores of its slot, so it
+    saves back exactly the data it restored and wrote. Nothing is saved
+    until ``restore`` has assigned a slot.
+    """
+
+    MAGIC = b'ASSNAP01'
+    HEADER = struct.Struct('>8sBBd')  # magic, Python major/minor (marshal format), saved at
+
+    def __init__(self, stores, revocations, interval):
+        self.stores = stores
+        self.revocations = revocations
+        self.interval = interval
+        self.slot = None
+        self.child = None  # (pid, started, dirty shards, revocation bytes)
+        self.last_save = time.time()
+        self.last_revocations = None
+        self.saves = 0
+        self.failures = 0
+        self.shards_written = 0
+        self.last_save_seconds = 0.0
+        self.restored = {}
+        self.restore_seconds = 0.0
+
+    def _path(self, name, index=None):
+        suffix = '' if index is None else f'.{self.slot}.{index}'
+        return os.path.join(config['snapshot_dir'], f'{name}{suffix}.snap')
+
+    def _write(self, path, obj):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, *sys.version_info[:2], time.time()))
+            marshal.dump(obj, f)
+        os.replace(tmp_path, path)
+
+    def _read(self, path):
+        """Return the object stored in a snapshot file, or None if it is unusable."""
+        with open(path, 'rb') as f:
+            try:
+                memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return None
+        try:
+            magic, major, minor, saved_at = self.HEADER.unpack_from(memory, 0)
+            if magic != self.MAGIC or (major, minor) != sys.version_info[:2]:
+                logger.warning(f"Ignoring snapshot {path} from another format or Python version")
+                return None
+            # Unmarshal straight from the mapping without copying the file
+            with memoryview(memory)[self.HEADER.size:] as data:
+                return marshal.loads(data)
+        except (struct.error, ValueError, EOFError, TypeError):
+            logger.warning(f"Ignoring unreadable snapshot {path}")
+            return None
+        finally:
+            memory.close()
+
+    def restore(self, slot=0, slots=1, shared=True):
+        """Load the snapshots of one worker from ``snapshot_dir``, dropping expired entries.
+
+        ``slot`` becomes this process's slot and must be unique among the
+        ``slots`` processes snapshotting into the directory; with None, no
+        store is loaded and nothing will be saved. Files of slots beyond
+        ``slots`` go to ``slot % slots`` and, like shards beyond the current
+        shard count, are deleted once loaded, since no worker rewrites
+        them. With ``shared``, the signing key and revocation filter shared
+        by all workers are loaded too, which the prefork master does once
+        before forking, and files of stores that are no longer snapshotted
+        are deleted.
+        """
+        self.slot = slot
+        directory = config['snapshot_dir']
+        if not directory:
+            return {}
+        os.makedirs(directory, exist_ok=True)
+        if shared and not config['token_secret']:
+            self._keep_token_secret(directory)
+        started = time.perf_counter()
+        now = time.time()
+        restored = {}
+        
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.snap'):
+                continue
+            path = os.path.join(directory, filename)
+            name, _, position = filename[:-len('.snap')].partition('.')
+            if name == 'revocation_filter':
+                data = self._read(path) if shared else None
+                if data is not None and len(data) == len(self.revocations.memory):
+                    # Slot epochs are stored with the bits, so revocations keep their original age
+                    self.revocations.memory[:] = data
+                    self.last_revocations = data
+                    restored[name] = 1
+                continue
+            store = self.stores.get(name)
+            if store is None:
+                if shared:
+                    # Left by a version that snapshotted more stores
+                    os.remove(path)
+                continue
+            if slot is None:
+                continue
+            owner, _, index = position.partition('.')
+            owner = int(owner) if owner.isdigit() else 0
+            if owner % slots != slot:
+                continue
+            in_layout = owner < slots and index.isdigit() and int(index) < store.shard_count
+            snapshot = self._read(path)
+            if snapshot is not None:
+                entries, expiry = snapshot
+                source = int(index) if in_layout else None
+                restored[name] = restored.get(name, 0) + store.restore(entries, expiry, now, source)
+            if not in_layout:
+                os.remove(path)
+        
+        self.restored = restored
+        self.restore_seconds = time.perf_counter() - started
+        logger.info(f"Restored {restored} from {directory} in {self.restore_seconds:.2f}s")
+        return restored
+
+    def _keep_token_secret(self, directory):
+        # Restored tokens only verify with the key that signed them, so a
+        # generated key is kept next to the snapshots
+        global _generated_token_secret
+        path = os.path.join(directory, 'token_secret')
+        try:
+            with open(path, 'rb') as f:
+                secret = f.read()
+        except FileNotFoundError:
+            with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+                f.write(_generated_token_secret)
+            return
+        if len(secret) == len(_generated_token_secret) and secret != _generated_token_secret:
+            _generated_token_secret = secret
+            reload_config()
+
+    def _changed_revocations(self):
+        # The filter is shared by all workers, so only the first slot saves it
+        if self.slot != 0:
+            return None
+        data = bytes(self.revocations.memory)
+        return None if data == self.last_revocations else data
+
+    def _write_all(self, dirty, revocations):
+        for name, indexes in dirty.items():
+            store = self.stores[name]
+            for index in indexes:
+                self._write(self._path(name, index), store.shard_state(index))
+        if revocations is not None:
+            self._write(self._path('revocation_filter'), revocations)
+
+    def _finished(self, dirty, revocations, seconds, ok):
+        if ok:
+            self.saves += 1
+            self.shards_written += sum(len(indexes) for indexes in dirty.values())
+            self.last_save_seconds = seconds
+            if revocations is not None:
+                self.last_revocations = revocations
+        else:
+            # Write the shards again with the next snapshot
+            self.failures += 1
+            for name, indexes in dirty.items():
+                self.stores[name].mark_dirty(indexes)
+            logger.warning("State snapshot failed")
+
+    def save(self, background=True):
+        """Snapshot the shards written since the last snapshot.
+
+        With ``background`` the files are written by a forked child that is
+        reaped by a later ``maybe_save``; otherwise they are written inline.
+        Without a slot nothing is saved, as the files could belong to
+        another process.
+        """
+        self.last_save = time.time()
+        if self.slot is None:
+            if not self.failures:
+                logger.warning("Not snapshotting: no slot assigned, call state_snapshots.restore() first")
+            self.failures += 1
+            return
+        dirty = {}
+        for name, store in self.stores.items():
+            indexes = store.take_dirty()
+            if indexes:
+                dirty[name] = indexes
+        revocations = self._changed_revocations()
+        if not dirty and revocations is None:
+            return
+        
+        os.makedirs(config['snapshot_dir'], exist_ok=True)
+        started = time.perf_counter()
+        if not background:
+            try:
+                self._write_all(dirty, revocations)
+            except OSError:
+                logger.exception("Failed to write state snapshot")
+                self._finished(dirty, revocations, 0, False)
+            else:
+                self._finished(dirty, revocations, time.perf_counter() - started, True)
+            return
+        
+        pid = os.fork()
+        if pid == 0:
+            # Only touch the copied stores and files here: locks held by other
+            # threads at the fork stay locked in the child
+            code = 0
+            try:
+                self._write_all(dirty, revocations)
+            except BaseException:
+                code = 1
+            os._exit(code)
+        self.child = (pid, started, dirty, revocations)
+
+    def _reap(self, block=False):
+        pid, started, dirty, revocations = self.child
+        try:
+            done, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            done, status = pid, 1
+        if done:
+            self.child = None
+            self._finished(dirty, revocations, time.perf_counter() - started, os.waitstatus_to_exitcode(status) == 0)
+
+    def maybe_save(self, now=None):
+        """Reap a finished snapshot child and start the next snapshot when it is due."""
+        if not config['snapshot_dir']:
+            return
+        now = time.time() if now is None else now
+        if self.child:
+            self._reap()
+        if not self.child and now - self.last_save >= self.interval:
+            self.save()
+
+    def flush(self):
+        """Wait for a running snapshot and write the remaining changes inline, e.g. on shutdown."""
+        if not config['snapshot_dir']:
+            return
+        if self.child:
+            self._reap(block=True)
+        self.save(background=False)
+
+    def stats(self):
+        return {
+            'enabled': bool(config['snapshot_dir']),
+            'slot': self.slot,
+            'saves': self.saves,
+            'failures': self.failures,
+            'shards_written': self.shards_written,
+            'last_save_ms': self.last_save_seconds * 1000,
+            'writing': self.child is not None,
+            'restored': self.restored,
+            'restore_seconds': self.restore_seconds,
+        }
+
+# Tokens and challenges are signed and carry their own expiry, so only the
+# signing key, the revocations and the detection log need to survive a restart
+state_snapshots = StateSnapshots({'detected_bots': detected_bots}, revocation_filter, config['snapshot_interval'])
+janitor.tasks.append(state_snapshots.maybe_save)
+
 # Middleware to check protection token
 def check_protection_token():
     def decorator(f):
@@ -626,21 +3276,81 @@ def check_protection_token():
                 else:
                     token = request.form.get('protection_token')
             
-            # Also check for token in headers
+            # Also check for token in headers and the cookie set by the client script
             if not token:
-                token = request.headers.get('X-Protection-Token')
+                token = request.headers.get('X-Protection-Token') or request.cookies.get('protection_token')
+            
+            # A filled honeypot field means the form was submitted by a bot
+            if request.method == 'POST' and honeypot_filled(request, compiled_config()):
+                return render_protection_page()
             
             # Verify the token
-            if verify_protection_token(token):
+            if verify_cached_protection_token(token, request.remote_addr):
                 return f(*args, **kwargs)
             
             # Token is invalid, redirect to protection page
             # In a real implementation, you might want to show a captcha or block the request
-            return render_template_string(PROTECTION_PAGE)
+            return render_protection_page()
         
         return decorated_function
     return decorator
 
+class ProtectionMiddleware:
+    """WSGI middleware that enforces protection tokens before the app runs.
+    
+    Paths under ``prefixes`` (everything by default) need a valid token in
+    the ``protection_token`` query parameter, the ``X-Protection-Token``
+    header or the ``protection_token`` cookie; paths under ``exempt`` are
+    passed through untouched. Everything is read straight from the WSGI
+    environ, so rejected requests never reach Flask routing, request
+    context creation or the view. Request bodies are not read: form
+    submissions are covered by the cookie, and honeypot checks on posted
+    forms still need ``check_protection_token``.
+    
+        app.wsgi_app = ProtectionMiddleware(app.wsgi_app, prefixes=['/shop/', '/api/'])
+    
+    Pass ``app`` when it was built with its own settings, so tokens are
+    checked against that app's keys.
+    """
+
+    def __init__(self, wsgi_app, prefixes=('/',), exempt=('/bot-detection/', '/bot-protection.js', '/dynamic-css', '/admin/'), app=None):
+        self.wsgi_app = wsgi_app
+        self.prefixes = tuple(prefixes)
+        self.exempt = tuple(exempt)
+        self.app = app
+
+    @staticmethod
+    def _token(environ):
+        query = environ.get('QUERY_STRING', '')
+        if 'protection_token=' in query:
+            for part in query.split('&'):
+                if part.startswith('protection_token='):
+                    return urllib.parse.unquote_plus(part[len('protection_token='):])
+        token = environ.get('HTTP_X_PROTECTION_TOKEN')
+        if token:
+            return token
+        cookies = environ.get('HTTP_COOKIE', '')
+        if 'protection_token=' in cookies:
+            for part in cookies.split(';'):
+                name, _, value = part.strip().partition('=')
+                if name == 'protection_token':
+                    return value.strip('"')
+        return None
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefixes) or path.startswith(self.exempt):
+            return self.wsgi_app(environ, start_response)
+        
+        registry = tenant_registry(self.app) if self.app is not None else tenant_registry()
+        compiled = registry.resolve(environ.get('HTTP_HOST'), environ.get('HTTP_X_API_KEY'))
+        if verify_cached_protection_token(self._token(environ), environ.get('REMOTE_ADDR'), compiled):
+            return self.wsgi_app(environ, start_response)
+        
+        body = render_protection_page().encode()
+        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8'), ('Content-Length', str(len(body)))])
+        return [body]
+
 # Example protection page with captcha
 PROTECTION_PAGE = '''
 <!DOCTYPE html>
@@ -686,17 +3396,206 @@ PROTECTION_PAGE = '''
 </html>
 '''
 
+_protection_page_html = None
+
+def render_protection_page():
+    """Return the protection page, rendering the template only once."""
+    global _protection_page_html
+    if _protection_page_html is None:
+        _protection_page_html = jinja2.Environment(autoescape=True).from_string(PROTECTION_PAGE).render()
+    return _protection_page_html
+
 # Example route protected by the token middleware
-@app.route('/')
+@demo_blueprint.route('/')
 @check_protection_token()
 def index():
     return "Protected content!"
 
+def require_admin_key(f):
+    """Require the configured admin API key on admin routes.
+
+    Without a configured key, read-only (GET) routes stay open and routes
+    that change state are refused.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        admin_key = config['admin_api_key']
+        if not admin_key:
+            if request.method != 'GET':
+                return jsonify({'error': 'Set admin_api_key to use this endpoint'}), 403
+        elif not hmac.compare_digest(request.headers.get('X-Admin-Key', '').encode(), admin_key.encode()):
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Route for monitoring bot detections (admin only)
-@app.route('/admin/bot-detections', methods=['GET'])
+@protection_blueprint.route('/admin/bot-detections', methods=['GET'])
+@require_admin_key
 def admin_bot_detections():
-    # In a real app, authenticate admin access
-    return jsonify(detected_bots)
+    return jsonify(detected_bots.to_dict())
+
+def detection_stream_filter(args):
+    """Build the event filter for a stream from its query parameters.
+
+    ``summaries`` is ``1`` to add per-second summaries or ``only`` to
+    receive nothing else; ``min_score``, ``ip`` (address or CIDR),
+    ``user_agent`` (substring) and ``tenant`` narrow the detections.
+    Raises ValueError for invalid values.
+    """
+    summaries = args.get('summaries', '0')
+    types_wanted = {'0': ('detection',), '1': ('detection', 'summary'), 'only': ('summary',)}.get(summaries)
+    if types_wanted is None:
+        raise ValueError("summaries must be 0, 1 or only")
+    min_score = float(args['min_score']) if 'min_score' in args else None
+    network = ipaddress.ip_network(args['ip'], strict=False) if 'ip' in args else None
+    user_agent = args.get('user_agent', '').lower()
+    tenant = args.get('tenant')
+    
+    def accept(event):
+        if event['type'] not in types_wanted:
+            return False
+        if tenant is not None and (event['tenant'] or '') != tenant:
+            return False
+        if event['type'] == 'summary':
+            return True
+        if min_score is not None and event['score'] < min_score:
+            return False
+        if network is not None:
+            try:
+                if ipaddress.ip_address(event['ip']) not in network:
+                    return False
+            except ValueError:
+                return False
+        return not user_agent or user_agent in event['user_agent'].lower()
+    return accept
+
+# Route for streaming detections as Server-Sent Events (admin only)
+@protection_blueprint.route('/admin/detections/stream', methods=['GET'])
+@require_admin_key
+def admin_detection_stream():
+    """Push new detections, and optionally per-second summaries, as they happen."""
+    try:
+        accept = detection_stream_filter(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not detection_broadcaster.subscribe():
+        response = jsonify({'error': 'Too many detection stream subscribers'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(config['detection_stream_heartbeat'])
+        return response
+    
+    # Event ids carry the worker's pid: sequence numbers are only meaningful
+    # within the worker that issued them
+    pid = os.getpid()
+    last_sequence = None
+    prefix, _, sequence = request.headers.get('Last-Event-ID', '').partition('-')
+    if prefix == str(pid) and sequence.isdigit():
+        last_sequence = int(sequence)
+    cursor = detection_broadcaster.start(last_sequence)
+    heartbeat = config['detection_stream_heartbeat']
+    
+    def generate(cursor):
+        yield f"retry: {heartbeat * 1000}\n\n"
+        last_write = time.time()
+        while True:
+            entries, sequence = detection_broadcaster.read(cursor, heartbeat)
+            if entries is None:
+                yield f"event: dropped\ndata: {json.dumps({'missed': sequence - cursor - detection_broadcaster.capacity})}\n\n"
+                return
+            cursor = sequence
+            chunk = []
+            for entry in entries:
+                if accept(entry[1]):
+                    # Serialized once, by whichever subscriber gets there first
+                    if entry[2] is None:
+                        entry[2] = json.dumps(entry[1], default=str)
+                    chunk.append(f"id: {pid}-{entry[0]}\nevent: {entry[1]['type']}\ndata: {entry[2]}\n\n")
+            if chunk:
+                yield ''.join(chunk)
+                last_write = time.time()
+            elif time.time() - last_write >= heartbeat:
+                yield ": keep-alive\n\n"
+                last_write = time.time()
+    
+    response = current_app.response_class(generate(cursor), mimetype='text/event-stream')
+    # Runs when the server closes the response, including on disconnect or HEAD
+    response.call_on_close(detection_broadcaster.unsubscribe)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Route for runtime metrics (admin only)
+@protection_blueprint.route('/admin/metrics', methods=['GET'])
+@require_admin_key
+def admin_metrics():
+    """Report cache and pipeline metrics for this worker."""
+    return jsonify({
+        'token_cache': token_cache.stats(),
+        'scoring_pipeline': pipeline_stats.stats(),
+        'janitor': janitor.stats(),
+        'load_shedding': overload_controller.stats(),
+        'detection_logging': detection_log_sampler.stats(),
+        'challenge_difficulty': difficulty_scheduler.stats(),
+        'snapshots': state_snapshots.stats(),
+        'detection_stream': detection_broadcaster.stats(),
+    })
+
+# Route for memory accounting (admin only)
+@protection_blueprint.route('/admin/memory', methods=['GET'])
+@require_admin_key
+def admin_memory():
+    """Report estimated entries, bytes and growth of the in-process state for this worker."""
+    return jsonify(memory_monitor.stats(request.args.get('top', 10, type=int)))
+
+# Route for shadow scoring results (admin only)
+@protection_blueprint.route('/admin/shadow', methods=['GET'])
+@require_admin_key
+def admin_shadow():
+    """Report how often each candidate config would have decided differently."""
+    return jsonify(shadow_scorer.stats())
+
+# Routes for traffic sketches (admin only)
+@protection_blueprint.route('/admin/sketches', methods=['GET'])
+@require_admin_key
+def admin_sketches():
+    """Report sketch summaries, or the raw state with ?format=state."""
+    if request.args.get('format') == 'state':
+        return jsonify(traffic_sketches.to_state())
+    top = request.args.get('top', 20, type=int)
+    return jsonify(traffic_sketches.summary(top, request.args.get('ip')))
+
+@protection_blueprint.route('/admin/sketches/merge', methods=['POST'])
+@require_admin_key
+def admin_sketches_merge():
+    """Merge sketch state exported by another worker."""
+    state = request.get_json(silent=True)
+    try:
+        traffic_sketches.merge_state(state)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid sketch state: {e}'}), 400
+    return jsonify({'merged': True})
+
+# Route for revoking issued tokens (admin only)
+@protection_blueprint.route('/admin/revoke', methods=['POST'])
+@require_admin_key
+def admin_revoke():
+    """Revoke a token, or all tokens for a fingerprint or IP."""
+    data = request.get_json(silent=True) or {}
+    token = data.get('token')
+    fingerprint = data.get('fingerprint')
+    ip = data.get('ip')
+    
+    if not (token or fingerprint or ip):
+        return jsonify({'error': 'Provide a token, fingerprint or ip to revoke'}), 400
+    
+    revocation_filter.revoke(token, namespaced(fingerprint), namespaced(ip))
+    if token:
+        token_cache.discard(namespaced(token))
+    
+    return jsonify({
+        'revoked': {'token': bool(token), 'fingerprint': fingerprint, 'ip': ip},
+        'expires_in': config['token_validity']
+    })
 
 # Integration instructions for website owners
 INTEGRATION_INSTRUCTIONS = '''
@@ -739,6 +3638,12 @@ def api_endpoint():
     return jsonify({'data': 'your data'})
 ```
 
+3. To protect whole path prefixes without decorating each route, wrap the WSGI app:
+
+```python
+app.wsgi_app = ProtectionMiddleware(app.wsgi_app, prefixes=['/shop/', '/api/'])
+```
+
 ## Advanced Configuration
 You can customize the bot detection system by modifying the configuration:
 
@@ -750,19 +3655,43 @@ config = {
 }
 ```
 
+Lookup structures such as the IP deny set and the user agent blacklist pattern are compiled from `config` once. Call `reload_config()` after changing `config` at runtime.
+
 ## Monitoring
 Access the admin dashboard at /admin/bot-detections to see detected bots and scraping attempts.
+Stream new detections live from /admin/detections/stream (Server-Sent Events).
+
+To invalidate tokens that were already issued, POST a token, fingerprint or IP to /admin/revoke:
+
+```bash
+curl -X POST -H 'Content-Type: application/json' -d '{"fingerprint": "..."}' https://your-domain.com/admin/revoke
+```
+
+Set `config['admin_api_key']` to require an `X-Admin-Key` header on all /admin/ routes. Without it, /admin/revoke is refused.
 '''
 
-@app.route('/bot-protection.js')
+# The snippet without its <script> wrapper, for serving as a script file
+BOT_PROTECTION_JS = HTML_HEAD_SNIPPET.strip()[len('<script>'):-len('</script>')].strip() + '\n'
+
+@protection_blueprint.route('/bot-protection.js')
 def bot_protection_js():
-    """Serve the bot protection JavaScript."""
-    response = make_response(HTML_HEAD_SNIPPET)
+    """Serve the bot protection JavaScript, with a signed challenge embedded."""
+    script = BOT_PROTECTION_JS
+    if config['embed_challenge']:
+        keys = client_keys(request.remote_addr)
+        difficulty = difficulty_scheduler.difficulty(keys, client_request_rates(keys), overload_controller.mode)
+        challenge, _ = issue_signed_challenge(difficulty)
+        preset = json.dumps({'challenge': challenge, 'formats': challenge_formats()})
+        script = script.replace('/*PRESET_CHALLENGE*/null', preset, 1)
+    response = make_response(script)
     response.headers['Content-Type'] = 'application/javascript'
+    if config['embed_challenge']:
+        # Every response carries its own challenge, so it must not be cached
+        response.headers['Cache-Control'] = 'no-store'
     return response
 
 # Dynamic CSS to defeat scrapers by randomizing selectors
-@app.route('/dynamic-css')
+@protection_blueprint.route('/dynamic-css')
 def dynamic_css():
     """Generate dynamic CSS with random selectors to break scrapers."""
     random_class_suffix = ''.join(random.choices(string.ascii_lowercase, k=8))
@@ -779,9 +3708,258 @@ def dynamic_css():
     return response
 
 # Helper route for integration instructions
-@app.route('/integration-guide')
+@demo_blueprint.route('/integration-guide')
 def integration_guide():
     return INTEGRATION_INSTRUCTIONS
 
+def setup_protection(flask_app, settings=None):
+    """Register the protection endpoints on an existing Flask app and return it.
+    
+    ``settings`` override ``config`` for this app only. They are limited to
+    ``APP_SETTINGS``; other settings are process-wide and must be set in
+    ``config`` before the first app is built.
+    """
+    if settings:
+        process_wide = sorted(set(settings) - APP_SETTINGS)
+        if process_wide:
+            raise ValueError(f"Set process-wide settings in config instead: {', '.join(process_wide)}")
+        flask_app.extensions['anti_scraper'] = (dict(settings), None, None)
+    if not config['admin_api_key']:
+        logger.warning("admin_api_key is not set: /admin/ reports are open and /admin/revoke and /admin/sketches/merge are refused")
+    flask_app.register_blueprint(protection_blueprint)
+    return flask_app
+
+def create_app(settings=None):
+    """Build the standalone protection app, with ``settings`` applied to it alone."""
+    flask_app = setup_protection(Flask(__name__), settings)
+    flask_app.register_blueprint(demo_blueprint)
+    return flask_app
+
+_app = None
+
+def default_app():
+    """Return the module's standalone app, building it on first use."""
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+def __getattr__(name):
+    # ``anti_scraper_solution.app`` (e.g. for gunicorn) is built on first
+    # access, so importing the module for its helpers does not build it
+    if name == 'app':
+        return default_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Production entry point: a prefork server built on werkzeug's threaded WSGI server
+def preload():
+    """Load everything workers share before forking, so pages stay copy-on-write shared."""
+    # Each worker restores the stores of its own slot once forked
+    state_snapshots.restore(None)
+    default_app()
+    compiled_config()
+    load_ip_reputation_db()
+    parse_user_agent('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36')
+    render_protection_page()
+    
+    # Move everything allocated so far out of the collector's reach, so that
+    # garbage collection in a worker does not touch (and copy) shared pages
+    gc.collect()
+    gc.freeze()
+
+def _listen_socket(host, port, reuse_port=False, listen=True):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    if listen:
+        sock.listen(1024)
+    return sock
+
+def _run_worker(host, port, listener, reuse_port, slot, slots, ready_fd=None):
+    """Serve requests in a forked worker until told to stop.
+
+    The worker first restores the snapshot of its ``slot`` out of
+    ``slots``. Once the server is about to accept, a byte is written to
+    ``ready_fd`` so that a rolling reload can wait for this worker before
+    stopping the next.
+    """
+    from werkzeug.serving import make_server
+    
+    state_snapshots.restore(slot, slots, shared=False)
+    
+    # With SO_REUSEPORT each worker gets its own socket and the kernel
+    # balances connections between them; otherwise all workers accept
+    # from the socket inherited from the master
+    if reuse_port:
+        listener = _listen_socket(host, port, reuse_port=True)
+    server = make_server(host, port, default_app(), threaded=True, fd=listener.fileno())
+    # Track request threads so that stopping waits for the requests already
+    # accepted instead of cutting them off when the process exits
+    server.daemon_threads = False
+    server.block_on_close = True
+    
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so call it from another thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    if ready_fd is not None:
+        try:
+            os.write(ready_fd, b'1')
+        except OSError:
+            pass  # the master is not waiting for this worker
+        os.close(ready_fd)
+    server.serve_forever()
+    server.server_close()
+    state_snapshots.flush()
+
+def serve(host='0.0.0.0', port=5000, workers=None, reuse_port=False, graceful_timeout=30):
+    """Run the app with ``workers`` forked processes.
+
+    SIGHUP restarts the workers one by one, each replacement accepting
+    before the next old worker is stopped. SIGTERM/SIGINT stops them
+    gracefully and workers that die are replaced.
+    """
+    workers = workers or os.cpu_count() or 1
+    preload()
+    
+    # Without SO_REUSEPORT the master binds once and workers inherit the socket.
+    # With it, the master only binds (without listening, so the kernel never
+    # hands it connections) to fail fast if the port is taken
+    listener = _listen_socket(host, port, reuse_port, listen=not reuse_port)
+    
+    children = {}
+    state = {'running': True, 'reload': False}
+    
+    def spawn(slot, wait=False):
+        """Fork a worker for ``slot``; with ``wait``, return once it accepts or has failed."""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(ready_r)
+                _run_worker(host, port, listener, reuse_port, slot, workers, ready_w)
+            finally:
+                os._exit(0)
+        os.close(ready_w)
+        children[pid] = (time.time(), slot)
+        logger.info(f"Started worker {pid}")
+        ready = True
+        if wait:
+            # The worker writes a byte once it is serving; EOF without one
+            # means it died during startup
+            readable, _, _ = select.select([ready_r], [], [], graceful_timeout)
+            ready = bool(readable) and os.read(ready_r, 1) == b'1'
+            if not ready:
+                # Reaped by the main loop, which restarts the slot if it is now empty
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        os.close(ready_r)
+        return ready
+    
+    def stop_worker(pid):
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.time() + graceful_timeout
+        while not os.waitpid(pid, os.WNOHANG)[0]:
+            if time.time() >= deadline:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                break
+            time.sleep(0.05)
+        children.pop(pid)
+    
+    def stop(signum, frame):
+        state['running'] = False
+    
+    def reload(signum, frame):
+        state['reload'] = True
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+    
+    for slot in range(workers):
+        spawn(slot)
+    logger.info(f"Serving on {host}:{port} with {workers} workers")
+    
+    while state['running']:
+        if state['reload']:
+            # Replace workers one at a time, waiting for each replacement to
+            # accept before touching the next, so capacity never drops by more
+            # than one worker
+            state['reload'] = False
+            for pid, (_, slot) in list(children.items()):
+                if not state['running']:
+                    break
+                if config['snapshot_dir']:
+                    # Let the old worker write its final snapshot for the
+                    # replacement to restore; the other workers keep serving
+                    stop_worker(pid)
+                    ready = spawn(slot, wait=True)
+                else:
+                    ready = spawn(slot, wait=True)
+                    if ready:
+                        stop_worker(pid)
+                if not ready:
+                    logger.error(f"Replacement for worker slot {slot} did not start, stopping the reload")
+                    break
+        
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in children:
+            started, slot = children.pop(pid)
+            if state['running'] and len(children) < workers:
+                logger.warning(f"Worker {pid} exited with status {status}, restarting")
+                # Avoid a tight restart loop when workers crash on startup
+                if time.time() - started < 1:
+                    time.sleep(1)
+                spawn(slot)
+        elif not pid:
+            time.sleep(0.2)
+    
+    logger.info("Shutting down workers")
+    for pid in children:
+        os.kill(pid, signal.SIGTERM)
+    deadline = time.time() + graceful_timeout
+    while children and time.time() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            children.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in children:
+        os.kill(pid, signal.SIGKILL)
+    listener.close()
+
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Anti-scraper protection server")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=0, help="Number of prefork workers (0 = development server)")
+    parser.add_argument("--reuse-port", action="store_true", help="Give each worker its own SO_REUSEPORT socket")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Seconds to wait for workers on shutdown")
+    parser.add_argument("--snapshot-dir", help="Directory to snapshot the token signing key, revocations and detections to and restore them from")
+    
+    args = parser.parse_args()
+    if args.snapshot_dir:
+        config['snapshot_dir'] = args.snapshot_dir
+    
+    if args.workers:
+        serve(args.host, args.port, args.workers, args.reuse_port, args.graceful_timeout)
+    else:
+        state_snapshots.restore()
+        default_app().run(host=args.host, port=args.port, debug=True) 
\ No newline at end of file
@@ -0,0 +1,112 @@
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import re
+import statistics
+import time
+
+import anti_scraper_solution
+
+# Compares verifying new visitors with and without a challenge embedded in
+# /bot-protection.js, using the Flask test client. Each visitor fetches the
+# script, obtains a challenge (embedded or from /bot-detection/challenge),
+# solves it and posts /bot-detection/check. Time to token is server time
+# only; over a real network the embedded challenge also saves a round trip.
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+}
+PRESET = re.compile(r'let presetChallenge = (.*?);\n')
+
+
+def solve(challenge):
+    parts = challenge.split('|')
+    if parts[0] == 'pow':
+        nonce, bits = parts[1], int(parts[2])
+        for candidate in itertools.count():
+            digest = hashlib.sha256(f"{nonce}:{candidate}".encode()).digest()
+            if int.from_bytes(digest, 'big') >> (256 - bits) == 0:
+                return str(candidate)
+    a, b = int(parts[1]), int(parts[2])
+    return str({'add': a + b, 'sub': a - b, 'mul': a * b}[parts[0]])
+
+
+def visit(client, visitor):
+    """Verify one new visitor, returning the requests made and the seconds taken."""
+    environ = {'REMOTE_ADDR': f"10.{visitor // 65536 % 256}.{visitor // 256 % 256}.{visitor % 256}"}
+    fingerprint = f"visitor-{visitor}"
+    started = time.perf_counter()
+
+    script = client.get('/bot-protection.js', headers=HEADERS, environ_base=environ).get_data(as_text=True)
+    requests = 1
+    preset = json.loads(PRESET.search(script).group(1).replace('/*PRESET_CHALLENGE*/', ''))
+    if preset is None:
+        preset = client.post(
+            '/bot-detection/challenge', json={'fingerprint': fingerprint}, headers=HEADERS, environ_base=environ
+        ).get_json()
+        requests += 1
+
+    response = client.post('/bot-detection/check', json={
+        'challenge': preset['challenge'],
+        'solution': solve(preset['challenge']),
+        'info': {
+            'fingerprint': fingerprint,
+            'automationIndicators': {},
+            'userActivity': {'mouseMovements': 40, 'scrollEvents': 6, 'keyPresses': 3, 'timeSinceLastActivity': 800},
+        },
+    }, headers=HEADERS, environ_base=environ)
+    requests += 1
+    elapsed = time.perf_counter() - started
+
+    token = response.get_json()['token']
+    if not anti_scraper_solution.verify_protection_token(token):
+        raise SystemExit(f"visitor {visitor} did not get a valid token")
+    return requests, elapsed
+
+
+def check_signatures():
+    """Tampered, expired and token-signed challenges must all be rejected."""
+    verify = anti_scraper_solution.verify_challenge_signature
+    challenge, _ = anti_scraper_solution.issue_signed_challenge()
+    body = challenge.rsplit('|', 1)[0]
+    expired, _ = anti_scraper_solution.issue_signed_challenge(validity=-1)
+    cases = {
+        'valid': (challenge, True),
+        'tampered': (challenge.replace('|', '|9', 1), False),
+        'expired': (expired, False),
+        'unsigned': ('add|1|2', False),
+        'signed as a token': (f"{body}|{anti_scraper_solution.sign_token(body)}", False),
+    }
+    for name, (candidate, expected) in cases.items():
+        if verify(candidate) != expected:
+            raise SystemExit(f"{name} challenge: expected {expected}")
+    print(f"signature checks passed: {', '.join(cases)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure requests and server time per verified visitor with and without an embedded challenge")
+    parser.add_argument("-n", "--visitors", type=int, default=2000, help="New visitors per mode")
+
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    app = anti_scraper_solution.create_app()
+    client = app.test_client()
+    for offset, embed in enumerate((False, True)):
+        anti_scraper_solution.config['embed_challenge'] = embed
+        results = [visit(client, offset * args.visitors + visitor) for visitor in range(args.visitors)]
+        print(
+            f"{'embedded challenge' if embed else 'challenge request':<19}"
+            f" requests per verified visitor {statistics.mean(r[0] for r in results):.2f},"
+            f" median server time to token {statistics.median(r[1] for r in results) * 1000:.2f} ms"
+        )
+    check_signatures()
+
+
+if __name__ == "__main__":
+    main()
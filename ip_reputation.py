@@ -0,0 +1,197 @@
+import argparse
+import gzip
+import heapq
+import ipaddress
+import mmap
+import os
+import socket
+import struct
+import sys
+
+# File layout: a 16-byte header followed by fixed-width records sorted by
+# range start. Addresses are stored as 16-byte big-endian integers (IPv4 as
+# IPv4-mapped IPv6), so byte order equals numeric order and ranges can be
+# binary searched straight out of the mapped file.
+MAGIC = b'IPREP001'
+HEADER = struct.Struct('>8sQ')
+RECORD = struct.Struct('>16s16sHxx')
+IPV4_MAPPED = 0xFFFF << 32
+MAX_ADDRESS = (1 << 128) - 1
+
+
+def address_key(ip):
+    """Convert an IP address string to its 16-byte sort key."""
+    try:
+        return b'\x00' * 10 + b'\xff\xff' + socket.inet_pton(socket.AF_INET, ip)
+    except OSError:
+        return socket.inet_pton(socket.AF_INET6, ip)
+
+
+class IPReputationDB:
+    """Read-only view of a compiled reputation file.
+
+    The file is mapped with ``mmap`` instead of being parsed, so opening it
+    is instant regardless of size and every process that maps the same file
+    shares the page cache instead of holding its own copy.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.memory, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an IP reputation database")
+        if HEADER.size + self.count * RECORD.size > len(self.memory):
+            raise ValueError(f"{path} is truncated")
+        self.path = path
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, ip):
+        """Return the reputation score (0-100) for ``ip``, or 0 if unlisted."""
+        try:
+            key = address_key(ip)
+        except (OSError, TypeError):
+            return 0
+
+        # Find the last range whose start is <= key
+        memory = self.memory
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = HEADER.size + mid * RECORD.size
+            if memory[offset:offset + 16] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return 0
+
+        start, end, score = RECORD.unpack_from(memory, HEADER.size + (lo - 1) * RECORD.size)
+        return score if key <= end else 0
+
+    def close(self):
+        self.memory.close()
+
+
+def parse_feed_line(line, default_score):
+    """Parse one feed line into an (first, last, score) integer range.
+
+    Accepted forms are ``CIDR``, ``IP`` or ``IP-IP``, optionally followed by
+    a score separated by a comma or whitespace. Blank lines and lines
+    starting with ``#`` or ``;`` are skipped.
+    """
+    line = line.split('#', 1)[0].strip()
+    if not line or line.startswith(';'):
+        return None
+
+    fields = line.replace(',', ' ').split()
+    score = default_score
+    if len(fields) > 1:
+        score = max(0, min(int(float(fields[1])), 100))
+
+    if ':' not in fields[0] and '-' not in fields[0]:
+        # Fast path for IPv4 addresses and CIDRs, which make up most feeds
+        address, _, prefix = fields[0].partition('/')
+        prefix = int(prefix) if prefix else 32
+        if not 0 <= prefix <= 32:
+            raise ValueError(f"invalid prefix length in {fields[0]}")
+        host_bits = (1 << (32 - prefix)) - 1
+        if address.count('.') != 3:
+            raise ValueError(f"invalid IPv4 address {address}")
+        first = int.from_bytes(socket.inet_aton(address), 'big') & ~host_bits
+        return IPV4_MAPPED + first, IPV4_MAPPED + (first | host_bits), score
+
+    if '-' in fields[0]:
+        first, last = (ipaddress.ip_address(part.strip()) for part in fields[0].split('-', 1))
+    else:
+        network = ipaddress.ip_network(fields[0], strict=False)
+        first, last = network.network_address, network.broadcast_address
+
+    if first.version != last.version:
+        raise ValueError(f"mixed address families in {fields[0]}")
+    offset = IPV4_MAPPED if first.version == 4 else 0
+    return int(first) + offset, int(last) + offset, score
+
+
+def read_feeds(paths, default_score):
+    """Yield ranges from local feed files, reading gzip files transparently."""
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = parse_feed_line(line, default_score)
+                except (ValueError, OSError) as e:
+                    print(f"{path}:{line_number}: skipping invalid entry ({e})", file=sys.stderr)
+                    continue
+                if entry:
+                    yield entry
+
+
+def merge_ranges(ranges):
+    """Flatten overlapping ranges into sorted, disjoint ones.
+
+    Where ranges overlap, the highest score wins. Adjacent ranges with the
+    same score are coalesced to keep the output small.
+    """
+    ranges = sorted(ranges)
+    boundaries = sorted({first for first, _, _ in ranges} | {last + 1 for _, last, _ in ranges})
+
+    merged = []
+    active = []  # max-heap of (-score, last)
+    i = 0
+    for point, next_point in zip(boundaries, boundaries[1:]):
+        while i < len(ranges) and ranges[i][0] <= point:
+            heapq.heappush(active, (-ranges[i][2], ranges[i][1]))
+            i += 1
+        while active and active[0][1] < point:
+            heapq.heappop(active)
+        if not active:
+            continue
+
+        score = -active[0][0]
+        if merged and merged[-1][1] == point - 1 and merged[-1][2] == score:
+            merged[-1][1] = next_point - 1
+        else:
+            merged.append([point, next_point - 1, score])
+    return merged
+
+
+def build_database(feed_paths, output_path, default_score=50):
+    """Compile reputation feeds into a database file and return its record count."""
+    ranges = merge_ranges(read_feeds(feed_paths, default_score))
+
+    # Write to a temporary file and rename it into place so running workers
+    # keep their existing mapping until they reopen the file
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(ranges)))
+        for first, last, score in ranges:
+            f.write(RECORD.pack(first.to_bytes(16, 'big'), min(last, MAX_ADDRESS).to_bytes(16, 'big'), score))
+    os.replace(tmp_path, output_path)
+    return len(ranges)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile IP reputation feeds into a memory-mappable database")
+    parser.add_argument("feeds", nargs='+', help="Local feed files (CIDR, IP or IP-IP per line, optional score; .gz supported)")
+    parser.add_argument("-o", "--output", default="ip_reputation.bin", help="Output database file")
+    parser.add_argument("--default-score", type=int, default=50, help="Score for entries without one (0-100)")
+    parser.add_argument("--lookup", nargs='*', default=[], help="IPs to look up in the built database")
+
+    args = parser.parse_args()
+
+    count = build_database(args.feeds, args.output, max(0, min(args.default_score, 100)))
+    print(f"Wrote {count} ranges to {args.output}")
+
+    if args.lookup:
+        db = IPReputationDB(args.output)
+        for ip in args.lookup:
+            print(f"{ip}: {db.lookup(ip)}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import anti_scraper_solution
+
+# Measures /bot-detection/check throughput during a flood of detected bots,
+# with every detection logged and with the default per-IP/per-UA sampling.
+# Records go to a file handler, as they would in production; console output
+# is turned off so the terminal does not become the bottleneck.
+
+HEADERS = {'User-Agent': 'python-requests/2.31', 'Accept': '*/*'}
+
+
+def flood(client, checks, ips):
+    started = time.perf_counter()
+    for i in range(checks):
+        client.post(
+            '/bot-detection/check',
+            json={'challenge': 'add|1|2', 'solution': '0', 'info': {'fingerprint': f"flood-{i}"}},
+            headers=HEADERS, environ_base={'REMOTE_ADDR': f"10.0.0.{i % ips}"},
+        )
+    return checks / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare check throughput with full and sampled detection logging")
+    parser.add_argument("-n", "--checks", type=int, default=5000, help="Bot checks per run")
+    parser.add_argument("--ips", type=int, default=20, help="Distinct client IPs in the flood")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per mode")
+
+    args = parser.parse_args()
+
+    sampler = anti_scraper_solution.detection_log_sampler
+    default_rates = dict(sampler.rates)
+    unlimited = {kind: float('inf') for kind in default_rates}
+    root = logging.getLogger()
+    root.handlers[:] = []
+
+    app = anti_scraper_solution.create_app()
+    client = app.test_client()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'detections.log')
+        handler = logging.FileHandler(path)
+        root.addHandler(handler)
+        for mode, rates in (('full', unlimited), ('sampled', default_rates)):
+            throughput = []
+            for _ in range(args.repeat):
+                sampler.rates = rates
+                with sampler.lock:
+                    sampler.windows.clear()
+                handler.stream.truncate(0)
+                handler.stream.seek(0)
+                throughput.append(flood(client, args.checks, args.ips))
+                sampler.flush(time.time() + sampler.interval)
+                handler.flush()
+                with open(path) as f:
+                    records = f.readlines()
+                lines = sum(1 for record in records if record.startswith('Bot detected'))
+                summaries = sum(1 for record in records if record.startswith('Suppressed'))
+            print(
+                f"{mode:<8} {statistics.median(throughput):7.0f} checks/s (median of {args.repeat}),"
+                f" {lines} detection lines and {summaries} summary lines per {args.checks} detections"
+            )
+        root.removeHandler(handler)
+        handler.close()
+
+
+if __name__ == "__main__":
+    main()
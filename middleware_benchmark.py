@@ -0,0 +1,90 @@
+import argparse
+import logging
+import time
+
+from werkzeug.test import EnvironBuilder
+
+import anti_scraper_solution
+
+# Compares the per-request cost of ProtectionMiddleware with the
+# check_protection_token decorator by calling the WSGI app directly, so no
+# HTTP client or server overhead is included. Each route exists in a cheap
+# and an expensive variant, protected either way, plus an unprotected
+# baseline.
+
+
+def expensive_work():
+    return str(sum(i * i for i in range(20000)))
+
+
+def build_app():
+    app = anti_scraper_solution.create_app()
+    protect = anti_scraper_solution.check_protection_token
+
+    app.add_url_rule('/open/cheap', 'open_cheap', lambda: 'ok')
+    app.add_url_rule('/decorator/cheap', 'decorator_cheap', protect()(lambda: 'ok'))
+    app.add_url_rule('/decorator/expensive', 'decorator_expensive', protect()(expensive_work))
+    app.add_url_rule('/middleware/cheap', 'middleware_cheap', lambda: 'ok')
+    app.add_url_rule('/middleware/expensive', 'middleware_expensive', expensive_work)
+    app.wsgi_app = anti_scraper_solution.ProtectionMiddleware(app.wsgi_app, prefixes=['/middleware/'])
+    return app
+
+
+def per_request_us(app, path, headers, requests, repeat):
+    """Return the best of ``repeat`` runs in microseconds per request, and the last status."""
+    environ = EnvironBuilder(path=path, headers=headers).get_environ()
+    status = []
+
+    def start_response(response_status, response_headers, exc_info=None):
+        status[:] = [response_status]
+
+    def call():
+        body = app.wsgi_app(dict(environ), start_response)
+        b''.join(body)
+        if hasattr(body, 'close'):
+            body.close()
+
+    for _ in range(min(requests, 200)):
+        call()
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(requests):
+            call()
+        runs.append((time.perf_counter() - started) / requests * 1e6)
+    return min(runs), status[0].split()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ProtectionMiddleware with the check_protection_token decorator")
+    parser.add_argument("-n", "--requests", type=int, default=5000, help="Requests per run on cheap routes")
+    parser.add_argument("--expensive-requests", type=int, default=300, help="Requests per run on expensive routes")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Runs per measurement (the best is reported)")
+
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    app = build_app()
+    with app.test_request_context('/'):
+        token = anti_scraper_solution.generate_token('middleware-benchmark', validity=3600)
+    tokens = {
+        'header token': {'X-Protection-Token': token},
+        'cookie token': {'Cookie': f'protection_token={token}'},
+        'no token': {},
+    }
+
+    baseline, _ = per_request_us(app, '/open/cheap', {}, args.requests, args.repeat)
+    print(f"unprotected cheap route: {baseline:.1f} us/request")
+    print(f"{'route':<10} {'request':<13} {'decorator':>16} {'middleware':>16}")
+    for kind, requests in (('cheap', args.requests), ('expensive', args.expensive_requests)):
+        for label, headers in tokens.items():
+            decorator, decorator_status = per_request_us(app, f'/decorator/{kind}', headers, requests, args.repeat)
+            middleware, middleware_status = per_request_us(app, f'/middleware/{kind}', headers, requests, args.repeat)
+            print(
+                f"{kind:<10} {label:<13} {decorator:9.1f} us ({decorator_status})"
+                f" {middleware:9.1f} us ({middleware_status})"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import logging
+import threading
+import time
+
+import anti_scraper_solution
+
+# Simulates an overload of /bot-detection/check in-process. Full and degraded
+# scoring are slowed down by an extra stage, so a burst of concurrent checks
+# pushes the overload controller through degraded and reject mode. The run
+# fails if a request errors, if a degraded check is handed a real token, or
+# if the service does not return to normal once the burst is over. A known
+# bot then sends checks in degraded mode, which must leave the difficulty it
+# is given unchanged.
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+}
+
+
+def solve(challenge):
+    operation, a, b = challenge.split('|')[:3]
+    a, b = int(a), int(b)
+    return str({'add': a + b, 'sub': a - b, 'mul': a * b}[operation])
+
+
+def check(client, client_id):
+    """Send one check that full scoring would pass and classify the response."""
+    challenge, _ = anti_scraper_solution.issue_signed_challenge(difficulty=1)
+    response = client.post('/bot-detection/check', json={
+        'challenge': challenge,
+        'solution': solve(challenge),
+        'info': {
+            'fingerprint': f"overload-{client_id}",
+            'automationIndicators': {},
+            'userActivity': {'mouseMovements': 40, 'scrollEvents': 6, 'keyPresses': 3, 'timeSinceLastActivity': 800},
+        },
+    }, headers=HEADERS, environ_base={'REMOTE_ADDR': f"10.{client_id // 65536 % 256}.{client_id // 256 % 256}.{client_id % 256}"})
+    if response.status_code == 200:
+        token = response.get_json()['token']
+        return 'token' if anti_scraper_solution.verify_protection_token(token) else 'fake token'
+    if response.status_code == 503 and response.headers.get('Retry-After'):
+        return 'page' if response.mimetype == 'text/html' else 'rejected'
+    return f"HTTP {response.status_code}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate an overload of the bot-detection endpoints")
+    parser.add_argument("-c", "--clients", type=int, default=40, help="Concurrent checks in the burst")
+    parser.add_argument("--degraded-at", type=int, default=8, help="In-flight checks that switch to degraded mode")
+    parser.add_argument("--reject-at", type=int, default=16, help="In-flight checks that switch to reject mode")
+    parser.add_argument("--delay", type=float, default=0.2, help="Seconds of simulated work added to full scoring")
+    parser.add_argument("--degraded-delay", type=float, default=0.05, help="Seconds of simulated work added to degraded scoring")
+
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    controller = anti_scraper_solution.overload_controller
+    controller.degraded_watermark = args.degraded_at
+    controller.reject_watermark = args.reject_at
+    anti_scraper_solution.SCORING_STAGES.append(
+        ('simulated_work', lambda request, info, challenge, solution, compiled: time.sleep(args.delay))
+    )
+    anti_scraper_solution.DEGRADED_SCORING_STAGES.append(
+        ('simulated_work', lambda request, info, challenge, solution, compiled: time.sleep(args.degraded_delay))
+    )
+    app = anti_scraper_solution.create_app()
+
+    outcomes = []
+    barrier = threading.Barrier(args.clients)
+
+    def burst(client_id):
+        client = app.test_client()
+        barrier.wait()
+        outcomes.append(check(client, client_id))
+
+    threads = [threading.Thread(target=burst, args=(client_id,)) for client_id in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = controller.stats()
+    counts = {outcome: outcomes.count(outcome) for outcome in sorted(set(outcomes))}
+    recovered = check(app.test_client(), args.clients)
+    print(f"burst of {args.clients} checks in {elapsed:.2f} s: {counts}")
+    print(f"served per mode: {stats['served']}, {stats['transitions']} transitions")
+    print(f"after the burst: mode {controller.mode}, next check got a {recovered}")
+
+    # A known bot on its own network, checked while every request is degraded
+    bot_id = 1 << 20
+    with app.app_context():
+        bot_keys = anti_scraper_solution.client_keys("10.16.0.0", f"overload-{bot_id}")
+        scheduler = anti_scraper_solution.difficulty_scheduler
+        for _ in range(3):
+            scheduler.record(bot_keys, 90)
+        bot_difficulty = scheduler.difficulty(bot_keys)
+        degraded_watermark, controller.degraded_watermark = controller.degraded_watermark, 1
+        bot_outcomes = [check(app.test_client(), bot_id) for _ in range(20)]
+        controller.degraded_watermark = degraded_watermark
+        bot_difficulty_after = scheduler.difficulty(bot_keys)
+    print(f"known bot: difficulty {bot_difficulty} before and {bot_difficulty_after} after {len(bot_outcomes)} degraded checks")
+
+    failures = []
+    if any(outcome.startswith('HTTP') for outcome in outcomes):
+        failures.append("some checks failed outright")
+    if counts.get('token', 0) > stats['served'][controller.NORMAL]:
+        failures.append("real tokens were issued from degraded scoring")
+    if counts.get('page', 0) != stats['served'][controller.DEGRADED]:
+        failures.append("degraded checks did not get the protection page")
+    if not stats['served'][controller.DEGRADED] or not stats['served'][controller.REJECT]:
+        failures.append("the burst did not reach both degraded and reject mode")
+    if controller.mode != controller.NORMAL or recovered != 'token':
+        failures.append("the service did not recover")
+    if set(bot_outcomes) != {'page'}:
+        failures.append("the known bot's checks were not degraded")
+    if bot_difficulty_after != bot_difficulty:
+        failures.append("degraded checks changed the known bot's difficulty")
+    if failures:
+        raise SystemExit('; '.join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import math
+import sys
+import threading
+import time
+from array import array
+
+
+class RequestTimingTracker:
+    """Constant-size inter-arrival statistics per client with LRU eviction.
+
+    Every client occupies one slot in a set of parallel typed arrays: last
+    arrival time, EWMA and Welford mean/M2 of the inter-arrival time, and a
+    fixed-window burst counter. Slots are linked into an LRU list through
+    ``prev``/``next`` index arrays, so an update is O(1) and the least
+    recently seen client is recycled once ``capacity`` clients are tracked.
+    Arrays grow on demand, so memory follows the number of active clients
+    up to the cap.
+    """
+
+    def __init__(self, capacity=1000000, alpha=0.3, burst_window=60.0, burst_limit=60):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.burst_window = burst_window
+        self.burst_limit = burst_limit
+        self.lock = threading.Lock()
+
+        self.slots = {}  # hash(key) -> slot
+        self.slot_keys = array('q')
+        self.last_seen = array('d')
+        self.ewma = array('d')
+        self.mean = array('d')
+        self.m2 = array('d')
+        self.count = array('I')
+        self.window_start = array('d')
+        self.window_count = array('I')
+        self.bursts = array('I')
+        self.prev = array('i')
+        self.next = array('i')
+        self.head = -1  # most recently seen
+        self.tail = -1  # least recently seen
+
+    def __len__(self):
+        return len(self.slots)
+
+    def memory_bytes(self):
+        """Return the bytes held by the slot arrays and the key index."""
+        with self.lock:
+            columns = (
+                self.slot_keys, self.last_seen, self.ewma, self.mean, self.m2, self.count,
+                self.window_start, self.window_count, self.bursts, self.prev, self.next,
+            )
+            return sys.getsizeof(self.slots) + sum(column.buffer_info()[1] * column.itemsize for column in columns)
+
+    def _unlink(self, slot):
+        prev, next = self.prev[slot], self.next[slot]
+        if prev >= 0:
+            self.next[prev] = next
+        else:
+            self.head = next
+        if next >= 0:
+            self.prev[next] = prev
+        else:
+            self.tail = prev
+
+    def _push_front(self, slot):
+        self.prev[slot] = -1
+        self.next[slot] = self.head
+        if self.head >= 0:
+            self.prev[self.head] = slot
+        self.head = slot
+        if self.tail < 0:
+            self.tail = slot
+
+    def _allocate(self, key_hash, now):
+        if len(self.slot_keys) < self.capacity:
+            slot = len(self.slot_keys)
+            for column in (self.slot_keys, self.count, self.window_count, self.bursts, self.prev, self.next):
+                column.append(0)
+            for column in (self.last_seen, self.ewma, self.mean, self.m2, self.window_start):
+                column.append(0.0)
+        else:
+            slot = self.tail
+            self._unlink(slot)
+            del self.slots[self.slot_keys[slot]]
+
+        self.slots[key_hash] = slot
+        self.slot_keys[slot] = key_hash
+        self.last_seen[slot] = now
+        self.ewma[slot] = self.mean[slot] = self.m2[slot] = 0.0
+        self.count[slot] = 1
+        self.window_start[slot] = now
+        self.window_count[slot] = 1
+        self.bursts[slot] = 0
+        self._push_front(slot)
+
+    def record(self, key, now=None):
+        """Record one request from ``key``."""
+        now = time.time() if now is None else now
+        key_hash = hash(key)
+        with self.lock:
+            slot = self.slots.get(key_hash)
+            if slot is None:
+                self._allocate(key_hash, now)
+                return
+
+            interval = max(0.0, now - self.last_seen[slot])
+            self.last_seen[slot] = now
+            self.count[slot] += 1
+            intervals = self.count[slot] - 1
+
+            # EWMA and Welford's online mean/variance of the inter-arrival time
+            if intervals == 1:
+                self.ewma[slot] = interval
+            else:
+                self.ewma[slot] += self.alpha * (interval - self.ewma[slot])
+            delta = interval - self.mean[slot]
+            self.mean[slot] += delta / intervals
+            self.m2[slot] += delta * (interval - self.mean[slot])
+
+            if now - self.window_start[slot] >= self.burst_window:
+                self.window_start[slot] = now
+                self.window_count[slot] = 1
+            else:
+                self.window_count[slot] += 1
+                if self.window_count[slot] == self.burst_limit + 1:
+                    self.bursts[slot] += 1
+
+            if slot != self.head:
+                self._unlink(slot)
+                self._push_front(slot)
+
+    def stats(self, key):
+        """Return the timing statistics for ``key``, or None if it is not tracked."""
+        with self.lock:
+            slot = self.slots.get(hash(key))
+            if slot is None:
+                return None
+            intervals = self.count[slot] - 1
+            return {
+                'requests': self.count[slot],
+                'ewma_interval': self.ewma[slot],
+                'mean_interval': self.mean[slot],
+                'stddev_interval': math.sqrt(self.m2[slot] / intervals) if intervals > 1 else 0.0,
+                'window_requests': self.window_count[slot] if time.time() - self.window_start[slot] < self.burst_window else 0,
+                'bursts': self.bursts[slot],
+            }
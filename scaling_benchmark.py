@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+# Drives /bot-detection/check on the prefork server with several concurrent
+# client processes and reports throughput for each worker count. Each client
+# first gets a signed challenge from /bot-detection/challenge and solves it,
+# so checks take the normal token-issuing path; a real token is counted
+# apart from the fake tokens given to clients scored as bots. Run the
+# clients on other cores than the server (or on another host via --target),
+# otherwise they compete with the workers being measured.
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CHECK_HEADERS = {
+    'Content-Type': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def solve(challenge):
+    parts = challenge.split('|')
+    if parts[0] == 'pow':
+        nonce, bits = parts[1], int(parts[2])
+        for candidate in itertools.count():
+            digest = hashlib.sha256(f"{nonce}:{candidate}".encode()).digest()
+            if int.from_bytes(digest, 'big') >> (256 - bits) == 0:
+                return str(candidate)
+    a, b = int(parts[1]), int(parts[2])
+    return str({'add': a + b, 'sub': a - b, 'mul': a * b}[parts[0]])
+
+
+def check_body(host, port, fingerprint):
+    """Fetch and solve a signed challenge, returning the check body that answers it."""
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    connection.request('POST', '/bot-detection/challenge', json.dumps({'fingerprint': fingerprint}), CHECK_HEADERS)
+    challenge = json.loads(connection.getresponse().read())['challenge']
+    connection.close()
+    return json.dumps({
+        'challenge': challenge,
+        'solution': solve(challenge),
+        'info': {
+            'fingerprint': fingerprint,
+            'automationIndicators': {'webdriver': False},
+            'userActivity': {'mouseMovements': 40, 'scrollEvents': 6, 'keyPresses': 3, 'timeSinceLastActivity': 800},
+        },
+    })
+
+
+def client(host, port, duration, results, client_id):
+    """Send checks, reusing the connection when the server allows it, until ``duration`` has passed.
+
+    A math challenge can answer many checks until it expires; a proof of
+    work is spent by its first check, so a new challenge is fetched then.
+    """
+    statuses = {}
+    latencies = []
+    errors = 0
+    tokens = 0
+    connection = None
+    body = None
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        if body is None:
+            body = check_body(host, port, f"scaling-{client_id}")
+            reusable = not json.loads(body)['challenge'].startswith('pow|')
+        if connection is None:
+            connection = http.client.HTTPConnection(host, port, timeout=10)
+        started = time.perf_counter()
+        try:
+            connection.request('POST', '/bot-detection/check', body, CHECK_HEADERS)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Count the request as failed and reconnect, as a browser would
+            errors += 1
+            connection.close()
+            connection = None
+            continue
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        # Real tokens are signed ("<payload>.<signature>"); fake ones are not
+        if response.status == 200 and '.' in json.loads(data).get('token', ''):
+            tokens += 1
+        if not reusable:
+            body = None
+        if response.will_close:
+            connection.close()
+            connection = None
+    results.put((statuses, latencies, errors, tokens))
+
+
+def wait_until_serving(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=1)
+            connection.request('GET', '/bot-protection.js')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server did not respond within {timeout}s")
+
+
+def measure(workers, args):
+    """Start a server with ``workers`` workers, load it and return the totals."""
+    host, port = args.target.rsplit(':', 1) if args.target else ('127.0.0.1', str(free_port()))
+    port = int(port)
+    server = None
+    if not args.target:
+        command = [args.python, os.path.join(HERE, 'anti_scraper_solution.py'), '--port', str(port), '--workers', str(workers)]
+        if args.reuse_port:
+            command.append('--reuse-port')
+        server = subprocess.Popen(command, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_serving(host, port)
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(target=client, args=(host, port, args.duration, results, client_id))
+            for client_id in range(args.clients)
+        ]
+        for process in clients:
+            process.start()
+        if args.reload_after is not None and server:
+            time.sleep(args.reload_after)
+            server.send_signal(signal.SIGHUP)
+        collected = [results.get() for _ in clients]
+        for process in clients:
+            process.join()
+    finally:
+        if server:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    statuses = {}
+    latencies = []
+    for client_statuses, client_latencies, _, _ in collected:
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+        latencies.extend(client_latencies)
+    latencies.sort()
+    return {
+        'workers': workers,
+        'rps': statuses.get(200, 0) / args.duration,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        'statuses': statuses,
+        'tokens': sum(tokens for _, _, _, tokens in collected),
+        'errors': sum(errors for _, _, errors, _ in collected),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure /bot-detection/check throughput against the number of prefork workers")
+    parser.add_argument("--workers", default="1,2,4,8,16", help="Comma-separated worker counts to measure")
+    parser.add_argument("-c", "--clients", type=int, default=16, help="Concurrent client processes")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Seconds of load per worker count")
+    parser.add_argument("--reuse-port", action="store_true", help="Give each worker its own SO_REUSEPORT socket")
+    parser.add_argument("--reload-after", type=float, help="Send SIGHUP this many seconds into each run and report failed requests")
+    parser.add_argument("--target", help="host:port of an already running server instead of starting one")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter to run the server with")
+
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'tokens':>7}  statuses / failed requests")
+    for workers in (int(count) for count in args.workers.split(',')):
+        result = measure(workers, args)
+        print(f"{result['workers']:>7} {result['rps']:>8.0f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['tokens']:>7}  {result['statuses']} / {result['errors']}")
+
+
+if __name__ == "__main__":
+    main()
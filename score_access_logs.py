@@ -0,0 +1,382 @@
+import argparse
+import calendar
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+
+from werkzeug.datastructures import Headers
+
+import anti_scraper_solution as protection
+
+# Score web server access logs offline with the same stages check_bot uses
+# for request-derived signals. The parent process only reads raw lines and
+# hands them out in chunks; workers parse and score them and return per-IP
+# aggregates, which the parent merges. Memory therefore grows with the
+# number of distinct IPs, never with the size of the input.
+
+# host ident user [time] "request" status size ["referer" "user-agent"]
+LOG_LINE = re.compile(
+    r'(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<request>(?:[^"\\]|\\.)*)" (?P<status>\d{3}|-) \S+'
+    r'(?: "(?P<referer>(?:[^"\\]|\\.)*)" "(?P<user_agent>(?:[^"\\]|\\.)*)")?'
+)
+MONTHS = {name: number for number, name in enumerate(calendar.month_abbr) if name}
+
+# Stages that only need what an access log records. Header checks need the
+# full request headers, which only JSONL logs carry; scoring Combined logs
+# with them would penalize every line for the headers that were not logged.
+# The IP and UA stages are scored separately so each half can be cached on
+# its own key: a crawl repeats a handful of user agents across many IPs.
+IP_STAGES = ('ip_deny', 'ip_reputation')
+UA_STAGES = ('ua_blacklist', 'ua_consistency')
+HEADER_STAGES = ('ip_deny', 'ua_blacklist', 'headers', 'ip_reputation', 'ua_consistency')
+
+HISTOGRAM_BUCKET = 10
+
+
+class LogRequest:
+    """The request fields the scoring stages read, rebuilt from a log record."""
+
+    __slots__ = ('remote_addr', 'headers', 'form', 'is_json')
+
+    def __init__(self, ip, headers):
+        self.remote_addr = ip
+        self.headers = Headers(headers)
+        self.form = {}
+        self.is_json = False
+
+    def get_json(self, silent=False):
+        return None
+
+
+def parse_log_time(value):
+    """Parse ``10/Oct/2000:13:55:36 -0700`` to a Unix timestamp, or None."""
+    try:
+        day, month, year, hour, minute, second = value[0:2], value[3:6], value[7:11], value[12:14], value[15:17], value[18:20]
+        timestamp = calendar.timegm((int(year), MONTHS[month], int(day), int(hour), int(minute), int(second)))
+        offset = value[21:26]
+        if offset:
+            minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+            timestamp -= minutes * 60 if offset[0] == '+' else -minutes * 60
+        return timestamp
+    except (KeyError, ValueError, IndexError):
+        return None
+
+
+def parse_json_time(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return parse_log_time(value)
+    return None
+
+
+def parse_line(line):
+    """Parse one CLF, Combined or JSONL line into ``(ip, timestamp, status, headers, user_agent)``.
+
+    JSONL records use ``ip`` (or ``remote_addr``), ``time``, ``status``,
+    ``user_agent`` and an optional ``headers`` object. ``headers`` is None
+    when the line did not record request headers.
+    """
+    if line.startswith('{'):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        ip = record.get('ip') or record.get('remote_addr')
+        if not ip:
+            return None
+        headers = record.get('headers')
+        if isinstance(headers, dict):
+            headers = dict(headers)
+            if 'user_agent' in record:
+                headers.setdefault('User-Agent', record['user_agent'])
+        else:
+            headers = None
+        user_agent = record.get('user_agent') or (headers or {}).get('User-Agent', '')
+        return ip, parse_json_time(record.get('time')), record.get('status'), headers, user_agent
+
+    match = LOG_LINE.match(line)
+    if not match:
+        return None
+    status = match.group('status')
+    return (
+        match.group('ip'),
+        parse_log_time(match.group('time')),
+        int(status) if status != '-' else None,
+        None,
+        match.group('user_agent') or '',
+    )
+
+
+def read_lines(paths):
+    """Yield lines from log files, reading gzip files and stdin (``-``) transparently."""
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+            continue
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+            yield from f
+
+
+def chunked(lines, size):
+    """Group lines into lists of ``size``."""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+_stages = {}
+
+
+def init_worker(overrides):
+    """Apply config overrides and open the reputation database in a worker."""
+    if overrides:
+        protection.config.update(overrides)
+        protection.reload_config()
+    protection.load_ip_reputation_db()
+    ip_points.cache_clear()
+    ua_points.cache_clear()
+    by_name = dict(protection.SCORING_STAGES)
+    for key, names in (('ip', IP_STAGES), ('ua', UA_STAGES), ('headers', HEADER_STAGES)):
+        _stages[key] = [(name, by_name[name]) for name in names]
+
+
+@lru_cache(maxsize=65536)
+def ip_points(ip):
+    return protection.run_scoring_pipeline(LogRequest(ip, {}), {}, '', '', protection.compiled_config(), _stages['ip'])[0]
+
+
+@lru_cache(maxsize=4096)
+def ua_points(user_agent):
+    request = LogRequest(None, {'User-Agent': user_agent})
+    return protection.run_scoring_pipeline(request, {}, '', '', protection.compiled_config(), _stages['ua'])[0]
+
+
+def score_log_request(ip, user_agent):
+    """Score a log line without request headers from its IP and UA signals."""
+    return min(ip_points(ip) + ua_points(user_agent), 100)
+
+
+def new_aggregate():
+    # requests, score sum, max score, flagged, blocked, first seen, last seen, errors (4xx/5xx), sample UA
+    return [0, 0, 0, 0, 0, None, None, 0, '']
+
+
+def score_chunk(lines):
+    """Parse and score a chunk of lines, returning per-IP aggregates and a score histogram."""
+    if not _stages:
+        init_worker(None)
+    compiled = protection.compiled_config()
+    threshold, block = compiled.threshold_score, compiled.block_threshold
+    aggregates = {}
+    histogram = [0] * (100 // HISTOGRAM_BUCKET + 1)
+    unparsed = 0
+
+    for line in lines:
+        record = parse_line(line.strip())
+        if record is None:
+            unparsed += 1
+            continue
+        ip, timestamp, status, headers, user_agent = record
+
+        if headers is None:
+            score = score_log_request(ip, user_agent)
+        else:
+            score = protection.run_scoring_pipeline(LogRequest(ip, headers), {}, '', '', compiled, _stages['headers'])[0]
+
+        entry = aggregates.get(ip)
+        if entry is None:
+            entry = aggregates[ip] = new_aggregate()
+            entry[8] = user_agent[:200]
+        elif timestamp is not None and entry[5] is not None and timestamp < entry[5]:
+            entry[8] = user_agent[:200]
+        entry[0] += 1
+        entry[1] += score
+        if score > entry[2]:
+            entry[2] = score
+        if score >= block:
+            entry[4] += 1
+        elif score >= threshold:
+            entry[3] += 1
+        if timestamp is not None:
+            if entry[5] is None or timestamp < entry[5]:
+                entry[5] = timestamp
+            if entry[6] is None or timestamp > entry[6]:
+                entry[6] = timestamp
+        if isinstance(status, int) and status >= 400:
+            entry[7] += 1
+        histogram[int(score) // HISTOGRAM_BUCKET] += 1
+
+    return aggregates, histogram, len(lines), unparsed
+
+
+def merge_aggregate(into, entry):
+    into[0] += entry[0]
+    into[1] += entry[1]
+    into[2] = max(into[2], entry[2])
+    into[3] += entry[3]
+    into[4] += entry[4]
+    # Keep the user agent of the earliest request so results do not depend on chunk order
+    if entry[5] is not None and (into[5] is None or entry[5] < into[5]):
+        into[8] = entry[8]
+    for index, pick in ((5, min), (6, max)):
+        if entry[index] is not None:
+            into[index] = entry[index] if into[index] is None else pick(into[index], entry[index])
+    into[7] += entry[7]
+
+
+class LogScoreReport:
+    """Per-IP aggregates and the request score histogram merged from chunk results."""
+
+    def __init__(self):
+        self.ips = {}
+        self.histogram = [0] * (100 // HISTOGRAM_BUCKET + 1)
+        self.lines = 0
+        self.unparsed = 0
+
+    def add(self, result):
+        aggregates, histogram, lines, unparsed = result
+        for ip, entry in aggregates.items():
+            existing = self.ips.get(ip)
+            if existing is None:
+                self.ips[ip] = entry
+            else:
+                merge_aggregate(existing, entry)
+        self.histogram = [a + b for a, b in zip(self.histogram, histogram)]
+        self.lines += lines
+        self.unparsed += unparsed
+
+    def verdicts(self, compiled):
+        """Yield one verdict dict per IP; an IP is judged on its mean request score."""
+        for ip, (requests, score_sum, max_score, flagged, blocked, first, last, errors, user_agent) in self.ips.items():
+            mean = score_sum / requests
+            duration = (last - first) if first is not None and last is not None else None
+            yield {
+                'ip': ip,
+                'verdict': protection.score_decision(mean, compiled),
+                'requests': requests,
+                'mean_score': round(mean, 1),
+                'max_score': max_score,
+                'flagged_requests': flagged,
+                'blocked_requests': blocked,
+                'error_responses': errors,
+                'requests_per_minute': round(requests * 60 / duration, 1) if duration else None,
+                'first_seen': first,
+                'last_seen': last,
+                'user_agent': user_agent,
+            }
+
+
+def score_logs(paths, workers=None, chunk_size=20000, overrides=None, progress=None):
+    """Score log files and return a :class:`LogScoreReport`.
+
+    At most ``2 * workers`` chunks are in flight, so reading never runs
+    ahead of scoring and parent memory stays bounded on any input size.
+    """
+    workers = workers or os.cpu_count() or 1
+    report = LogScoreReport()
+    chunks = chunked(read_lines(paths), chunk_size)
+
+    if workers == 1:
+        init_worker(overrides)
+        for chunk in chunks:
+            report.add(score_chunk(chunk))
+            if progress:
+                progress(report)
+        return report
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(overrides,)) as pool:
+        pending = set()
+        for chunk in chunks:
+            pending.add(pool.submit(score_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    report.add(future.result())
+                if progress:
+                    progress(report)
+        for future in pending:
+            report.add(future.result())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score access logs offline and report per-IP bot verdicts")
+    parser.add_argument("logs", nargs='+', help="Log files in Common/Combined Log Format or JSONL (.gz supported, - for stdin)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="Lines per work unit")
+    parser.add_argument("--config", help="JSON file of config overrides (thresholds, blacklists, ip_reputation_db, ...)")
+    parser.add_argument("--ip-reputation-db", help="IP reputation database to score against")
+    parser.add_argument("-o", "--output", help="Write every per-IP verdict to this JSONL file")
+    parser.add_argument("--top", type=int, default=20, help="Number of highest scoring IPs to print")
+    parser.add_argument("--min-requests", type=int, default=1, help="Only list IPs with at least this many requests")
+
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.config:
+        with open(args.config) as f:
+            overrides.update(json.load(f))
+    if args.ip_reputation_db:
+        overrides['ip_reputation_db'] = args.ip_reputation_db
+    if overrides:
+        protection.config.update(overrides)
+        protection.reload_config()
+
+    started = time.time()
+    report = score_logs(args.logs, args.workers, args.chunk_size, overrides)
+    elapsed = time.time() - started
+    compiled = protection.compiled_config()
+
+    counts = {'allow': 0, 'flag': 0, 'block': 0}
+    top = []
+    output = open(args.output, 'w') if args.output else None
+    try:
+        for verdict in report.verdicts(compiled):
+            counts[verdict['verdict']] += 1
+            if output:
+                output.write(json.dumps(verdict) + '\n')
+            if verdict['requests'] >= args.min_requests and args.top:
+                top.append(verdict)
+                if len(top) > 4 * args.top:
+                    top.sort(key=lambda v: (v['mean_score'], v['requests']), reverse=True)
+                    del top[args.top:]
+    finally:
+        if output:
+            output.close()
+    top.sort(key=lambda v: (v['mean_score'], v['requests']), reverse=True)
+
+    print(f"Scored {report.lines} lines ({report.unparsed} unparsed) from {len(report.ips)} IPs "
+          f"in {elapsed:.1f}s ({report.lines / max(elapsed, 1e-9):.0f} lines/s)")
+    print(f"Verdicts: {counts['allow']} allow, {counts['flag']} flag, {counts['block']} block "
+          f"(threshold {compiled.threshold_score}, block {compiled.block_threshold})")
+
+    print("Request scores:")
+    scored = sum(report.histogram) or 1
+    for bucket, count in enumerate(report.histogram):
+        low = bucket * HISTOGRAM_BUCKET
+        label = f"{low}-{min(low + HISTOGRAM_BUCKET - 1, 100)}" if low < 100 else "100"
+        print(f"  {label:>7} {count:>10} {100 * count / scored:5.1f}%")
+
+    if top:
+        print(f"Top {min(args.top, len(top))} IPs by mean score:")
+        for verdict in top[:args.top]:
+            rate = verdict['requests_per_minute']
+            print(f"  {verdict['ip']:<39} {verdict['verdict']:<5} mean {verdict['mean_score']:>5} "
+                  f"max {verdict['max_score']:>3} requests {verdict['requests']:>8} "
+                  f"rpm {rate if rate is not None else '-':>7}  {verdict['user_agent'][:60]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import base64
+import hashlib
+import heapq
+import math
+from array import array
+
+# Streaming summaries with fixed memory. Every sketch hashes keys with
+# blake2b rather than the built-in hash(), which is randomized per process,
+# so sketches built in different workers can be merged.
+
+
+def _hash128(key):
+    digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+def _encode(data):
+    return base64.b64encode(bytes(data)).decode()
+
+
+def _decode(data):
+    if not isinstance(data, str):
+        raise TypeError("sketch data must be a base64 string")
+    return base64.b64decode(data.encode(), validate=True)
+
+
+class CountMinSketch:
+    """Approximate per-key counts that never underestimate."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+
+    def _columns(self, key):
+        h1, h2 = _hash128(key)
+        h2 |= 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        for row, column in zip(self.rows, self._columns(key)):
+            row[column] += count
+
+    def estimate(self, key):
+        return min(row[column] for row, column in zip(self.rows, self._columns(key)))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("cannot merge Count-Min sketches of different shapes")
+        for row, other_row in zip(self.rows, other.rows):
+            for column, count in enumerate(other_row):
+                if count:
+                    row[column] += count
+
+    def shape(self):
+        return {'width': self.width, 'depth': self.depth}
+
+    def to_state(self):
+        return {'width': self.width, 'depth': self.depth, 'rows': [_encode(row) for row in self.rows]}
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state['width'], state['depth'])
+        sketch.rows = [array('Q', _decode(row)) for row in state['rows']]
+        if len(sketch.rows) != sketch.depth or any(len(row) != sketch.width for row in sketch.rows):
+            raise ValueError("Count-Min rows do not match the sketch width and depth")
+        return sketch
+
+
+class HyperLogLog:
+    """Approximate distinct count using 2**precision one-byte registers."""
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, key):
+        value = _hash128(key)[0]
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def shape(self):
+        return {'precision': self.precision}
+
+    def to_state(self):
+        return {'precision': self.precision, 'registers': _encode(self.registers)}
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state['precision'])
+        sketch.registers = bytearray(_decode(state['registers']))
+        if len(sketch.registers) != 1 << sketch.precision:
+            raise ValueError("HyperLogLog registers do not match the precision")
+        return sketch
+
+
+class SpaceSaving:
+    """Top-K heavy hitters with at most ``k`` monitored keys.
+
+    Each monitored key keeps its (over-)estimated weight and the maximum
+    overestimation error. With ``distinct_precision`` set, each key also
+    carries a small HyperLogLog of the items seen with it, which answers
+    questions like "distinct fingerprints per IP" for the heaviest keys.
+
+    Eviction finds the lightest key through a min-heap holding one
+    ``(weight, key)`` entry per monitored key. Weights only grow, so entries
+    are refreshed lazily when they reach the top, which keeps eviction at
+    amortized O(log k).
+    """
+
+    def __init__(self, k=100, distinct_precision=None):
+        self.k = k
+        self.distinct_precision = distinct_precision
+        self.counters = {}  # key -> [weight, error, HyperLogLog or None]
+        self.heap = []  # (weight at last refresh, key), one entry per monitored key
+
+    def _new_distinct(self):
+        return HyperLogLog(self.distinct_precision) if self.distinct_precision else None
+
+    def add(self, key, weight=1, item=None):
+        counter = self.counters.get(key)
+        if counter is None:
+            if len(self.counters) < self.k:
+                counter = self.counters[key] = [0, 0, self._new_distinct()]
+                heapq.heappush(self.heap, (weight, key))
+            else:
+                # Replace the lightest key; the newcomer inherits its weight as error
+                floor = self._pop_lightest()
+                counter = self.counters[key] = [floor, floor, self._new_distinct()]
+                heapq.heappush(self.heap, (floor + weight, key))
+        counter[0] += weight
+        if item is not None and counter[2] is not None:
+            counter[2].add(item)
+
+    def _pop_lightest(self):
+        """Remove the lightest monitored key and return its weight."""
+        while True:
+            weight, key = self.heap[0]
+            current = self.counters[key][0]
+            if current == weight:
+                heapq.heappop(self.heap)
+                del self.counters[key]
+                return weight
+            heapq.heapreplace(self.heap, (current, key))
+
+    def _rebuild_heap(self):
+        self.heap = [(counter[0], key) for key, counter in self.counters.items()]
+        heapq.heapify(self.heap)
+
+    def top(self, n=None):
+        """Return ``[(key, weight, error, distinct)]`` heaviest first."""
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)
+        return [
+            (key, weight, error, distinct.count() if distinct else None)
+            for key, (weight, error, distinct) in ranked[:n]
+        ]
+
+    def merge(self, other):
+        own_floor = min((c[0] for c in self.counters.values()), default=0) if len(self.counters) >= self.k else 0
+        other_floor = min((c[0] for c in other.counters.values()), default=0) if len(other.counters) >= other.k else 0
+
+        merged = {}
+        for key in set(self.counters) | set(other.counters):
+            mine = self.counters.get(key, [own_floor, own_floor, None])
+            theirs = other.counters.get(key, [other_floor, other_floor, None])
+            distinct = self._new_distinct()
+            for sketch in (mine[2], theirs[2]):
+                if sketch is not None and distinct is not None:
+                    distinct.merge(sketch)
+            merged[key] = [mine[0] + theirs[0], mine[1] + theirs[1], distinct]
+
+        ranked = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)
+        self.counters = dict(ranked[:self.k])
+        self._rebuild_heap()
+
+    def shape(self):
+        return {'k': self.k, 'distinct_precision': self.distinct_precision}
+
+    def to_state(self):
+        return {
+            'k': self.k,
+            'distinct_precision': self.distinct_precision,
+            'counters': [
+                [key, weight, error, distinct.to_state()['registers'] if distinct else None]
+                for key, (weight, error, distinct) in self.counters.items()
+            ],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state['k'], state['distinct_precision'])
+        if len(state['counters']) > sketch.k:
+            raise ValueError("more Space-Saving counters than k")
+        for key, weight, error, registers in state['counters']:
+            if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in (weight, error)):
+                raise TypeError("Space-Saving weights must be numbers")
+            distinct = None
+            if registers is not None:
+                distinct = HyperLogLog.from_state({'precision': sketch.distinct_precision, 'registers': registers})
+            sketch.counters[key] = [weight, error, distinct]
+        sketch._rebuild_heap()
+        return sketch
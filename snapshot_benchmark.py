@@ -0,0 +1,121 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Measures what a warm restart costs: the size of the snapshot files, how
+# long a background snapshot blocks the process and how long its child
+# takes, and how long a fresh interpreter takes to restore them. The
+# restarted process must still accept a token issued before the restart
+# and still refuse one revoked before it.
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+RESTART = r'''
+import json, logging, sys, time
+logging.disable(logging.WARNING)
+import anti_scraper_solution
+anti_scraper_solution.config['snapshot_dir'] = sys.argv[1]
+tokens = json.loads(sys.argv[2])
+started = time.perf_counter()
+restored = anti_scraper_solution.state_snapshots.restore()
+restore_ms = (time.perf_counter() - started) * 1000
+app = anti_scraper_solution.create_app()
+with app.test_request_context('/'):
+    print(json.dumps({
+        'restore_ms': restore_ms,
+        'restored': restored,
+        'kept_token_valid': anti_scraper_solution.verify_protection_token(tokens['kept']),
+        'revoked_token_valid': anti_scraper_solution.verify_protection_token(tokens['revoked']),
+    }))
+'''
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+    'Host': 'example.com',
+}
+
+
+def fill(module, ips, per_ip, revocations):
+    """Record detections and revocations like a busy server would."""
+    store = module.detected_bots
+    expires_at = time.time() + module.config['detection_retention']
+    for i in range(ips):
+        ip = f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+        for j in range(per_ip):
+            store.append(ip, {
+                'timestamp': f"2026-01-01T00:00:{j % 60:02d}.000000",
+                'ip': ip,
+                'user_agent': HEADERS['User-Agent'],
+                'score': 80,
+                'fingerprint': f"fp-{i}",
+                'automation_indicators': {'webdriver': True},
+                'headers': dict(HEADERS),
+            }, expires_at, limit=module.config['detections_per_ip'])
+    for i in range(revocations):
+        module.revocation_filter.revoke(token=f"revoked-{i}")
+
+
+def timed_save(snapshots):
+    """Return the milliseconds a background snapshot blocked the caller and its child took."""
+    started = time.perf_counter()
+    snapshots.save()
+    blocked = time.perf_counter() - started
+    snapshots._reap(block=True)
+    return blocked * 1000, snapshots.last_save_seconds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure snapshot size, snapshot cost and restore time")
+    parser.add_argument("--ips", type=int, default=100000, help="IPs with detections")
+    parser.add_argument("--per-ip", type=int, default=5, help="Detections per IP")
+    parser.add_argument("--revocations", type=int, default=50000, help="Tokens revoked before the restart")
+    parser.add_argument("--dir", help="Snapshot directory (a temporary one by default)")
+
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    directory = args.dir or tempfile.mkdtemp(prefix='snapshot-benchmark-')
+
+    import anti_scraper_solution
+    anti_scraper_solution.config['snapshot_dir'] = directory
+    snapshots = anti_scraper_solution.state_snapshots
+    snapshots.restore()
+    app = anti_scraper_solution.create_app()
+
+    started = time.perf_counter()
+    fill(anti_scraper_solution, args.ips, args.per_ip, args.revocations)
+    with app.test_request_context('/'):
+        tokens = {
+            'kept': anti_scraper_solution.generate_token('snapshot-kept'),
+            'revoked': anti_scraper_solution.generate_token('snapshot-revoked'),
+        }
+        anti_scraper_solution.revocation_filter.revoke(token=tokens['revoked'])
+    print(f"filled {args.ips * args.per_ip} detections from {args.ips} IPs and {args.revocations + 1} revocations in {time.perf_counter() - started:.1f} s")
+
+    full_blocked, full_child = timed_save(snapshots)
+    anti_scraper_solution.detected_bots.append('10.255.255.255', {'timestamp': '', 'ip': '10.255.255.255'}, time.time() + 60)
+    one_blocked, one_child = timed_save(snapshots)
+    files = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.snap')]
+    size = sum(os.path.getsize(path) for path in files)
+    print(f"snapshot: {len(files)} files, {size / 1e6:.1f} MB")
+    print(f"full snapshot: blocked {full_blocked:.1f} ms, child {full_child:.0f} ms")
+    print(f"one changed shard: blocked {one_blocked:.1f} ms, child {one_child:.0f} ms")
+
+    output = subprocess.run(
+        [sys.executable, '-c', RESTART, directory, json.dumps(tokens)], cwd=HERE, capture_output=True, text=True, check=True
+    ).stdout
+    restart = json.loads(output.strip().splitlines()[-1])
+    print(f"restore in a fresh process: {restart['restore_ms']:.0f} ms, {restart['restored']}")
+    print(f"after the restart: token issued before it valid={restart['kept_token_valid']}, revoked token valid={restart['revoked_token_valid']}")
+    if not restart['kept_token_valid'] or restart['revoked_token_valid']:
+        raise SystemExit("tokens did not survive the restart as expected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import ast
+import json
+import os
+import subprocess
+import tempfile
+
+# Measures the per-event cost of the client snippet's activity listeners in
+# node, against a minimal DOM stub instead of a headless browser. The snippet
+# is taken from HTML_HEAD_SNIPPET in a copy of anti_scraper_solution.py, so an
+# older revision can be measured the same way, e.g.
+#   git show <rev>:anti_scraper_solution.py > /tmp/old.py
+#   python snippet_benchmark.py --source /tmp/old.py
+# After the events, the snippet's own token request is captured to check that
+# the behavioural counters it reports match the events dispatched.
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HARNESS = r'''
+const fs = require('fs');
+const [file, events, perFrame] = [process.argv[2], Number(process.argv[3]), Number(process.argv[4])];
+
+const listeners = {};
+let frameCallbacks = [];
+let timers = [];
+let checkBody = null;
+const realNow = Date.now;
+
+function element(tag) {
+    return {
+        tagName: tag.toUpperCase(), nodeType: 1, style: {}, children: [],
+        appendChild(child) { this.children.push(child); },
+        querySelector() { return null; },
+        getElementsByTagName() { return []; },
+        getContext() { return null; },
+    };
+}
+const forms = [element('form'), element('form')];
+const storage = {};
+const define = (name, value) => Object.defineProperty(globalThis, name, { value, configurable: true, writable: true });
+define('window', { requestAnimationFrame: callback => frameCallbacks.push(callback), localStorage: true });
+define('navigator', { userAgent: 'snippet-benchmark', language: 'en', plugins: [], mimeTypes: [], webdriver: false });
+define('screen', { width: 1920, height: 1080, colorDepth: 24 });
+define('location', { protocol: 'http:' });
+define('localStorage', {
+    getItem: key => (key in storage ? storage[key] : null),
+    setItem: (key, value) => { storage[key] = String(value); },
+    removeItem: key => { delete storage[key]; },
+});
+define('document', {
+    readyState: 'complete', forms, documentElement: element('html'), cookie: '',
+    addEventListener: (type, listener) => { listeners[type] = listener; },
+    querySelectorAll: () => forms,
+    createElement: element,
+});
+window.document = document;
+define('MutationObserver', class { observe() {} });
+define('setTimeout', callback => timers.push(callback));
+define('clearTimeout', () => {});
+define('setInterval', () => 0);
+define('fetch', async (url, options) => {
+    if (url.indexOf('challenge') !== -1) {
+        return { ok: true, json: async () => ({ challenge: 'add|1|2', formats: ['json'] }) };
+    }
+    checkBody = JSON.parse(options.body);
+    return { ok: true, json: async () => ({ token: 'benchmark', expires_in: 1800 }) };
+});
+
+eval(fs.readFileSync(file, 'utf8'));
+
+function flushFrames() {
+    const callbacks = frameCallbacks;
+    frameCallbacks = [];
+    callbacks.forEach(callback => callback());
+}
+
+function dispatch(listener, count) {
+    const event = {};
+    for (let i = 1; i <= count; i++) {
+        listener(event);
+        if (i % perFrame === 0) {
+            flushFrames();
+        }
+    }
+    flushFrames();
+}
+
+(async () => {
+    const results = {};
+    const dispatched = {};
+    const counted = Math.max(1, Math.floor(events / 10));
+    for (const type of ['mousemove', 'scroll', 'keydown']) {
+        const listener = listeners[type];
+        dispatch(listener, 100000);  // warm up
+
+        const started = process.hrtime.bigint();
+        dispatch(listener, events);
+        const nanoseconds = Number(process.hrtime.bigint() - started) / events;
+
+        let dateNowCalls = 0;
+        Date.now = () => { dateNowCalls++; return realNow(); };
+        dispatch(listener, counted);
+        Date.now = realNow;
+
+        dispatched[type] = 100000 + events + counted;
+        results[type] = { ns_per_event: nanoseconds, date_now_per_event: dateNowCalls / counted };
+    }
+
+    // The snippet asked for a token on start (deferred through setTimeout);
+    // run it now and read the counters it sends
+    timers.splice(0).forEach(callback => callback());
+    for (let i = 0; i < 100 && !checkBody; i++) {
+        await new Promise(resolve => setImmediate(resolve));
+    }
+    const activity = checkBody ? checkBody.info.userActivity : {};
+    results.counters_match = activity.mouseMovements === dispatched.mousemove &&
+        activity.scrollEvents === dispatched.scroll && activity.keyPresses === dispatched.keydown;
+    console.log(JSON.stringify(results));
+})();
+'''
+
+
+def load_snippet(source):
+    """Return the JavaScript inside HTML_HEAD_SNIPPET of ``source`` without importing it."""
+    with open(source) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'HTML_HEAD_SNIPPET' for target in node.targets):
+            snippet = ast.literal_eval(node.value).strip()
+            return snippet[len('<script>'):-len('</script>')]
+    raise SystemExit(f"no HTML_HEAD_SNIPPET in {source}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the per-event cost of the client snippet's activity listeners")
+    parser.add_argument("--source", default=os.path.join(HERE, 'anti_scraper_solution.py'), help="Module to take HTML_HEAD_SNIPPET from")
+    parser.add_argument("-n", "--events", type=int, default=5000000, help="Events timed per event type")
+    parser.add_argument("--per-frame", type=int, default=8, help="Events between two animation frames")
+    parser.add_argument("--node", default="node", help="Node.js binary")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        snippet = os.path.join(directory, 'snippet.js')
+        harness = os.path.join(directory, 'harness.js')
+        with open(snippet, 'w') as f:
+            f.write(load_snippet(args.source))
+        with open(harness, 'w') as f:
+            f.write(HARNESS)
+        completed = subprocess.run(
+            [args.node, harness, snippet, str(args.events), str(args.per_frame)],
+            capture_output=True, text=True,
+        )
+    if completed.returncode:
+        raise SystemExit(completed.stderr)
+    results = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    print(f"{args.source}, {args.events} events per type, one frame per {args.per_frame} events:")
+    for kind in ('mousemove', 'scroll', 'keydown'):
+        print(f"  {kind:<10} {results[kind]['ns_per_event']:6.1f} ns/event  {results[kind]['date_now_per_event']:.3f} Date.now() per event")
+    print(f"  reported counters match the events dispatched: {results['counters_match']}")
+    if not results['counters_match']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
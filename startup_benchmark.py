@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Every measurement runs in a fresh interpreter, since a warm process has
+# its imports cached and would hide exactly the cost being measured.
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+IN_PROCESS = r'''
+import json, sys, time
+started = time.perf_counter()
+import anti_scraper_solution
+imported = time.perf_counter()
+app = anti_scraper_solution.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/bot-protection.js')
+assert response.status_code == 200, response.status_code
+responded = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_response_ms': (responded - created) * 1000,
+    'user_agents_loaded': 'user_agents' in sys.modules,
+}))
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure_in_process(python):
+    output = subprocess.run([python, '-c', IN_PROCESS], cwd=HERE, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_server(python, workers, timeout=30):
+    """Return milliseconds from launching the server to its first successful response."""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [python, os.path.join(HERE, 'anti_scraper_solution.py'), '--port', str(port), '--workers', str(workers)],
+        cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f'http://127.0.0.1:{port}/bot-protection.js'
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError(f"server did not respond within {timeout}s")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def summarize(values):
+    return f"median {statistics.median(values):7.1f} ms  min {min(values):7.1f} ms  max {max(values):7.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time to first response of the protection server")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--workers", type=int, default=1, help="Prefork workers for the server measurement (0 = skip it)")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter to benchmark")
+
+    args = parser.parse_args()
+
+    samples = [measure_in_process(args.python) for _ in range(args.runs)]
+    print(f"In-process, {args.runs} runs:")
+    for key in ('import_ms', 'create_app_ms', 'first_response_ms'):
+        print(f"  {key[:-3]:<16} {summarize([sample[key] for sample in samples])}")
+    print(f"  user_agents imported by the first response: {samples[0]['user_agents_loaded']}")
+
+    if args.workers:
+        timings = [measure_server(args.python, args.workers) for _ in range(args.runs)]
+        print(f"Server with {args.workers} worker(s), launch to first response:")
+        print(f"  {'first_response':<16} {summarize(timings)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import logging
+import threading
+import time
+
+import anti_scraper_solution
+
+# Hammers the sharded stores from many threads through the same functions the
+# request handlers use. Detections go to a handful of shared IPs so that many
+# threads append to the same keys, which is where unlocked stores lost writes.
+
+
+class FakeRequest:
+    def __init__(self, ip):
+        self.remote_addr = ip
+        self.headers = {'User-Agent': 'store-stress-test'}
+
+
+def worker(thread_id, iterations, ips, failures):
+    request = FakeRequest(f"10.0.0.{thread_id % ips}")
+    for i in range(iterations):
+        token = anti_scraper_solution.generate_token(f"stress-{thread_id}-{i}")
+        if not anti_scraper_solution.verify_protection_token(token):
+            failures.append(token)
+        anti_scraper_solution.log_bot_detection(request, 90, {'fingerprint': f"stress-{thread_id}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the in-process stores for lost writes under concurrent access")
+    parser.add_argument("-t", "--threads", type=int, default=64, help="Concurrent threads")
+    parser.add_argument("-n", "--iterations", type=int, default=500, help="Issue/verify/log rounds per thread")
+    parser.add_argument("--ips", type=int, default=8, help="Distinct client IPs the detections are spread over")
+
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    # Keep every detection, so a lost append shows up in the count
+    anti_scraper_solution.config['detections_per_ip'] = args.threads * args.iterations
+
+    failures = []
+    threads = [
+        threading.Thread(target=worker, args=(thread_id, args.iterations, args.ips, failures))
+        for thread_id in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    expected = args.threads * args.iterations
+    detections = sum(len(entries) for _, entries in anti_scraper_solution.detected_bots.items())
+    print(f"tokens rejected:     {len(failures)} / {expected}")
+    print(f"detections recorded: {detections} / {expected}")
+    print(f"throughput:          {expected / elapsed:,.0f} issue/verify/log rounds/s over {elapsed:.2f} s")
+
+    if failures or detections != expected:
+        raise SystemExit("lost or rejected writes")
+
+
+if __name__ == "__main__":
+    main()
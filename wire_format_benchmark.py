@@ -0,0 +1,185 @@
+import argparse
+import base64
+import json
+import logging
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+import anti_scraper_solution
+from snippet_benchmark import load_snippet
+
+# Compares the JSON and compact /bot-detection/check bodies. The bodies are
+# produced by the client snippet itself, run in node against a DOM stub that
+# looks like desktop Chrome, once with only 'json' advertised and once with
+# 'packed' too. Both are posted through the Flask test client to check that
+# they earn a token, timing the whole check, and the parse of each body is
+# timed on its own.
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+}
+
+HARNESS = r'''
+const fs = require('fs');
+const [file, challenge, formats] = [process.argv[2], process.argv[3], process.argv[4].split(',')];
+
+const listeners = {};
+let frameCallbacks = [];
+let timers = [];
+let cookie = '';
+
+function element(tag) {
+    return {
+        tagName: tag.toUpperCase(), nodeType: 1, style: {}, children: [],
+        appendChild(child) { this.children.push(child); },
+        querySelector() { return null; },
+        getElementsByTagName() { return []; },
+        getContext(kind) {
+            if (kind !== 'webgl') return null;
+            return {
+                VENDOR: 0x1F00, RENDERER: 0x1F01,
+                getParameter: name => (name === 0x1F00 ? 'Google Inc. (NVIDIA)'
+                    : 'ANGLE (NVIDIA, NVIDIA GeForce RTX 3060 Direct3D11 vs_5_0 ps_5_0, D3D11)'),
+            };
+        },
+    };
+}
+const storage = {};
+const define = (name, value) => Object.defineProperty(globalThis, name, { value, configurable: true, writable: true });
+define('window', { requestAnimationFrame: callback => frameCallbacks.push(callback), localStorage: true, sessionStorage: true, indexedDB: true });
+define('navigator', {
+    userAgent: 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    language: 'en-US', platform: 'Win32', plugins: { length: 5 }, mimeTypes: { length: 2 }, webdriver: false,
+});
+define('screen', { width: 1920, height: 1080, colorDepth: 24 });
+define('location', { protocol: 'https:' });
+define('localStorage', {
+    getItem: key => (key in storage ? storage[key] : null),
+    setItem: (key, value) => { storage[key] = String(value); },
+    removeItem: key => { delete storage[key]; },
+});
+const document = {
+    readyState: 'complete', forms: [], documentElement: element('html'),
+    addEventListener: (type, listener) => { listeners[type] = listener; },
+    querySelectorAll: () => [],
+    createElement: element,
+};
+Object.defineProperty(document, 'cookie', {
+    get: () => cookie,
+    set: value => { cookie = value.indexOf('1970') === -1 ? value.split(';')[0] : ''; },
+});
+define('document', document);
+window.document = document;
+define('MutationObserver', class { observe() {} });
+define('setTimeout', callback => timers.push(callback));
+define('clearTimeout', () => {});
+define('setInterval', () => 0);
+define('fetch', async (url, options) => {
+    if (url.indexOf('challenge') !== -1) {
+        return { ok: true, json: async () => ({ challenge, formats }) };
+    }
+    const body = typeof options.body === 'string' ? Buffer.from(options.body) : Buffer.from(options.body);
+    console.log(JSON.stringify({ type: options.headers['Content-Type'], body: body.toString('base64') }));
+    process.exit(0);
+});
+
+eval(fs.readFileSync(file, 'utf8'));
+
+// A short visit: some mouse movement, a few scrolls and key presses
+for (const [type, count] of [['mousemove', 40], ['scroll', 6], ['keydown', 3]]) {
+    for (let i = 0; i < count; i++) {
+        listeners[type]({});
+        frameCallbacks.splice(0).forEach(callback => callback());
+    }
+}
+(async () => {
+    for (let i = 0; i < 100; i++) {
+        timers.splice(0).forEach(callback => callback());
+        await new Promise(resolve => setImmediate(resolve));
+    }
+    console.error('the snippet sent no check request');
+    process.exit(1);
+})();
+'''
+
+
+def capture_body(node, snippet, challenge, formats):
+    """Run the snippet and return the content type and body of its check request."""
+    with tempfile.TemporaryDirectory() as directory:
+        snippet_path = os.path.join(directory, 'snippet.js')
+        harness = os.path.join(directory, 'harness.js')
+        with open(snippet_path, 'w') as f:
+            f.write(snippet)
+        with open(harness, 'w') as f:
+            f.write(HARNESS)
+        completed = subprocess.run([node, harness, snippet_path, challenge, ','.join(formats)], capture_output=True, text=True)
+    if completed.returncode:
+        raise SystemExit(completed.stderr)
+    captured = json.loads(completed.stdout.strip().splitlines()[-1])
+    return captured['type'], base64.b64decode(captured['body'])
+
+
+def best_us(function, body, iterations, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            function(body)
+        runs.append((time.perf_counter() - started) / iterations * 1e6)
+    return min(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the size and parse time of JSON and compact check bodies")
+    parser.add_argument("-n", "--iterations", type=int, default=100000, help="Parses per run")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Runs per format (the best is reported)")
+    parser.add_argument("--requests", type=int, default=500, help="Checks posted per format to time the whole request")
+    parser.add_argument("--node", default="node", help="Node.js binary")
+
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    snippet = load_snippet(os.path.join(HERE, 'anti_scraper_solution.py'))
+    app = anti_scraper_solution.create_app()
+    parsers = {
+        'application/json': lambda body: json.loads(body),
+        anti_scraper_solution.COMPACT_CHECK_MIMETYPE: anti_scraper_solution.decode_compact_check,
+    }
+
+    # Math challenges are not spent, so one body per format can answer every check
+    challenge, _ = anti_scraper_solution.issue_signed_challenge(difficulty=1)
+    bodies = {
+        label: capture_body(args.node, snippet, challenge, formats)
+        for label, formats in (('json', ['json']), ('compact', ['json', 'packed']))
+    }
+
+    # Alternate the formats so both see the same server state
+    request_times = {label: [] for label in bodies}
+    client = app.test_client()
+    for i in range(args.requests):
+        for label, (content_type, body) in bodies.items():
+            started = time.perf_counter()
+            response = client.post(
+                '/bot-detection/check', data=body, content_type=content_type,
+                headers=HEADERS, environ_base={'REMOTE_ADDR': f"10.1.{i // 256 % 256}.{i % 256}"},
+            )
+            request_times[label].append(time.perf_counter() - started)
+            token = response.get_json().get('token', '')
+            if not anti_scraper_solution.verify_protection_token(token):
+                raise SystemExit(f"the {label} check did not earn a token: {response.get_data(as_text=True)}")
+
+    print(f"{'format':<8} {'bytes':>6} {'parse us':>9} {'check ms':>9}")
+    for label, (content_type, body) in bodies.items():
+        parse = best_us(parsers[content_type], body, args.iterations, args.repeat)
+        print(f"{label:<8} {len(body):>6} {parse:>9.1f} {statistics.median(request_times[label]) * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()